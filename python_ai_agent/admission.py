@@ -0,0 +1,266 @@
+"""
+Admission Module - Concurrency limit and per-store fair queuing for model calls
+Every Gemini call takes a slot from a global pool. When the pool is full,
+callers wait in a bounded queue ordered by weighted start-time fair queuing:
+each store's waiters get virtual start tags spaced 1/weight apart, so one
+busy store cannot starve the others. A full queue rejects immediately with
+a retry hint, and waiters whose deadline passes are dropped. Synchronous
+callers on worker threads queue in the same pool through slot_blocking.
+"""
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from threading import Event, Lock
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", 64))
+# Longest a call may wait for a slot; clients have usually given up by then
+LLM_QUEUE_DEADLINE = float(os.getenv("LLM_QUEUE_DEADLINE_SECONDS", 30))
+# "store-a.myshopify.com=3,store-b.myshopify.com=0.5"; unlisted stores weigh 1
+LLM_STORE_WEIGHTS = os.getenv("LLM_STORE_WEIGHTS", "")
+
+_request_deadline = ContextVar("llm_request_deadline", default=None)
+
+
+def set_request_deadline(timeout_seconds: float):
+    """Bound how long model calls made for the current request may queue"""
+    _request_deadline.set(time.monotonic() + timeout_seconds)
+
+
+def _parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in spec.split(","):
+        store, _, weight = item.strip().partition("=")
+        try:
+            if store and float(weight) > 0:
+                weights[store] = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring invalid LLM store weight: {item}")
+    return weights
+
+
+class AdmissionRejected(Exception):
+    """The model queue is full; retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTimeout(AdmissionRejected):
+    """A queued call's deadline passed before a slot freed up"""
+
+
+class _Waiter:
+    """A queued call: woken through its event loop, or through an Event on a worker thread"""
+    __slots__ = ("store", "loop", "future", "event", "state", "enqueued_at")
+
+    def __init__(self, store: str, loop: asyncio.AbstractEventLoop = None):
+        self.store = store
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = Event() if loop is None else None
+        # "waiting", then "granted" or "abandoned"; changed only under the scheduler lock
+        self.state = "waiting"
+        self.enqueued_at = time.perf_counter()
+
+    def wake(self) -> bool:
+        if self.loop is None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+            return True
+        except RuntimeError:
+            # Its event loop is closed; nobody is left to use the slot
+            return False
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """Global model-call slots handed out in weighted fair order across stores"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, queue_limit: int = LLM_QUEUE_LIMIT,
+                 deadline: float = LLM_QUEUE_DEADLINE, weights: dict = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_limit = queue_limit
+        self.deadline = deadline
+        self.weights = _parse_weights(LLM_STORE_WEIGHTS) if weights is None else weights
+        self._heap = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag = {}
+        self._in_flight = 0
+        self._queued = Counter()
+        self._service_ms = 1000.0
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0, "expired": 0}
+        self.max_queue_depth = 0
+        # Async callers and worker threads share the pool
+        self._lock = Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued.values())
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained"""
+        backlog = self.queue_depth + self._in_flight
+        return max(1, math.ceil(backlog / self.max_concurrency * self._service_ms / 1000))
+
+    def _admit_or_enqueue(self, store: str, loop: asyncio.AbstractEventLoop = None):
+        """None if a slot was free, else the queued waiter; raises when the queue is full"""
+        with self._lock:
+            if self._in_flight < self.max_concurrency and self.queue_depth == 0:
+                self._in_flight += 1
+                self._counters["admitted"] += 1
+                admitted = True
+            elif self.queue_depth >= self.queue_limit:
+                self._counters["rejected"] += 1
+                raise AdmissionRejected("Model queue is full", self.retry_after())
+            else:
+                admitted = False
+                weight = self.weights.get(store, 1.0)
+                tag = max(self._virtual_time, self._last_tag.get(store, 0.0)) + 1.0 / weight
+                self._last_tag[store] = tag
+                waiter = _Waiter(store, loop)
+                heapq.heappush(self._heap, (tag, next(self._sequence), waiter))
+                self._queued[store] += 1
+                self._counters["queued"] += 1
+                self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        if admitted:
+            metrics.record_stage("llm_queue_wait", 0.0)
+            return None
+        self._dispatch()
+        return waiter
+
+    def _dequeued(self, waiter: _Waiter):
+        # Callers hold self._lock
+        self._queued[waiter.store] -= 1
+        if self._queued[waiter.store] <= 0:
+            del self._queued[waiter.store]
+
+    def _dispatch(self):
+        """Hand free slots to the waiters with the smallest virtual start tags"""
+        while True:
+            with self._lock:
+                if self._in_flight >= self.max_concurrency or not self._heap:
+                    return
+                tag, _, waiter = heapq.heappop(self._heap)
+                if waiter.state != "waiting":
+                    # Timed out or cancelled; already accounted for
+                    continue
+                self._dequeued(waiter)
+                self._virtual_time = tag
+                self._in_flight += 1
+                waiter.state = "granted"
+            if not waiter.wake():
+                with self._lock:
+                    self._in_flight -= 1
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter; False if a slot was granted to it first"""
+        with self._lock:
+            if waiter.state == "granted":
+                return False
+            waiter.state = "abandoned"
+            self._dequeued(waiter)
+            return True
+
+    def _timeout(self, deadline: float = None) -> float:
+        deadline = deadline or _request_deadline.get()
+        return self.deadline if deadline is None else min(self.deadline, max(0.0, deadline - time.monotonic()))
+
+    def _expired(self):
+        with self._lock:
+            self._counters["expired"] += 1
+        raise AdmissionTimeout("Timed out waiting for a model slot", self.retry_after())
+
+    def _admitted(self, waiter: _Waiter):
+        with self._lock:
+            self._counters["admitted"] += 1
+        metrics.record_stage("llm_queue_wait", (time.perf_counter() - waiter.enqueued_at) * 1000)
+
+    async def acquire(self, store: str, deadline: float = None):
+        """Wait for a slot; raises AdmissionRejected when the queue is full or the wait runs out"""
+        waiter = self._admit_or_enqueue(store, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._timeout(deadline))
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                self._expired()
+            # The slot arrived as the deadline passed; keep it
+        except asyncio.CancelledError:
+            # The caller gave up (client disconnected); pass on a slot granted meanwhile
+            if not self._give_up(waiter):
+                self.release()
+            raise
+        self._admitted(waiter)
+
+    def acquire_blocking(self, store: str, deadline: float = None):
+        """acquire for synchronous callers on worker threads"""
+        waiter = self._admit_or_enqueue(store)
+        if waiter is None:
+            return
+        if not waiter.event.wait(self._timeout(deadline)) and self._give_up(waiter):
+            self._expired()
+        self._admitted(waiter)
+
+    def release(self, service_ms: float = None):
+        with self._lock:
+            self._in_flight -= 1
+            if service_ms is not None:
+                # Smoothed model-call time, used for Retry-After estimates
+                self._service_ms = 0.8 * self._service_ms + 0.2 * service_ms
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, store: str, deadline: float = None):
+        """Hold one model-call slot for the duration of the block"""
+        await self.acquire(store, deadline)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release((time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def slot_blocking(self, store: str, deadline: float = None):
+        """slot for synchronous callers; blocks the calling thread while queued"""
+        self.acquire_blocking(store, deadline)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "queue_limit": self.queue_limit,
+                "queued_by_store": dict(self._queued.most_common(10))
+            }
+
+
+# Singleton instance
+llm_scheduler = LLMScheduler()
@@ -2,9 +2,25 @@ import os
 import json
 import logging
 import hashlib
-from datetime import datetime, timedelta
+import asyncio
+import threading
+import time
 import google.generativeai as genai
-from shopify_client import ShopifyClient
+from shopify_client import ShopifyClient, AsyncShopifyClient, store_domain_for
+from analytics import summarize_store_data, dataset_responses
+from prompt_packing import pack_store_data, PROMPT_TOKEN_BUDGET
+from fetch_planner import build_plan, plan_datasets, fetch_planner, FetchPlan, DATASETS
+from snapshot import SnapshotReader, AsyncSnapshotReader, SNAPSHOT_ENABLED
+from webhooks import webhook_receiver
+from answer_reuse import answer_reuse, data_fingerprint
+from admission import llm_scheduler, AdmissionRejected
+from cache import answer_cache, call_async, STALE
+from canonical import canonicalize, canonical_key, parse_question, semantic_index, SEMANTIC_CACHE
+from singleflight import SingleFlight, AsyncSingleFlight
+from tracing import span, set_attribute, record_value
+from prompt_packing import estimate_tokens
+from conversation import ConversationMemory, refers_back
+from metrics import metrics
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,71 +31,233 @@ genai.configure(api_key=GEMINI_API_KEY)
 
 logger = logging.getLogger(__name__)
 
-# Simple in-memory cache (in production, use Redis)
-query_cache = {}
-CACHE_TTL = 300  # 5 minutes
+# How much history to pull per question
+ORDERS_DAYS_BACK = int(os.getenv("ORDERS_DAYS_BACK", 30))
+MAX_FETCH_PAGES = int(os.getenv("SHOPIFY_MAX_PAGES", 10))
+
+# Measure packed prompts with Gemini's tokenizer (one extra API call) instead of the local estimate
+EXACT_TOKEN_COUNT = os.getenv("EXACT_TOKEN_COUNT", "false").lower() == "true"
+
+# How long a follow-up on the same agent may reuse the data its previous question fetched
+FOLLOWUP_DATA_TTL = float(os.getenv("FOLLOWUP_DATA_TTL", 120))
+
+# Questions answered together in one structured multi-answer model call
+BATCH_QUESTIONS_PER_CALL = int(os.getenv("BATCH_QUESTIONS_PER_CALL", 5))
+
+ANALYSIS_FALLBACK_ANSWER = (
+    "I was able to retrieve your store data, but had trouble analyzing it. "
+    "Please try asking a more specific question."
+)
+
+# Strong references to in-flight stale-while-revalidate refreshes
+_refresh_tasks = set()
+
+# Concurrent misses for the same store and canonical question share one analysis
+analysis_flight = SingleFlight()
+async_analysis_flight = AsyncSingleFlight()
+
+
+def _record_cache_outcome(outcome: str):
+    """Tag the current trace and count a cache outcome (hit, stale, miss, coalesced, bypass)"""
+    set_attribute("cache", outcome)
+    metrics.record_cache_outcome(outcome)
 
 class AnalyticsAgent:
-    def __init__(self, store_id: str, conversation_history=None):
-        self.client = ShopifyClient(
-            store_domain=os.getenv("SHOPIFY_STORE_URL"),
-            access_token=os.getenv("SHOPIFY_ACCESS_TOKEN")
-        )
+    def __init__(self, store_id: str, conversation_history=None, access_token: str = None, stateful: bool = True):
+        store_domain = store_domain_for(store_id)
+        access_token = access_token or os.getenv("SHOPIFY_ACCESS_TOKEN")
+        self.client = ShopifyClient(store_domain=store_domain, access_token=access_token)
+        # Pooled non-blocking client used by process_question_async
+        self.async_client = AsyncShopifyClient(store_domain=store_domain, access_token=access_token)
+        # Orders and products are read from the local snapshot, kept current by incremental sync
+        if SNAPSHOT_ENABLED:
+            self.data_source = SnapshotReader(self.client)
+            self.async_data_source = AsyncSnapshotReader(self.async_client, bulk_client=self.client)
+        else:
+            self.data_source = self.client
+            self.async_data_source = self.async_client
         self.model = genai.GenerativeModel('gemini-2.5-flash')
         self.store_id = store_id
-        # Conversation memory for follow-up questions
-        self.conversation_history = conversation_history or []
+        # Conversation memory for follow-up questions, bounded by CONVERSATION_TOKEN_BUDGET
+        if isinstance(conversation_history, ConversationMemory):
+            self.conversation_history = conversation_history
+        else:
+            self.conversation_history = ConversationMemory(conversation_history)
+        # (fetched_at, plan, raw_data) of the last successful fetch, reused by follow-ups
+        self._last_fetch = None
+        # A stateless agent is shared by one-off requests: it keeps no turns and no recent fetch
+        self.stateful = stateful
+
+    def canonical_question(self, question: str):
+        """Structured form of the question (intent, window, top-N, metric, focus words)"""
+        return canonicalize(question, self.classify_intent(question))
 
     def get_cache_key(self, question: str) -> str:
-        """Generate cache key for question"""
-        return hashlib.md5(f"{self.store_id}:{question}".encode()).hexdigest()
+        """Generate cache key for question, shared by all of its paraphrases"""
+        key = canonical_key(self.canonical_question(question))
+        return hashlib.md5(f"{self.store_id}:{key}".encode()).hexdigest()
 
     def get_cached_result(self, question: str):
-        """Check if result is cached"""
-        cache_key = self.get_cache_key(question)
-        if cache_key in query_cache:
-            cached_data, timestamp = query_cache[cache_key]
-            if datetime.now() - timestamp < timedelta(seconds=CACHE_TTL):
-                logger.info(f"Cache HIT for question: {question[:50]}...")
-                return cached_data
-            else:
-                del query_cache[cache_key]
-        return None
+        """
+        Check if result is cached.
+        Returns (result, is_stale); stale results should be served while a
+        background refresh replaces them.
+        """
+        with span("cache_lookup"):
+            cache_key = self.get_cache_key(question)
+            cached_data, state = answer_cache.get(cache_key)
+            if cached_data is None and SEMANTIC_CACHE:
+                similar_key = semantic_index.lookup(self.store_id, self.canonical_question(question))
+                if similar_key:
+                    cached_data, state = answer_cache.get(similar_key)
+        if cached_data is None:
+            return None, False
+        _record_cache_outcome("stale" if state == STALE else "hit")
+        logger.info(f"Cache {'STALE ' if state == STALE else ''}HIT for question: {question[:50]}...")
+        return {**cached_data, "cached": True}, state == STALE
 
     def cache_result(self, question: str, result: dict):
         """Store result in cache"""
         cache_key = self.get_cache_key(question)
-        query_cache[cache_key] = (result, datetime.now())
+        store = self.client.store_domain
+        ttl = webhook_receiver.answer_ttl(store)
+        answer_cache.set(cache_key, result, ttl=ttl)
+        # Remember what the answer was built from so webhooks can invalidate it
+        webhook_receiver.track(store, cache_key, plan_datasets(result.get("intent"), question), ttl=ttl)
+        if SEMANTIC_CACHE:
+            semantic_index.add(self.store_id, self.canonical_question(question), cache_key)
         logger.info(f"Cached result for question: {question[:50]}...")
 
+    async def get_cached_result_async(self, question: str):
+        """get_cached_result without blocking the event loop on a Redis or SQLite backend"""
+        return await call_async(answer_cache, self.get_cached_result, question)
+
+    async def cache_result_async(self, question: str, result: dict):
+        await call_async(answer_cache, self.cache_result, question, result)
+
+    def _refresh(self, question: str):
+        """Recompute a stale answer; runs on a background thread"""
+        try:
+            analysis_flight.do(self.get_cache_key(question), lambda: self._answer(question))
+        except Exception as e:
+            logger.error(f"Background refresh failed: {e}")
+        finally:
+            answer_cache.end_refresh(self.get_cache_key(question))
+
+    async def _start_refresh_async(self, question: str):
+        """Refresh a stale answer in the background, unless a refresh of it is already running"""
+        if await call_async(answer_cache, answer_cache.begin_refresh, self.get_cache_key(question)):
+            task = asyncio.create_task(self._refresh_async(question))
+            _refresh_tasks.add(task)
+            task.add_done_callback(_refresh_tasks.discard)
+
+    async def _refresh_async(self, question: str):
+        """Recompute a stale answer without holding up the request that found it"""
+        try:
+            await async_analysis_flight.do(self.get_cache_key(question), lambda: self._answer_async(question))
+        except Exception as e:
+            logger.error(f"Background refresh failed: {e}")
+        finally:
+            await call_async(answer_cache, answer_cache.end_refresh, self.get_cache_key(question))
+
     def classify_intent(self, question: str) -> str:
-        """Classify the user's question intent"""
-        question_lower = question.lower()
-        
-        if any(word in question_lower for word in ['sell', 'sold', 'sales', 'revenue', 'top', 'best']):
-            return 'sales_analysis'
-        elif any(word in question_lower for word in ['inventory', 'stock', 'reorder', 'out of stock']):
-            return 'inventory_check'
-        elif any(word in question_lower for word in ['product', 'item']):
-            return 'product_info'
-        elif any(word in question_lower for word in ['order', 'recent']):
-            return 'order_info'
-        else:
-            return 'general'
+        """Classify the user's question intent (one cached pass of the question matcher)"""
+        return parse_question(question).intent
+
+    def fetch_plan(self, intent: str, question: str = ""):
+        """Every dataset the question needs, e.g. orders and inventory for reorder questions"""
+        return build_plan(intent, question, ORDERS_DAYS_BACK, MAX_FETCH_PAGES)
 
-    def fetch_relevant_data(self, intent: str) -> dict:
+    def fetch_relevant_data(self, intent: str, question: str = "") -> dict:
         """Fetch data from Shopify based on intent"""
-        logger.info(f"Fetching data for intent: {intent}")
-        
-        if intent in ['sales_analysis', 'order_info']:
-            return self.client.get_orders(first=100)
-        elif intent in ['inventory_check', 'product_info']:
-            return self.client.get_products(first=100)
-        else:
-            # Fetch both for general questions
-            orders = self.client.get_orders(first=50)
-            products = self.client.get_products(first=50)
-            return {"orders": orders, "products": products}
+        plan = self.fetch_plan(intent, question)
+        recent = self._recent_data(plan)
+        if recent is not None:
+            return recent
+        logger.info(f"Fetching {', '.join(plan.datasets)} for intent: {intent}")
+        return self._remember_fetch(plan, fetch_planner.execute(self.data_source, plan))
+
+    async def fetch_relevant_data_async(self, intent: str, question: str = "") -> dict:
+        """Async counterpart of fetch_relevant_data"""
+        plan = self.fetch_plan(intent, question)
+        recent = self._recent_data(plan)
+        if recent is not None:
+            return recent
+        logger.info(f"Fetching {', '.join(plan.datasets)} for intent: {intent}")
+        return self._remember_fetch(plan, await fetch_planner.execute_async(self.async_data_source, plan))
+
+    @staticmethod
+    def _data_for(raw_data: dict, datasets) -> dict:
+        """The part of a multi-dataset fetch covering `datasets`, shaped like a fetch of just those"""
+        data = {name: raw_data[name] for name in datasets if name in raw_data}
+        for marker in ("unavailable", "pending"):
+            notes = {name: note for name, note in raw_data.get(marker, {}).items() if name in datasets}
+            if data and notes:
+                data[marker] = notes
+        return data
+
+    def _remember_fetch(self, plan, raw_data: dict) -> dict:
+        if self.stateful and "error" not in raw_data and "errors" not in raw_data and not raw_data.get("pending"):
+            self._last_fetch = (time.monotonic(), plan, raw_data)
+        return raw_data
+
+    @staticmethod
+    def _complete(data: dict) -> bool:
+        """False while a snapshot load is still filling in the data; such answers are not cached"""
+        return not (isinstance(data, dict) and data.get("pending"))
+
+    def _recent_data(self, plan):
+        """Data a follow-up can reuse from the previous question's fetch, or None"""
+        if self._last_fetch is None:
+            return None
+        fetched_at, previous, raw_data = self._last_fetch
+        # Full records (no query plan) cover any projection; planned ones only the same plan
+        previous_queries, queries = previous.queries or {}, plan.queries or {}
+        if (time.monotonic() - fetched_at > FOLLOWUP_DATA_TTL
+                or (plan.days_back, plan.max_pages) != (previous.days_back, previous.max_pages)
+                or not set(plan.datasets) <= set(previous.datasets)
+                or not set(plan.focus) <= set(previous.focus)
+                or any(previous_queries.get(name) not in (None, queries.get(name)) for name in plan.datasets)):
+            return None
+        data = self._data_for(raw_data, plan.datasets)
+        if not data:
+            return None
+        logger.info(f"Reusing {', '.join(plan.datasets)} fetched {time.monotonic() - fetched_at:.0f}s ago")
+        set_attribute("fetch", "reused")
+        return data
+
+    def _build_context(self) -> str:
+        """Summarize earlier exchanges for follow-up questions"""
+        return self.conversation_history.context()
+
+    def _context_for(self, question: str) -> str:
+        """Conversation context if the question refers back to it; standalone questions share the cache"""
+        return self._build_context() if refers_back(question) else ""
+
+    def _check_fetch_errors(self, raw_data: dict):
+        """Return an error response if the Shopify fetch failed, else None"""
+        if "error" in raw_data:
+            return {
+                "error": "Failed to fetch data from Shopify",
+                "details": raw_data.get("error", "Unknown error"),
+                "suggestion": "Please check your Shopify API credentials."
+            }
+
+        if "errors" in raw_data:
+            return {
+                "error": "Shopify API returned errors",
+                "details": str(raw_data["errors"]),
+                "suggestion": "Please check your API permissions."
+            }
+        return None
+
+    def _connection_error(self, e: Exception) -> dict:
+        logger.error(f"Shopify API error: {e}")
+        return {
+            "error": "Failed to connect to Shopify",
+            "details": str(e),
+            "suggestion": "Check your store URL and access token."
+        }
 
     def process_question(self, user_question: str):
         """
@@ -90,111 +268,592 @@ class AnalyticsAgent:
         4. Use LLM to analyze and explain
         """
         
+        # --- Build conversation context ---
+        context = self._context_for(user_question)
+        if context:
+            # Follow-ups are answered for this conversation only, never shared through the cache
+            _record_cache_outcome("bypass")
+            result = self._answer(user_question, context)
+            self._remember_turn(user_question, result)
+            return result
+
         # --- Check Cache ---
-        cached_result = self.get_cached_result(user_question)
+        cached_result, is_stale = self.get_cached_result(user_question)
         if cached_result:
+            if is_stale and answer_cache.begin_refresh(self.get_cache_key(user_question)):
+                threading.Thread(target=self._refresh, args=(user_question,), daemon=True).start()
+            self._remember_turn(user_question, cached_result)
             return cached_result
-        
-        # --- Build conversation context ---
-        context = ""
-        if self.conversation_history:
-            context = "\n".join([
-                f"Previous Q: {item['question']}\nA: {item['answer'][:200]}..."
-                for item in self.conversation_history[-3:]
-            ])
+
+        cache_key = self.get_cache_key(user_question)
+        _record_cache_outcome("coalesced" if analysis_flight.in_flight(cache_key) else "miss")
+        result = analysis_flight.do(cache_key, lambda: self._answer(user_question))
+        self._remember_turn(user_question, result)
+        return result
+
+    def _answer(self, user_question: str, context: str = "") -> dict:
+        """Answer a question from fresh Shopify data; answers without conversation context are cached"""
         
         # --- Classify Intent ---
-        intent = self.classify_intent(user_question)
+        with span("classify_intent"):
+            intent = self.classify_intent(user_question)
         logger.info(f"Classified intent: {intent}")
         
         # --- Fetch Data from Shopify ---
         try:
-            raw_data = self.fetch_relevant_data(intent)
+            with span("fetch_data"):
+                raw_data = self.fetch_relevant_data(intent, user_question)
             
             # Check for errors
-            if "error" in raw_data:
-                return {
-                    "error": "Failed to fetch data from Shopify",
-                    "details": raw_data.get("error", "Unknown error"),
-                    "suggestion": "Please check your Shopify API credentials."
-                }
-            
-            if "errors" in raw_data:
-                return {
-                    "error": "Shopify API returned errors",
-                    "details": str(raw_data["errors"]),
-                    "suggestion": "Please check your API permissions."
-                }
+            fetch_error = self._check_fetch_errors(raw_data)
+            if fetch_error:
+                return fetch_error
                 
         except Exception as e:
-            logger.error(f"Shopify API error: {e}")
-            return {
-                "error": "Failed to connect to Shopify",
-                "details": str(e),
-                "suggestion": "Check your store URL and access token."
-            }
+            return self._connection_error(e)
         
         # --- Analyze with LLM ---
         result = self._analyze_and_respond(user_question, raw_data, intent, context)
         
         # Cache the result
-        self.cache_result(user_question, result)
+        if not context and self._complete(raw_data):
+            self.cache_result(user_question, result)
         
         return result
+
+    async def process_question_async(self, user_question: str):
+        """
+        Non-blocking version of process_question: the Shopify fetch and the
+        Gemini call are awaited so the event loop can serve other requests.
+        """
+        context = self._context_for(user_question)
+        if context:
+            _record_cache_outcome("bypass")
+            result = await self._answer_async(user_question, context)
+            self._remember_turn(user_question, result)
+            return result
+
+        cached_result, is_stale = await self.get_cached_result_async(user_question)
+        if cached_result:
+            if is_stale:
+                await self._start_refresh_async(user_question)
+            self._remember_turn(user_question, cached_result)
+            return cached_result
+
+        cache_key = self.get_cache_key(user_question)
+        _record_cache_outcome("coalesced" if async_analysis_flight.in_flight(cache_key) else "miss")
+        result = await async_analysis_flight.do(cache_key, lambda: self._answer_async(user_question))
+        self._remember_turn(user_question, result)
+        return result
+
+    async def _answer_async(self, user_question: str, context: str = "") -> dict:
+        """Async counterpart of _answer"""
+        with span("classify_intent"):
+            intent = self.classify_intent(user_question)
+        logger.info(f"Classified intent: {intent}")
+
+        try:
+            with span("fetch_data"):
+                raw_data = await self.fetch_relevant_data_async(intent, user_question)
+            fetch_error = self._check_fetch_errors(raw_data)
+            if fetch_error:
+                return fetch_error
+        except Exception as e:
+            return self._connection_error(e)
+
+        result = await self._analyze_and_respond_async(user_question, raw_data, intent, context)
+        if not context and self._complete(raw_data):
+            await self.cache_result_async(user_question, result)
+        return result
     
-    def _analyze_and_respond(self, question: str, data: dict, intent: str, context: str) -> dict:
-        """Use LLM to analyze data and generate response"""
-        
-        # Prepare a summary of the data (limit size for LLM)
-        data_summary = json.dumps(data, indent=2)[:8000]  # Limit to 8k chars
+    def _data_slice(self, question: str, data: dict, intent: str, figures: dict = None) -> tuple:
+        """The serialized data the model sees: (figures JSON, packed records)"""
+        # Do the arithmetic locally; the model only explains exact figures
+        if figures is None:
+            with span("aggregate"):
+                figures = summarize_store_data(data)
+        with span("pack_prompt"):
+            data_summary = json.dumps(figures, separators=(",", ":"), sort_keys=True)
+            records = pack_store_data(
+                data, intent, question,
+                token_budget=PROMPT_TOKEN_BUDGET,
+                count_tokens=self._count_tokens if EXACT_TOKEN_COUNT else None
+            )
+        return data_summary, records
+
+    async def _data_slice_async(self, question: str, data: dict, intent: str, figures: dict = None) -> tuple:
+        """_data_slice for async paths; exact token counts call the model's tokenizer, so run off the loop"""
+        if EXACT_TOKEN_COUNT:
+            return await asyncio.to_thread(self._data_slice, question, data, intent, figures)
+        return self._data_slice(question, data, intent, figures)
+
+    def _fingerprint(self, question: str, intent: str, data_slice: tuple, context: str = "") -> str:
+        """Identity of an answer: canonical question, intent, the exact data slice and conversation context"""
+        fingerprint = data_fingerprint(canonical_key(self.canonical_question(question)), intent, *data_slice, context)
+        set_attribute("data_fingerprint", fingerprint[:16])
+        return fingerprint
+
+    def _reused_answer(self, question: str, intent: str, fingerprint: str):
+        """Finished result built from an earlier answer to the identical data slice, if any"""
+        reused = answer_reuse.get(fingerprint, intent)
+        if reused is None:
+            return None
+        logger.info(f"Reusing answer for unchanged data: {question[:50]}...")
+        return self._finish_answer(question, reused["answer"], intent, reused["confidence"])
+
+    async def _reused_answer_async(self, question: str, intent: str, fingerprint: str):
+        return await call_async(answer_reuse.cache, self._reused_answer, question, intent, fingerprint)
+
+    @staticmethod
+    async def _store_answer_async(fingerprint: str, answer: str, confidence: str, intent: str):
+        await call_async(answer_reuse.cache, answer_reuse.put, fingerprint, answer, confidence, intent)
+
+    def _build_analysis_prompt(self, question: str, data: dict, intent: str, context: str,
+                               figures: dict = None, data_slice: tuple = None) -> str:
+        """Build the analysis prompt sent to the LLM"""
+        data_summary, records = data_slice or self._data_slice(question, data, intent, figures)
+        records_block = f"Most relevant individual records:\n{records}\n" if records else ""
+        context_block = f"Previous conversation:\n{context}\n" if context else ""
         
-        analysis_prompt = f"""
+        prompt = f"""
         You are a helpful Shopify business analyst assistant.
         
         User Question: "{question}"
         Intent: {intent}
         
-        {f"Previous conversation:\\n{context}\\n" if context else ""}
+        {context_block}
         
-        Here is the store data from Shopify:
+        Here are figures computed from all fetched store data. They are exact;
+        quote them as-is rather than recalculating:
         {data_summary}
         
+        {records_block}
+        
         INSTRUCTIONS:
-        1. Analyze the data to answer the user's question
+        1. Analyze the figures to answer the user's question
         2. Provide specific numbers and insights
-        3. For sales questions: identify top products by quantity or revenue
-        4. For inventory questions: identify low stock items
+        3. For sales questions: use the top products by quantity or revenue
+        4. For inventory questions: use the low stock list
         5. Be conversational and business-friendly
-        6. If data is insufficient, say so and suggest what might help
+        6. If data is insufficient or listed as unavailable, say so and suggest what might help
         7. NEVER mention technical terms like JSON, GraphQL, API, edges, nodes, etc.
         8. Format large numbers nicely (e.g., $1,234.56)
         
         Provide a clear, actionable answer:
         """
+        record_value("prompt_chars", len(prompt))
+        record_value("prompt_tokens_estimate", estimate_tokens(prompt))
+        return prompt
+
+    def _analyze_and_respond(self, question: str, data: dict, intent: str, context: str) -> dict:
+        """Use LLM to analyze data and generate response"""
+        data_slice = self._data_slice(question, data, intent)
+        fingerprint = self._fingerprint(question, intent, data_slice, context)
+        reused = self._reused_answer(question, intent, fingerprint)
+        if reused is not None:
+            return reused
+        analysis_prompt = self._build_analysis_prompt(question, data, intent, context, data_slice=data_slice)
+
+        # Same model-call pool as the async paths; raises AdmissionRejected when it is saturated
+        with llm_scheduler.slot_blocking(self.client.store_domain):
+            try:
+                with span("llm_generate"):
+                    response = self.model.generate_content(analysis_prompt)
+                answer = response.text
+                confidence = self._confidence(data)
+                answer_reuse.put(fingerprint, answer, confidence, intent)
+
+            except Exception as e:
+                logger.error(f"LLM analysis failed: {e}")
+                answer = ANALYSIS_FALLBACK_ANSWER
+                confidence = "low"
         
-        try:
-            response = self.model.generate_content(analysis_prompt)
-            answer = response.text
-            
-            # Determine confidence based on data quality
-            confidence = "high"
-            if not data or (isinstance(data, dict) and not data.get("data")):
+        return self._finish_answer(question, answer, intent, confidence)
+
+    async def _analyze_and_respond_async(self, question: str, data: dict, intent: str, context: str) -> dict:
+        """Async counterpart of _analyze_and_respond using Gemini's async API"""
+        data_slice = await self._data_slice_async(question, data, intent)
+        fingerprint = self._fingerprint(question, intent, data_slice, context)
+        reused = await self._reused_answer_async(question, intent, fingerprint)
+        if reused is not None:
+            return reused
+        analysis_prompt = self._build_analysis_prompt(question, data, intent, context, data_slice=data_slice)
+
+        # Raises AdmissionRejected (surfaced as 429) instead of piling onto a saturated model
+        async with llm_scheduler.slot(self.client.store_domain):
+            try:
+                with span("llm_generate"):
+                    response = await self.model.generate_content_async(analysis_prompt)
+                answer = response.text
+                confidence = self._confidence(data)
+                await self._store_answer_async(fingerprint, answer, confidence, intent)
+            except Exception as e:
+                logger.error(f"LLM analysis failed: {e}")
+                answer = ANALYSIS_FALLBACK_ANSWER
                 confidence = "low"
-            
+
+        return self._finish_answer(question, answer, intent, confidence)
+
+    async def stream_question(self, user_question: str):
+        """
+        Streaming variant of process_question_async.
+        Yields (event, payload) pairs: "meta" with the intent and computed
+        figures as soon as they are known, "token" for each answer chunk as
+        Gemini produces it, then "done" with the full result (which is added to
+        conversation history and, unless it is a follow-up, cached), or "error".
+        A stream asking what another request is already answering waits for
+        that answer and sends it as a single token.
+        """
+        context = self._context_for(user_question)
+        if not context:
+            cached_result, is_stale = await self.get_cached_result_async(user_question)
+            if cached_result:
+                if is_stale:
+                    await self._start_refresh_async(user_question)
+                yield "meta", {"intent": cached_result.get("intent"), "cached": True}
+                yield "token", {"text": cached_result["answer"]}
+                self._remember_turn(user_question, cached_result)
+                yield "done", cached_result
+                return
+
+        events = asyncio.Queue()
+
+        async def answer():
+            try:
+                return await self._stream_answer(user_question, context, events.put_nowait)
+            finally:
+                events.put_nowait(None)
+
+        if context:
+            _record_cache_outcome("bypass")
+            task, leader = asyncio.ensure_future(answer()), True
+        else:
+            # Identical streams and requests arriving meanwhile share this answer
+            task, leader = async_analysis_flight.join(self.get_cache_key(user_question), answer)
+            _record_cache_outcome("miss" if leader else "coalesced")
+
+        try:
+            if leader:
+                # The answer keeps going for coalesced callers if this client disconnects
+                task.add_done_callback(lambda done: done.cancelled() or done.exception())
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    yield event
+            result = await asyncio.shield(task)
+            if not leader and "error" not in result:
+                yield "meta", {"intent": result.get("intent"), "cached": False}
+                yield "token", {"text": result["answer"]}
+        except AdmissionRejected as e:
+            yield "error", {"error": str(e), "retry_after": e.retry_after}
+            return
+        if "error" in result:
+            yield "error", result
+            return
+        self._remember_turn(user_question, result)
+        yield "done", result
+
+    async def _stream_answer(self, user_question: str, context: str, emit) -> dict:
+        """
+        _answer_async that also passes ("meta" | "token", payload) events to
+        `emit` as they happen; returns the same result (or error) dict
+        """
+        with span("classify_intent"):
+            intent = self.classify_intent(user_question)
+        logger.info(f"Classified intent: {intent}")
+
+        try:
+            with span("fetch_data"):
+                raw_data = await self.fetch_relevant_data_async(intent, user_question)
+            fetch_error = self._check_fetch_errors(raw_data)
+        except Exception as e:
+            fetch_error = self._connection_error(e)
+        if fetch_error:
+            return fetch_error
+
+        with span("aggregate"):
+            figures = summarize_store_data(raw_data)
+        emit(("meta", {"intent": intent, "cached": False, "figures": figures}))
+
+        data_slice = await self._data_slice_async(user_question, raw_data, intent, figures)
+        fingerprint = self._fingerprint(user_question, intent, data_slice, context)
+        reused = await self._reused_answer_async(user_question, intent, fingerprint)
+        if reused is not None:
+            emit(("token", {"text": reused["answer"]}))
+            if not context and self._complete(raw_data):
+                await self.cache_result_async(user_question, reused)
+            return reused
+
+        analysis_prompt = self._build_analysis_prompt(user_question, raw_data, intent, context, data_slice=data_slice)
+        await llm_scheduler.acquire(self.client.store_domain)
+        chunks = []
+        llm_start = time.perf_counter()
+        try:
+            response = await self.model.generate_content_async(analysis_prompt, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    emit(("token", {"text": chunk.text}))
+            metrics.record_stage("llm_generate", (time.perf_counter() - llm_start) * 1000)
+            answer = "".join(chunks)
+            confidence = self._confidence(raw_data)
+            await self._store_answer_async(fingerprint, answer, confidence, intent)
         except Exception as e:
             logger.error(f"LLM analysis failed: {e}")
-            answer = "I was able to retrieve your store data, but had trouble analyzing it. Please try asking a more specific question."
+            answer = "".join(chunks) or ANALYSIS_FALLBACK_ANSWER
+            if not chunks:
+                emit(("token", {"text": answer}))
             confidence = "low"
-        
-        # Store in conversation history
+        finally:
+            llm_scheduler.release((time.perf_counter() - llm_start) * 1000)
+
+        result = self._finish_answer(user_question, answer, intent, confidence)
+        if not context and self._complete(raw_data):
+            await self.cache_result_async(user_question, result)
+        return result
+
+    async def process_batch_async(self, questions: list) -> list:
+        """
+        Answer several questions for this store together. Cached questions are
+        served from the cache; the rest share fetches wherever their date
+        windows and queries agree, and as few model calls as possible (one
+        structured multi-answer prompt per BATCH_QUESTIONS_PER_CALL questions).
+        Every answer is cached individually, as if asked alone, unless the
+        question refers back to earlier turns of the conversation.
+        """
+        contexts = [self._context_for(question) for question in questions]
+        results = [None] * len(questions)
+        pending = []
+        for index, question in enumerate(questions):
+            context = contexts[index]
+            cached_result = None if context else (await self.get_cached_result_async(question))[0]
+            if cached_result:
+                results[index] = cached_result
+            else:
+                _record_cache_outcome("bypass" if context else "miss")
+                with span("classify_intent"):
+                    intent = self.classify_intent(question)
+                pending.append((index, question, intent, self.fetch_plan(intent, question)))
+        if not pending:
+            return self._remember_batch(questions, results)
+
+        # One fetch per group of questions with the same window and compatible queries
+        fetched = {}
+        groups = self._batch_fetch_plans(pending)
+        logger.info(f"Batch of {len(pending)} questions in {len(groups)} fetches")
+        with span("fetch_data"):
+            outcomes = await asyncio.gather(
+                *(fetch_planner.execute_async(self.async_data_source, plan) for plan, _ in groups),
+                return_exceptions=True
+            )
+        for (plan, members), raw_data in zip(groups, outcomes):
+            if isinstance(raw_data, BaseException):
+                if not isinstance(raw_data, Exception):
+                    raise raw_data
+                fetch_error = self._connection_error(raw_data)
+            else:
+                fetch_error = self._check_fetch_errors(self._remember_fetch(plan, raw_data))
+            for index in members:
+                if fetch_error:
+                    results[index] = fetch_error
+                else:
+                    fetched[index] = raw_data
+
+        # Per question: only the datasets it needs, shaped like a lone fetch of them
+        to_generate = []
+        for index, question, intent, plan in pending:
+            if index not in fetched:
+                continue
+            raw_data, needed = fetched[index], plan.datasets
+            data = self._data_for(raw_data, needed)
+            if not data:
+                # Everything this question needs failed, as a lone fetch would have
+                errors = [error for name, error in raw_data.get("unavailable", {}).items() if name in needed]
+                results[index] = self._check_fetch_errors({"error": "; ".join(errors)})
+                continue
+            context = contexts[index]
+            data_slice = await self._data_slice_async(question, data, intent)
+            fingerprint = self._fingerprint(question, intent, data_slice, context)
+            reused = await self._reused_answer_async(question, intent, fingerprint)
+            if reused is not None:
+                results[index] = reused
+                if not context and self._complete(data):
+                    await self.cache_result_async(question, reused)
+            else:
+                to_generate.append((index, question, intent, data, data_slice, fingerprint))
+
+        # Follow-ups and standalone questions go in separate calls, so no cached answer saw the conversation
+        calls = []
+        for context in dict.fromkeys(contexts[item[0]] for item in to_generate):
+            same_context = [item for item in to_generate if contexts[item[0]] == context]
+            calls += [(same_context[start:start + BATCH_QUESTIONS_PER_CALL], context)
+                      for start in range(0, len(same_context), BATCH_QUESTIONS_PER_CALL)]
+        for group, context in calls:
+            try:
+                answers = await self._answer_group_async(group, context)
+            except AdmissionRejected as e:
+                for index, *_ in group:
+                    results[index] = self._rejected(e)
+                continue
+            for index, question, intent, data, _, fingerprint in group:
+                answer = answers.get(index)
+                if answer:
+                    confidence = self._confidence(data)
+                    await self._store_answer_async(fingerprint, answer, confidence, intent)
+                    result = self._finish_answer(question, answer, intent, confidence)
+                else:
+                    # Left out of (or unparseable in) the combined reply; ask on its own
+                    try:
+                        result = await self._analyze_and_respond_async(question, data, intent, context)
+                    except AdmissionRejected as e:
+                        # Keep the answers already made; only this question is shed
+                        results[index] = self._rejected(e)
+                        continue
+                if not context and self._complete(data):
+                    await self.cache_result_async(question, result)
+                results[index] = result
+        return self._remember_batch(questions, results)
+
+    @staticmethod
+    def _rejected(e: AdmissionRejected) -> dict:
+        """Batch entry for a question the model queue had no room for"""
+        return {"error": str(e), "retry_after": e.retry_after}
+
+    def _remember_batch(self, questions: list, results: list) -> list:
+        """Record every answered batch question as a turn, in the order asked"""
+        for question, result in zip(questions, results):
+            self._remember_turn(question, result)
+        return results
+
+    @staticmethod
+    def _batch_fetch_plans(pending: list) -> list:
+        """
+        [(FetchPlan, [question index, ...])]: questions share a fetch only when
+        their date windows match and every dataset they have in common uses the
+        same query, so each answer is built from exactly what a lone fetch returns
+        """
+        groups = []
+        for index, _, _, plan in pending:
+            wanted = {name: (plan.queries or {}).get(name) for name in plan.datasets}
+            for days_back, queries, focus, members in groups:
+                if days_back == plan.days_back and all(queries.get(name, query) == query
+                                                       for name, query in wanted.items()):
+                    queries.update(wanted)
+                    focus.update(plan.focus)
+                    members.append(index)
+                    break
+            else:
+                groups.append((plan.days_back, wanted, set(plan.focus), [index]))
+        return [
+            (FetchPlan("batch", tuple(name for name in DATASETS if name in queries), days_back, MAX_FETCH_PAGES,
+                       {name: query for name, query in queries.items() if query is not None},
+                       tuple(sorted(focus))), members)
+            for days_back, queries, focus, members in groups
+        ]
+
+    async def _answer_group_async(self, group: list, context: str) -> dict:
+        """One model call answering every question in `group`; returns {index: answer}"""
+        if len(group) == 1:
+            index, question, intent, data, data_slice, _ = group[0]
+            prompt = self._build_analysis_prompt(question, data, intent, context, data_slice=data_slice)
+            async with llm_scheduler.slot(self.client.store_domain):
+                try:
+                    with span("llm_generate"):
+                        response = await self.model.generate_content_async(prompt)
+                    return {index: response.text}
+                except Exception as e:
+                    logger.error(f"LLM analysis failed: {e}")
+                    return {}
+
+        # Figures and records are shared between questions with the same data slice
+        blocks, block_ids = [], {}
+        numbered = []
+        for number, (index, question, intent, _, data_slice, _) in enumerate(group, 1):
+            if data_slice not in block_ids:
+                block_ids[data_slice] = len(blocks) + 1
+                data_summary, records = data_slice
+                records_block = f"\nMost relevant individual records:\n{records}" if records else ""
+                blocks.append(f"[Data {block_ids[data_slice]}]\nFigures: {data_summary}{records_block}")
+            numbered.append(f'{number}. (intent: {intent}, use Data {block_ids[data_slice]}) "{question}"')
+        context_block = f"Previous conversation:\n{context}\n" if context else ""
+        newline = "\n"
+
+        prompt = f"""
+        You are a helpful Shopify business analyst assistant.
+        Answer each of these questions from the same store:
+        {newline.join(numbered)}
+
+        {context_block}
+
+        Here are figures computed from all fetched store data. They are exact;
+        quote them as-is rather than recalculating:
+        {(newline + newline).join(blocks)}
+
+        INSTRUCTIONS:
+        1. Answer every question separately, using only the data block named for it
+        2. Provide specific numbers and insights
+        3. Be conversational and business-friendly
+        4. If data is insufficient or listed as unavailable, say so and suggest what might help
+        5. NEVER mention technical terms like JSON, GraphQL, API, edges, nodes, etc.
+        6. Format large numbers nicely (e.g., $1,234.56)
+
+        Respond with JSON only: {{"answers": [{{"id": <question number>, "answer": "<answer text>"}}]}}
+        """
+        record_value("prompt_chars", len(prompt))
+        record_value("prompt_tokens_estimate", estimate_tokens(prompt))
+
+        async with llm_scheduler.slot(self.client.store_domain):
+            try:
+                with span("llm_generate", questions=len(group)):
+                    response = await self.model.generate_content_async(
+                        prompt, generation_config={"response_mime_type": "application/json"}
+                    )
+                parsed = json.loads(response.text)
+            except Exception as e:
+                logger.error(f"Batch LLM analysis failed: {e}")
+                return {}
+
+        answers = {}
+        items = parsed.get("answers", []) if isinstance(parsed, dict) else parsed
+        for item in items if isinstance(items, list) else []:
+            try:
+                number = int(item.get("id"))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if 1 <= number <= len(group) and isinstance(item.get("answer"), str):
+                answers[group[number - 1][0]] = item["answer"]
+        return answers
+
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens with the model's own tokenizer"""
+        return self.model.count_tokens(text).total_tokens
+
+    def _confidence(self, data: dict) -> str:
+        """Determine confidence based on data quality"""
+        responses = dataset_responses(data) if isinstance(data, dict) else []
+        if not responses or not all(isinstance(r, dict) and r.get("data") for r in responses):
+            return "low"
+        if data.get("unavailable") or data.get("pending"):
+            return "medium"
+        return "high"
+
+    def _remember_turn(self, question: str, result: dict):
+        """Record a finished exchange once, by the request that asked it; errors are not recorded"""
+        if not self.stateful or "answer" not in result:
+            return
         self.conversation_history.append({
             "question": question,
-            "answer": answer[:500]  # Store truncated version
+            "answer": result["answer"][:500]  # Store truncated version
         })
+
+    def _finish_answer(self, question: str, answer: str, intent: str, confidence: str) -> dict:
+        """Build the response; the caller records the turn"""
+        record_value("response_chars", len(answer))
         
         return {
             "answer": answer,
             "intent": intent,
             "confidence": confidence,
             "cached": False
-        }
\ No newline at end of file
+        }
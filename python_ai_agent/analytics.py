@@ -0,0 +1,263 @@
+"""
+Analytics Module - Deterministic aggregation of Shopify data before the LLM
+Flattens the GraphQL edges/node payloads into columnar NumPy arrays and keeps
+running totals, so pages can be folded in as they arrive and the model only
+sees small, exact figures instead of raw JSON.
+"""
+import os
+import numpy as np
+
+TOP_N = 10
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", 10))
+
+
+def unwrap_nodes(connection: dict) -> list:
+    """Unwrap a GraphQL connection ({"edges": [{"node": ...}]}) into its nodes"""
+    return [edge["node"] for edge in (connection or {}).get("edges", []) if edge.get("node")]
+
+
+def to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Accumulator:
+    """Running per-key sums stored as growable NumPy columns"""
+
+    def __init__(self, columns):
+        self.index = {}
+        self.keys = []
+        self.columns = {name: np.zeros(0) for name in columns}
+
+    def codes(self, keys) -> np.ndarray:
+        """Map keys to dense integer codes, growing the columns for new keys"""
+        codes = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            code = self.index.get(key)
+            if code is None:
+                code = self.index[key] = len(self.keys)
+                self.keys.append(key)
+            codes[i] = code
+        grow = len(self.keys) - len(next(iter(self.columns.values())))
+        if grow > 0:
+            for name, column in self.columns.items():
+                self.columns[name] = np.concatenate([column, np.zeros(grow)])
+        return codes
+
+    def add(self, keys, **values):
+        if not keys:
+            return
+        codes = self.codes(keys)
+        for name, column_values in values.items():
+            np.add.at(self.columns[name], codes, np.asarray(column_values, dtype=np.float64))
+
+    def top(self, by: str, n: int) -> list:
+        column = self.columns[by]
+        if not len(column):
+            return []
+        order = np.argsort(-column, kind="stable")[:n]
+        return [
+            {"key": self.keys[i], **{name: float(col[i]) for name, col in self.columns.items()}}
+            for i in order
+        ]
+
+
+class OrderAnalytics:
+    """Incremental order aggregates: revenue, top products and a daily series"""
+
+    def __init__(self):
+        self.order_count = 0
+        self.revenue = 0.0
+        self.units = 0.0
+        self.currencies = {}
+        self.products = _Accumulator(["quantity", "revenue"])
+        self.days = _Accumulator(["orders", "revenue"])
+
+    def add_page(self, orders: list):
+        """Fold one page of order nodes into the running totals"""
+        if not orders:
+            return
+        totals = np.array([
+            to_float(((o.get("totalPriceSet") or {}).get("shopMoney") or {}).get("amount"))
+            for o in orders
+        ])
+        dates = [(o.get("createdAt") or "")[:10] or "unknown" for o in orders]
+
+        titles, quantities, prices = [], [], []
+        for order in orders:
+            currency = ((order.get("totalPriceSet") or {}).get("shopMoney") or {}).get("currencyCode")
+            if currency:
+                self.currencies[currency] = self.currencies.get(currency, 0) + 1
+            for item in unwrap_nodes(order.get("lineItems")):
+                titles.append(item.get("title") or "Untitled")
+                quantities.append(item.get("quantity") or 0)
+                prices.append(to_float((item.get("variant") or {}).get("price")))
+
+        quantities = np.asarray(quantities, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+
+        self.order_count += len(orders)
+        self.revenue += float(totals.sum())
+        self.units += float(quantities.sum())
+        self.days.add(dates, orders=np.ones(len(orders)), revenue=totals)
+        self.products.add(titles, quantity=quantities, revenue=quantities * prices)
+
+    def summary(self, top_n: int = TOP_N) -> dict:
+        currency = max(self.currencies, key=self.currencies.get) if self.currencies else None
+        daily = sorted(
+            ({"date": key, "orders": int(orders), "revenue": round(revenue, 2)}
+             for key, orders, revenue in zip(self.days.keys, self.days.columns["orders"],
+                                             self.days.columns["revenue"])),
+            key=lambda day: day["date"]
+        )
+
+        def ranked(by):
+            return [
+                {"product": row["key"], "quantity": int(row["quantity"]), "revenue": round(row["revenue"], 2)}
+                for row in self.products.top(by, top_n)
+            ]
+
+        return {
+            "order_count": self.order_count,
+            "total_revenue": round(self.revenue, 2),
+            "currency": currency,
+            "mixed_currencies": len(self.currencies) > 1,
+            "average_order_value": round(self.revenue / self.order_count, 2) if self.order_count else 0.0,
+            "units_sold": int(self.units),
+            "top_products_by_quantity": ranked("quantity"),
+            "top_products_by_revenue": ranked("revenue"),
+            "daily": daily
+        }
+
+
+class ProductAnalytics:
+    """Incremental product aggregates: catalogue size, stock levels and low-stock lists"""
+
+    def __init__(self):
+        self.titles = []
+        self.statuses = {}
+        self.inventory = np.zeros(0)
+        self.variant_count = 0
+
+    def add_page(self, products: list):
+        """Fold one page of product nodes into the running totals"""
+        if not products:
+            return
+        self.titles.extend(p.get("title") or "Untitled" for p in products)
+        inventory = np.array([to_float(p.get("totalInventory")) for p in products])
+        self.inventory = np.concatenate([self.inventory, inventory])
+        for product in products:
+            status = product.get("status") or "UNKNOWN"
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.variant_count += len(unwrap_nodes(product.get("variants")))
+
+    def summary(self, low_stock_threshold: int = LOW_STOCK_THRESHOLD, top_n: int = TOP_N) -> dict:
+        low = np.flatnonzero(self.inventory <= low_stock_threshold)
+        low = low[np.argsort(self.inventory[low], kind="stable")]
+        high = np.argsort(-self.inventory, kind="stable")[:top_n]
+        return {
+            "product_count": len(self.titles),
+            "variant_count": self.variant_count,
+            "by_status": dict(self.statuses),
+            "total_inventory": int(self.inventory.sum()),
+            "out_of_stock_count": int((self.inventory <= 0).sum()),
+            "low_stock_threshold": low_stock_threshold,
+            "low_stock_count": int(len(low)),
+            "low_stock": [
+                {"product": self.titles[i], "inventory": int(self.inventory[i])} for i in low[:top_n * 2]
+            ],
+            "most_stocked": [
+                {"product": self.titles[i], "inventory": int(self.inventory[i])} for i in high
+            ]
+        }
+
+
+class InventoryAnalytics:
+    """Incremental inventory-level aggregates: stock per location and the emptiest SKUs"""
+
+    def __init__(self):
+        self.item_count = 0
+        self.tracked_count = 0
+        self.levels = []
+        self.locations = _Accumulator(["available"])
+
+    def add_page(self, items: list):
+        """Fold one page of inventory item nodes into the running totals"""
+        if not items:
+            return
+        locations, available = [], []
+        for item in items:
+            self.item_count += 1
+            self.tracked_count += bool(item.get("tracked"))
+            for level in unwrap_nodes(item.get("inventoryLevels")):
+                location = (level.get("location") or {}).get("name") or "Unknown"
+                quantity = to_float(level.get("available"))
+                locations.append(location)
+                available.append(quantity)
+                self.levels.append((item.get("sku") or item.get("id") or "", location, quantity))
+        self.locations.add(locations, available=available)
+
+    def summary(self, low_stock_threshold: int = LOW_STOCK_THRESHOLD, top_n: int = TOP_N) -> dict:
+        available = np.array([level[2] for level in self.levels])
+        low = np.flatnonzero(available <= low_stock_threshold) if len(available) else np.zeros(0, dtype=np.int64)
+        low = low[np.argsort(available[low], kind="stable")] if len(low) else low
+        return {
+            "inventory_item_count": self.item_count,
+            "tracked_count": self.tracked_count,
+            "total_available": int(available.sum()) if len(available) else 0,
+            "available_by_location": {
+                row["key"]: int(row["available"]) for row in self.locations.top("available", len(self.locations.keys))
+            },
+            "low_stock_levels": [
+                {"sku": self.levels[i][0], "location": self.levels[i][1], "available": int(self.levels[i][2])}
+                for i in low[:top_n * 2]
+            ]
+        }
+
+
+# Response key for each dataset and the payload connection it carries
+DATASET_CONNECTIONS = {"orders": "orders", "products": "products", "inventory": "inventoryItems"}
+
+# Accumulator for each connection; responses collected page by page carry its summary under "figures"
+CONNECTION_ANALYTICS = {"orders": OrderAnalytics, "products": ProductAnalytics, "inventoryItems": InventoryAnalytics}
+
+
+def analytics_for(connection: str):
+    """A fresh accumulator for the connection's nodes, or None if it has none"""
+    analytics = CONNECTION_ANALYTICS.get(connection)
+    return analytics() if analytics else None
+
+
+def dataset_responses(data: dict) -> list:
+    """
+    The GraphQL responses inside a fetch_relevant_data payload, which is either
+    a single response or keyed by dataset ({"orders": <response>, ...}).
+    """
+    if any(name in data for name in DATASET_CONNECTIONS):
+        return [data[name] for name in DATASET_CONNECTIONS if name in data]
+    return [data]
+
+
+def summarize_store_data(data: dict, top_n: int = TOP_N) -> dict:
+    """Compute exact figures from a fetch_relevant_data payload"""
+    summary = {}
+    for response in dataset_responses(data):
+        response = response or {}
+        payload = response.get("data") or {}
+        for name, connection in DATASET_CONNECTIONS.items():
+            if connection not in payload:
+                continue
+            figures = response.get("figures")
+            if figures is None:
+                # Payloads not collected page by page are folded in one go
+                analytics = analytics_for(connection)
+                analytics.add_page(unwrap_nodes(payload[connection]))
+                figures = analytics.summary(top_n=top_n)
+            summary[name] = figures
+    if data.get("unavailable"):
+        summary["unavailable"] = sorted(data["unavailable"])
+    if data.get("pending"):
+        summary["still_loading"] = sorted(data["pending"])
+    return summary
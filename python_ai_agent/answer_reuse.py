@@ -0,0 +1,70 @@
+"""
+Answer Reuse Module - Data-fingerprint keyed reuse of model answers
+An answer is a function of the question and the data slice the model saw
+(figures plus packed records). Fingerprinting (canonical question, intent,
+data slice) lets an unchanged slice reuse the earlier answer however old
+it is, so only a real data change costs a new Gemini call. Fingerprints
+live in their own cache so they neither evict answers nor skew answer-cache
+hit rates.
+"""
+import os
+import hashlib
+from collections import deque
+from threading import Lock
+from cache import create_answer_cache
+
+ANSWER_REUSE_TTL = int(os.getenv("ANSWER_REUSE_TTL", 7 * 24 * 3600))
+RECENT_FINGERPRINTS = 20
+
+
+def data_fingerprint(canonical_key: str, intent: str, *data_parts: str) -> str:
+    """Content hash of the question's canonical form, its intent and the serialized data slice"""
+    digest = hashlib.sha256()
+    for part in (canonical_key, intent, *data_parts):
+        digest.update((part or "").encode())
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class AnswerReuse:
+    """Fingerprint -> answer store in its own namespace of the configured cache backend"""
+
+    def __init__(self, cache=None, ttl: int = ANSWER_REUSE_TTL):
+        self.cache = cache or create_answer_cache(namespace="reuse")
+        self.ttl = ttl
+        self._lock = Lock()
+        self._recent = deque(maxlen=RECENT_FINGERPRINTS)
+        self._counters = {"lookups": 0, "reused": 0, "stored": 0}
+
+    def _count(self, name: str, fingerprint: str, intent: str = None):
+        with self._lock:
+            self._counters[name] += 1
+            if name != "lookups":
+                self._recent.append({"fingerprint": fingerprint[:16], "intent": intent, "event": name})
+
+    def get(self, fingerprint: str, intent: str = None):
+        """Earlier answer for an identical data slice, or None"""
+        self._count("lookups", fingerprint)
+        value, _ = self.cache.get(fingerprint)
+        if value is not None:
+            self._count("reused", fingerprint, intent)
+        return value
+
+    def put(self, fingerprint: str, answer: str, confidence: str, intent: str = None):
+        self.cache.set(fingerprint, {"answer": answer, "confidence": confidence}, ttl=self.ttl)
+        self._count("stored", fingerprint, intent)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["lookups"]
+            return {
+                **self._counters,
+                "model_calls_saved": self._counters["reused"],
+                "reuse_rate_percent": round(self._counters["reused"] / lookups * 100, 2) if lookups else 0,
+                "recent": list(self._recent),
+                "cache": self.cache.stats()
+            }
+
+
+# Singleton instance
+answer_reuse = AnswerReuse()
@@ -0,0 +1,5 @@
+"""
+Benchmarks - Offline load testing of the agent service
+Local stand-ins for the Shopify GraphQL Admin API and Gemini let /analyze be
+driven at fixed concurrency without credentials; see benchmarks.run.
+"""
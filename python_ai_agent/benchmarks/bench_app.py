@@ -0,0 +1,9 @@
+"""
+Bench App Module - The service's FastAPI app with the fake model installed
+Run by uvicorn in each benchmark worker: benchmarks.bench_app:app
+"""
+from benchmarks import fake_model
+
+fake_model.install()
+
+from main import app  # noqa: E402
@@ -0,0 +1,77 @@
+"""
+Fake Model Module - Gemini stand-in with configurable latency
+Replaces GenerativeModel's generate and count_tokens calls with local ones
+that sleep for BENCH_MODEL_LATENCY_MS (plus up to BENCH_MODEL_JITTER_MS) and
+return a synthetic answer. Streaming yields BENCH_MODEL_STREAM_CHUNKS chunks
+spread over the same latency, and structured batch prompts get one answer
+per numbered question, so every agent path runs unchanged.
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+import google.generativeai as genai
+from prompt_packing import estimate_tokens
+
+BENCH_MODEL_LATENCY_MS = float(os.getenv("BENCH_MODEL_LATENCY_MS", 800))
+BENCH_MODEL_JITTER_MS = float(os.getenv("BENCH_MODEL_JITTER_MS", 200))
+BENCH_MODEL_STREAM_CHUNKS = int(os.getenv("BENCH_MODEL_STREAM_CHUNKS", 8))
+
+_NUMBERED_QUESTION = re.compile(r"^\s*(\d+)\. \(intent:", re.MULTILINE)
+
+
+def _answer_text(prompt: str, generation_config) -> str:
+    mime = (generation_config or {}).get("response_mime_type") if isinstance(generation_config, dict) else None
+    if mime == "application/json":
+        numbers = [int(number) for number in _NUMBERED_QUESTION.findall(prompt)]
+        return json.dumps({"answers": [
+            {"id": number, "answer": f"Synthetic answer {number} from {len(prompt)} prompt characters."}
+            for number in numbers
+        ]})
+    return f"Synthetic answer from {len(prompt)} prompt characters. Revenue looks steady this period."
+
+
+class _Stream:
+    """Async iterator of response chunks, as returned by generate_content_async(stream=True)"""
+
+    def __init__(self, text: str, delay_seconds: float, chunks: int):
+        size = max(1, -(-len(text) // max(1, chunks)))
+        self._parts = [text[i:i + size] for i in range(0, len(text), size)]
+        self._delay = delay_seconds / max(1, len(self._parts))
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for part in self._parts:
+            await asyncio.sleep(self._delay)
+            yield SimpleNamespace(text=part)
+
+
+def install(latency_ms: float = BENCH_MODEL_LATENCY_MS, jitter_ms: float = BENCH_MODEL_JITTER_MS,
+            stream_chunks: int = BENCH_MODEL_STREAM_CHUNKS):
+    """Patch genai.GenerativeModel so no call leaves the process"""
+
+    def delay() -> float:
+        return (latency_ms + random.uniform(0, jitter_ms)) / 1000
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        time.sleep(delay())
+        return SimpleNamespace(text=_answer_text(str(contents), generation_config))
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        text = _answer_text(str(contents), generation_config)
+        if stream:
+            return _Stream(text, delay(), stream_chunks)
+        await asyncio.sleep(delay())
+        return SimpleNamespace(text=text)
+
+    def count_tokens(self, contents, **kwargs):
+        return SimpleNamespace(total_tokens=estimate_tokens(str(contents)))
+
+    genai.GenerativeModel.generate_content = generate_content
+    genai.GenerativeModel.generate_content_async = generate_content_async
+    genai.GenerativeModel.count_tokens = count_tokens
@@ -0,0 +1,353 @@
+"""
+Fake Shopify Module - Local GraphQL Admin API stand-in serving a synthetic store
+Answers the orders, products and inventoryItems connections the clients use,
+with cursor pagination, the search filters they send (created_at, updated_at,
+title), sort keys and field projection, so payload sizes follow the query.
+Every response carries a query cost and throttleStatus from a per-token leaky
+bucket, returning THROTTLED when it runs dry. Latency and 5xx errors are
+configurable. Bulk operations are served too: bulkOperationRunQuery, status
+polls and the JSONL result download, generated from the store or from a
+canned file. Point the service at it with SHOPIFY_API_BASE_URL.
+"""
+import re
+import json
+import time
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ADJECTIVES = ["Blue", "Red", "Classic", "Organic", "Vintage", "Slim", "Cozy", "Sport", "Linen", "Wool"]
+NOUNS = ["Hoodie", "Cap", "T-Shirt", "Mug", "Backpack", "Sneaker", "Scarf", "Jacket", "Bottle", "Candle"]
+LOCATIONS = ["Main Warehouse", "Retail Store", "Overflow"]
+
+_CONNECTION = re.compile(r"\b(orders|products|inventoryItems)\s*\(")
+_NESTED_FIRST = re.compile(r"\w+\(first:\s*(\d+)\)")
+_FILTER = re.compile(r"(\w+):(>=|<=|>|<)?'?([^'\s]+)'?")
+_DEFAULT_SORT = re.compile(r"\$sortKey:\s*\w+\s*=\s*(\w+)")
+_DEFAULT_REVERSE = re.compile(r"\$reverse:\s*Boolean\s*=\s*(true|false)")
+_BULK_SEARCH = re.compile(r'query:\s*("(?:[^"\\]|\\.)*")')
+_BULK_PATH = re.compile(r"^/bulk/(\d+)\.jsonl$")
+
+
+def _iso(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def synthetic_store(orders: int = 2000, products: int = 200, days: int = 60, seed: int = 0) -> dict:
+    """Deterministic store data: {connection: [node, ...]} in GraphQL node shape"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    product_nodes, inventory_nodes = [], []
+    for index in range(1, products + 1):
+        variants = []
+        for number in range(rng.randint(1, 5)):
+            variant_id = index * 10 + number
+            quantity = rng.randint(0, 120)
+            variants.append({"node": {
+                "id": f"gid://shopify/ProductVariant/{variant_id}",
+                "title": rng.choice(["S", "M", "L", "XL", "Default Title"]),
+                "price": f"{rng.uniform(5, 150):.2f}",
+                "inventoryQuantity": quantity
+            }})
+            inventory_nodes.append({
+                "id": f"gid://shopify/InventoryItem/{variant_id}",
+                "sku": f"SKU-{variant_id}",
+                "tracked": rng.random() > 0.1,
+                "inventoryLevels": {"edges": [
+                    {"node": {"available": quantity // 2, "location": {"name": location}}}
+                    for location in LOCATIONS[:rng.randint(1, 2)]
+                ]}
+            })
+        product_nodes.append({
+            "id": f"gid://shopify/Product/{index}",
+            "title": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index}",
+            "status": "ACTIVE" if rng.random() > 0.1 else "DRAFT",
+            "updatedAt": _iso(now - timedelta(days=rng.uniform(0, days))),
+            "totalInventory": sum(variant["node"]["inventoryQuantity"] for variant in variants),
+            "variants": {"edges": variants}
+        })
+
+    order_nodes = []
+    for index in range(1, orders + 1):
+        created = now - timedelta(days=rng.uniform(0, days))
+        line_items = []
+        for _ in range(rng.randint(1, 4)):
+            product = rng.choice(product_nodes)
+            variant = rng.choice(product["variants"]["edges"])["node"]
+            line_items.append({"node": {
+                "id": f"gid://shopify/LineItem/{index * 10 + len(line_items)}",
+                "title": product["title"],
+                "quantity": rng.randint(1, 3),
+                "variant": {"price": variant["price"]}
+            }})
+        total = sum(float(item["node"]["variant"]["price"]) * item["node"]["quantity"] for item in line_items)
+        order_nodes.append({
+            "id": f"gid://shopify/Order/{index}",
+            "name": f"#{1000 + index}",
+            "createdAt": _iso(created),
+            "updatedAt": _iso(min(now, created + timedelta(hours=rng.uniform(0, 48)))),
+            "totalPriceSet": {"shopMoney": {"amount": f"{total:.2f}", "currencyCode": "USD"}},
+            "lineItems": {"edges": line_items}
+        })
+    return {"orders": order_nodes, "products": product_nodes, "inventoryItems": inventory_nodes}
+
+
+def bulk_jsonl(nodes) -> bytes:
+    """Nodes in Shopify's bulk result format: nested connection nodes become their own lines with __parentId"""
+    lines = []
+    for node in nodes:
+        children = []
+        top = {}
+        for key, value in node.items():
+            if isinstance(value, dict) and "edges" in value:
+                children.extend(edge["node"] for edge in value["edges"])
+            else:
+                top[key] = value
+        lines.append(top)
+        lines.extend({**child, "__parentId": node["id"]} for child in children)
+    return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+def _matches(node: dict, field: str, operator: str, value: str) -> bool:
+    if field in ("created_at", "updated_at"):
+        stamp = node.get("createdAt" if field == "created_at" else "updatedAt") or ""
+        value = value if "T" in value else value + "T00:00:00Z"
+        return {">=": stamp >= value, ">": stamp > value, "<=": stamp <= value, "<": stamp < value}.get(operator, True)
+    if field == "title":
+        prefix = value.rstrip("*").lower()
+        return any(word.startswith(prefix) for word in re.findall(r"[a-z0-9]+", (node.get("title") or "").lower()))
+    return True
+
+
+def _sort_value(node: dict, sort_key: str):
+    if sort_key == "CREATED_AT":
+        return node.get("createdAt") or ""
+    if sort_key == "UPDATED_AT":
+        return node.get("updatedAt") or ""
+    if sort_key == "TOTAL_PRICE":
+        return float(node["totalPriceSet"]["shopMoney"]["amount"])
+    if sort_key == "INVENTORY_TOTAL":
+        return node.get("totalInventory") or 0
+    return int(node["id"].rsplit("/", 1)[-1])
+
+
+class _Bucket:
+    def __init__(self, maximum: float, restore_rate: float):
+        self.maximum = maximum
+        self.restore_rate = restore_rate
+        self.available = maximum
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float) -> bool:
+        now = time.monotonic()
+        self.available = min(self.maximum, self.available + (now - self.updated_at) * self.restore_rate)
+        self.updated_at = now
+        if cost > self.available:
+            return False
+        self.available -= cost
+        return True
+
+    def status(self) -> dict:
+        return {
+            "maximumAvailable": self.maximum,
+            "currentlyAvailable": round(self.available, 1),
+            "restoreRate": self.restore_rate
+        }
+
+
+class FakeShopifyServer:
+    """Threaded HTTP server answering GraphQL POSTs from a synthetic store"""
+
+    def __init__(self, store: dict, latency_ms: float = 80, jitter_ms: float = 40, bucket_size: float = 1000,
+                 restore_rate: float = 50, error_rate: float = 0.0, seed: int = 0, bulk_files: dict = None,
+                 bulk_polls: int = 1):
+        self.store = store
+        # Canned JSONL results per connection, served instead of ones generated from `store`
+        self.bulk_files = bulk_files or {}
+        # Status polls answered RUNNING before an operation completes
+        self.bulk_polls = bulk_polls
+        self._bulk_operations = {}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bucket_size = bucket_size
+        self.restore_rate = restore_rate
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "throttled": 0, "errors": 0, "bytes_sent": 0, "nodes_sent": 0}
+        self._by_connection = {}
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                status, body = server.handle(self.rfile.read(length), self.headers.get("X-Shopify-Access-Token"))
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                with server._lock:
+                    server._counters["bytes_sent"] += len(payload)
+
+            def do_GET(self):
+                payload = server.bulk_result(self.path)
+                self.send_response(200 if payload is not None else 404)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(payload or b"")))
+                self.end_headers()
+                self.wfile.write(payload or b"")
+                with server._lock:
+                    server._counters["bytes_sent"] += len(payload or b"")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-shopify", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms)
+            failed = self._random.random() < self.error_rate
+        time.sleep((self.latency_ms + jitter) / 1000)
+        return failed
+
+    def handle(self, raw: bytes, token: str):
+        """(HTTP status, JSON body) for one GraphQL request"""
+        with self._lock:
+            self._counters["requests"] += 1
+        if self._delay():
+            with self._lock:
+                self._counters["errors"] += 1
+            return 503, {"errors": "Service unavailable"}
+
+        request = json.loads(raw or b"{}")
+        query = request.get("query") or ""
+        variables = request.get("variables") or {}
+        if "bulkOperationRunQuery" in query:
+            return 200, self._start_bulk(variables.get("query") or "")
+        if "BulkOperation" in query:
+            return 200, self._bulk_status(variables.get("id"))
+        match = _CONNECTION.search(query)
+        if match is None:
+            return 200, {"errors": [{"message": "Unsupported by the benchmark server"}]}
+        connection = match.group(1)
+
+        first = int(variables.get("first") or 50)
+        nested = sum(int(value) for value in _NESTED_FIRST.findall(query))
+        cost = 2 + first + first * nested / 10
+        with self._lock:
+            bucket = self._buckets.setdefault(token, _Bucket(self.bucket_size, self.restore_rate))
+            allowed = bucket.take(cost)
+            throttle_status = bucket.status()
+            self._by_connection[connection] = self._by_connection.get(connection, 0) + 1
+            if not allowed:
+                self._counters["throttled"] += 1
+        extensions = {"cost": {"requestedQueryCost": cost, "throttleStatus": throttle_status}}
+        if not allowed:
+            return 200, {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                         "extensions": extensions}
+
+        nodes = self.store.get(connection, [])
+        for field, operator, value in _FILTER.findall(variables.get("query") or ""):
+            nodes = [node for node in nodes if _matches(node, field, operator, value)]
+        sort_key = variables.get("sortKey") or (_DEFAULT_SORT.search(query) or [None, "ID"])[1]
+        reverse = variables.get("reverse")
+        if reverse is None:
+            default = _DEFAULT_REVERSE.search(query)
+            reverse = bool(default) and default.group(1) == "true"
+        nodes = sorted(nodes, key=lambda node: _sort_value(node, sort_key), reverse=reverse)
+
+        offset = int(variables.get("after") or 0)
+        page = nodes[offset:offset + first]
+        fields = set(re.findall(r"\b\w+\b", query))
+        edges = [{"node": {key: value for key, value in node.items() if key in fields}} for node in page]
+        with self._lock:
+            self._counters["nodes_sent"] += len(edges)
+        has_next = offset + first < len(nodes)
+        extensions["cost"]["actualQueryCost"] = 2 + len(page) + len(page) * nested / 10
+        return 200, {
+            "data": {connection: {
+                "pageInfo": {"hasNextPage": has_next, "endCursor": str(offset + first) if has_next else None},
+                "edges": edges
+            }},
+            "extensions": extensions
+        }
+
+    def _start_bulk(self, bulk_query: str) -> dict:
+        match = _CONNECTION.search(bulk_query)
+        if match is None:
+            return {"data": {"bulkOperationRunQuery": {
+                "bulkOperation": None, "userErrors": [{"field": ["query"], "message": "Invalid bulk query"}]
+            }}}
+        connection = match.group(1)
+        body = self.bulk_files.get(connection)
+        if body is None:
+            search = _BULK_SEARCH.search(bulk_query)
+            nodes = self.store.get(connection, [])
+            for field, operator, value in _FILTER.findall(json.loads(search.group(1)) if search else ""):
+                nodes = [node for node in nodes if _matches(node, field, operator, value)]
+            body = bulk_jsonl(sorted(nodes, key=lambda node: node.get("updatedAt") or ""))
+        with self._lock:
+            number = len(self._bulk_operations) + 1
+            self._bulk_operations[number] = {"body": body, "polls_left": self.bulk_polls}
+        return {"data": {"bulkOperationRunQuery": {
+            "bulkOperation": {"id": f"gid://shopify/BulkOperation/{number}", "status": "CREATED"},
+            "userErrors": []
+        }}}
+
+    def _bulk_status(self, operation_id: str) -> dict:
+        number = int((operation_id or "0").rsplit("/", 1)[-1])
+        with self._lock:
+            operation = self._bulk_operations.get(number)
+            if operation is None:
+                return {"data": {"node": None}}
+            running = operation["polls_left"] > 0
+            operation["polls_left"] -= 1
+        lines = operation["body"].count(b"\n")
+        return {"data": {"node": {
+            "id": operation_id,
+            "status": "RUNNING" if running else "COMPLETED",
+            "errorCode": None,
+            "objectCount": str(lines),
+            "url": None if running or not lines else f"{self.base_url}/bulk/{number}.jsonl",
+            "partialDataUrl": None
+        }}}
+
+    def bulk_result(self, path: str):
+        """JSONL body of a finished bulk operation, or None"""
+        match = _BULK_PATH.match(path)
+        if match is None:
+            return None
+        with self._lock:
+            operation = self._bulk_operations.get(int(match.group(1)))
+        return operation["body"] if operation else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "bulk_operations": len(self._bulk_operations),
+                    "by_connection": dict(self._by_connection)}
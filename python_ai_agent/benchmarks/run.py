@@ -0,0 +1,370 @@
+"""
+Benchmark Runner - Drives /analyze at fixed concurrency against local stand-ins
+Starts the fake Shopify server, launches the service under uvicorn with the
+fake model (benchmarks.bench_app), sends a seeded question mix from
+`--concurrency` concurrent clients and reports throughput, latency
+percentiles, cache hit rate and memory per worker. Results are written as
+JSON with the git commit, so runs can be compared between commits.
+
+Run from python_ai_agent/:
+    python -m benchmarks.run --concurrency 16 --requests 2000 --workers 2 --output after.json
+    python -m benchmarks.run --concurrency 16 --requests 2000 --workers 2 --baseline before.json
+
+Service settings are taken from the environment or `--env KEY=VALUE`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import httpx
+from metrics import LatencyHistogram
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "What were my total sales last week?",
+    "How many orders did I get in the last 30 days?",
+    "What are my top 5 selling products?",
+    "Which products are running low on stock?",
+    "What is my average order value this month?",
+    "How much inventory do I have left?",
+    "What was my revenue yesterday?",
+    "Which product sold the most units last month?",
+    "How many units of Blue Hoodie should I reorder?",
+    "What are my best sellers in the last 7 days?",
+    "Show me my largest orders this week",
+    "What is the price of the Classic Mug variants?"
+]
+
+# Metrics compared against a baseline, and whether higher is better
+COMPARED_METRICS = [
+    ("requests_per_second", True),
+    ("latency.p50_ms", False),
+    ("latency.p95_ms", False),
+    ("latency.p99_ms", False),
+    ("cache_hit_rate", True),
+    ("error_rate", False),
+    ("memory.max_rss_mb", False)
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def question_mix(count: int, unique_ratio: float, stores: int, seed: int) -> list:
+    """(store index, question) pairs; `unique_ratio` of them are one-off questions no cache can serve"""
+    rng = random.Random(seed)
+    mix = []
+    for number in range(count):
+        question = rng.choice(QUESTIONS)
+        if rng.random() < unique_ratio:
+            question = f"{question.rstrip('?')} for region {''.join(rng.choices('bcdfghjklmnpqrstvwxz', k=6))}?"
+        mix.append((rng.randrange(stores), question))
+    return mix
+
+
+def _process_memory(pid: int) -> dict:
+    """Resident and peak resident memory of a process in MB, from /proc"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    memory["rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def _children(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The parent pid follows the parenthesised command name
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return children
+
+
+def _cmdline(pid: int) -> bytes:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+            return cmdline.read()
+    except OSError:
+        return b""
+
+
+def worker_memory(master_pid: int) -> dict:
+    """Memory per uvicorn worker (the master itself when it runs a single worker)"""
+    if not os.path.isdir("/proc"):
+        return {"workers": [], "max_rss_mb": None}
+    # Multiprocess workers are spawned children; skip helpers such as the resource tracker
+    pids = [pid for pid in _children(master_pid) if b"spawn_main" in _cmdline(pid)] or [master_pid]
+    workers = [{"pid": pid, **_process_memory(pid)} for pid in pids]
+    workers = [worker for worker in workers if "rss_mb" in worker]
+    return {
+        "workers": workers,
+        "max_rss_mb": max((worker["rss_mb"] for worker in workers), default=None),
+        "max_peak_rss_mb": max((worker.get("peak_rss_mb", 0) for worker in workers), default=None)
+    }
+
+
+def start_service(port: int, workers: int, shopify_url: str, workdir: str, extra_env: dict) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SHOPIFY_API_BASE_URL": shopify_url,
+        "SHOPIFY_STORE_URL": "",
+        "SNAPSHOT_PATH": os.path.join(workdir, "snapshots.sqlite3"),
+        "CACHE_SQLITE_PATH": os.path.join(workdir, "answer_cache.sqlite3"),
+        "PREWARM_ENABLED": "false",
+        **extra_env
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "benchmarks.bench_app:app",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"
+    ]
+    # Service logs go to a file so they do not drown the report
+    with open(os.path.join(workdir, "service.log"), "wb") as log:
+        return subprocess.Popen(command, cwd=SERVICE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _log_tail(workdir: str, lines: int = 20) -> str:
+    try:
+        with open(os.path.join(workdir, "service.log"), errors="replace") as log:
+            return "".join(log.readlines()[-lines:])
+    except OSError:
+        return ""
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Service did not become ready")
+
+
+async def drive(client: httpx.AsyncClient, mix: list, concurrency: int, duration: float, sessions: bool) -> dict:
+    """Send the mix from `concurrency` clients (repeating it until `duration` seconds, if given)"""
+    histogram = LatencyHistogram()
+    statuses = {}
+    counters = {"requests": 0, "cached": 0, "errors": 0}
+    position = [0]
+    started = time.perf_counter()
+    stop_at = started + duration if duration else None
+
+    def next_request():
+        if stop_at is None and position[0] >= len(mix):
+            return None
+        if stop_at is not None and time.perf_counter() >= stop_at:
+            return None
+        item = mix[position[0] % len(mix)]
+        position[0] += 1
+        return item
+
+    async def user(number: int):
+        while True:
+            item = next_request()
+            if item is None:
+                return
+            store, question = item
+            body = {"store_id": f"bench-store-{store}.myshopify.com", "question": question,
+                    "access_token": f"bench-token-{store}"}
+            if sessions:
+                body["session_id"] = f"bench-user-{number}"
+            request_start = time.perf_counter()
+            try:
+                response = await client.post("/analyze", json=body)
+                status = response.status_code
+                cached = status == 200 and bool(response.json().get("cached"))
+            except httpx.HTTPError:
+                status, cached = "transport_error", False
+            histogram.record((time.perf_counter() - request_start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            counters["requests"] += 1
+            counters["cached"] += cached
+            counters["errors"] += status != 200
+
+    await asyncio.gather(*(user(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    requests = counters["requests"]
+    return {
+        "requests": requests,
+        "duration_seconds": round(elapsed, 2),
+        "requests_per_second": round(requests / elapsed, 2) if elapsed else 0,
+        "latency": histogram.summary(),
+        "status_codes": statuses,
+        "cache_hit_rate": round(counters["cached"] / requests, 4) if requests else 0,
+        "error_rate": round(counters["errors"] / requests, 4) if requests else 0
+    }
+
+
+def _metric(results: dict, path: str):
+    value = results
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """Per-metric change against a baseline run; `regression` marks changes for the worse"""
+    comparison = {}
+    for path, higher_is_better in COMPARED_METRICS:
+        before, after = _metric(baseline, path), _metric(current, path)
+        if before is None or after is None:
+            continue
+        change = round((after - before) / before * 100, 1) if before else None
+        worse = after < before if higher_is_better else after > before
+        comparison[path] = {"baseline": before, "current": after, "change_percent": change, "regression": worse}
+    return comparison
+
+
+def print_report(report: dict):
+    results = report["results"]
+    latency = results["latency"]
+    print(f"\ncommit {report['commit']}  workers {report['config']['workers']}  "
+          f"concurrency {report['config']['concurrency']}")
+    print(f"requests     {results['requests']} in {results['duration_seconds']}s "
+          f"({results['requests_per_second']} req/s)")
+    print(f"latency ms   p50 {latency['p50_ms']}  p95 {latency['p95_ms']}  p99 {latency['p99_ms']}  max {latency['max_ms']}")
+    print(f"cache hits   {results['cache_hit_rate']:.1%}   errors {results['error_rate']:.1%}   "
+          f"status {results['status_codes']}")
+    for worker in results["memory"]["workers"]:
+        print(f"worker {worker['pid']}  rss {worker.get('rss_mb')} MB  peak {worker.get('peak_rss_mb')} MB")
+    shopify = results["shopify"]
+    print(f"shopify      {shopify['requests']} requests  {shopify['throttled']} throttled  "
+          f"{shopify['bytes_sent'] / 1024:.0f} KiB sent")
+    for path, row in report.get("comparison", {}).items():
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"vs baseline  {path:<22} {row['baseline']} -> {row['current']} ({row['change_percent']}%){flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /analyze against local Shopify and model stand-ins")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests to send (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=0, help="unrecorded requests sent first")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--stores", type=int, default=3, help="distinct stores (and access tokens) in the mix")
+    parser.add_argument("--unique-ratio", type=float, default=0.2, help="share of one-off questions")
+    parser.add_argument("--sessions", action="store_true", help="give each client a conversation session")
+    parser.add_argument("--orders", type=int, default=2000, help="synthetic orders per store")
+    parser.add_argument("--products", type=int, default=200, help="synthetic products per store")
+    parser.add_argument("--days", type=int, default=60, help="days of synthetic order history")
+    parser.add_argument("--shopify-latency-ms", type=float, default=80)
+    parser.add_argument("--shopify-jitter-ms", type=float, default=40)
+    parser.add_argument("--shopify-error-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--bucket-size", type=float, default=1000, help="query cost bucket per access token")
+    parser.add_argument("--restore-rate", type=float, default=50, help="query cost restored per second")
+    parser.add_argument("--model-latency-ms", type=float, default=800)
+    parser.add_argument("--model-jitter-ms", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="service setting")
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="exit 1 if RPS or p95 is worse than the baseline by more than this percent")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> dict:
+    shopify = FakeShopifyServer(
+        synthetic_store(args.orders, args.products, args.days, args.seed),
+        latency_ms=args.shopify_latency_ms, jitter_ms=args.shopify_jitter_ms, bucket_size=args.bucket_size,
+        restore_rate=args.restore_rate, error_rate=args.shopify_error_rate, seed=args.seed
+    )
+    shopify_url = shopify.start()
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    extra_env.setdefault("BENCH_MODEL_LATENCY_MS", str(args.model_latency_ms))
+    extra_env.setdefault("BENCH_MODEL_JITTER_MS", str(args.model_jitter_ms))
+    port = _free_port()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    with tempfile.TemporaryDirectory(prefix="ai-shopify-bench-") as workdir:
+        process = start_service(port, args.workers, shopify_url, workdir, extra_env)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+                try:
+                    await wait_ready(client, process)
+                except RuntimeError as e:
+                    raise RuntimeError(f"{e}\n{_log_tail(workdir)}")
+                if args.warmup:
+                    await drive(client, question_mix(args.warmup, args.unique_ratio, args.stores, args.seed + 1),
+                                args.concurrency, 0, args.sessions)
+                mix = question_mix(args.requests, args.unique_ratio, args.stores, args.seed)
+                results = await drive(client, mix, args.concurrency, args.duration, args.sessions)
+            results["memory"] = worker_memory(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            shopify.stop()
+    results["shopify"] = shopify.stats()
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        report["baseline_commit"] = baseline.get("commit")
+        report["comparison"] = compare(report["results"], baseline.get("results", {}))
+        if args.max_regression is not None:
+            for path in ("requests_per_second", "latency.p95_ms"):
+                row = report["comparison"].get(path)
+                if row and row["regression"] and abs(row["change_percent"] or 0) > args.max_regression:
+                    failed = True
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
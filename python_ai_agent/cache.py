@@ -0,0 +1,260 @@
+"""
+Cache Module - Bounded answer cache
+LRU eviction by entry count and approximate byte size, per-entry TTL,
+a stale-while-revalidate window and a background expiry sweeper. The
+in-process cache is the default; CACHE_BACKEND=redis or sqlite selects a
+backend shared by every worker (see cache_backends.py).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from threading import Lock, Thread, Event
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))  # 5 minutes
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 600))  # served stale while refreshing
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 16 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", 30))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+def _approximate_size(value) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "stale_until", "tags")
+
+    def __init__(self, value, size, expires_at, stale_until):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.tags = ()
+
+
+class CacheBackend:
+    """
+    Interface every answer cache backend implements: get/peek/set/delete with
+    FRESH/STALE states, refresh claims, tag-based invalidation and stats
+    """
+    name = "base"
+    # Backends doing network or disk I/O; async callers reach them through call_async
+    blocking = False
+
+    def __init__(self):
+        self._stop = Event()
+        self._sweeper = None
+
+    def purge_expired(self) -> int:
+        return 0
+
+    def start_expiry_thread(self, interval: int = CACHE_SWEEP_INTERVAL):
+        """Sweep expired entries in the background so idle keys don't linger"""
+        if self._sweeper and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+
+        def sweep():
+            while not self._stop.wait(interval):
+                removed = self.purge_expired()
+                if removed:
+                    logger.debug(f"Expired {removed} cache entries")
+
+        self._sweeper = Thread(target=sweep, name="answer-cache-expiry", daemon=True)
+        self._sweeper.start()
+
+    def stop_expiry_thread(self):
+        self._stop.set()
+
+
+class AnswerCache(CacheBackend):
+    """In-process backend; each worker process has its own"""
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl: int = CACHE_TTL, stale_ttl: int = CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._refreshing = set()
+        self._tags = {}
+        self._lock = Lock()
+        super().__init__()
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def get(self, key: str):
+        """Return (value, FRESH | STALE), or (None, None) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None, None
+            if now >= entry.stale_until:
+                self._remove(key)
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self._counters["hits"] += 1
+                return entry.value, FRESH
+            self._counters["stale_hits"] += 1
+            return entry.value, STALE
+
+    def peek(self, key: str):
+        """FRESH, STALE or None for `key`, without counting a lookup or refreshing its recency"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or now >= entry.stale_until:
+            return None
+        return FRESH if now < entry.expires_at else STALE
+
+    def set(self, key: str, value, ttl: int = None):
+        """Store a value, evicting least-recently-used entries to stay within bounds"""
+        ttl = self.ttl if ttl is None else ttl
+        size = _approximate_size(value)
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, now + ttl, now + ttl + self.stale_ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refreshing.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def tag(self, key: str, tags, ttl: int = None):
+        """Label a cached entry (stored with `ttl`) so invalidate_tags can drop it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.tags = tuple(set(entry.tags) | set(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+    def invalidate_tags(self, tags) -> int:
+        """Delete every entry carrying any of the tags; returns how many were dropped"""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            dropped = [key for key in keys if key in self._entries]
+            for key in dropped:
+                self._remove(key)
+            return len(dropped)
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the background refresh of a stale key; False if one is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: str):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def purge_expired(self) -> int:
+        """Drop every entry past its stale window"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now >= entry.stale_until]
+            for key in expired:
+                self._remove(key)
+            self._counters["expirations"] += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["stale_hits"] + self._counters["misses"]
+            served = self._counters["hits"] + self._counters["stale_hits"]
+            return {
+                "backend": self.name,
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_rate_percent": round(served / lookups * 100, 2) if lookups else 0
+            }
+
+
+async def call_async(cache: CacheBackend, fn, *args):
+    """Call `fn` (which uses `cache`) from async code, on a worker thread if the backend blocks"""
+    if cache.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def create_answer_cache(backend: str = CACHE_BACKEND, namespace: str = None) -> CacheBackend:
+    """
+    Answer cache for the configured backend: memory (per process), redis or
+    sqlite (shared). A `namespace` gets its own cache on the same backend,
+    with separate keys, LRU bounds and counters.
+    """
+    if backend == "redis":
+        from cache_backends import RedisCache, CACHE_KEY_PREFIX
+        return RedisCache(prefix=f"{CACHE_KEY_PREFIX}{namespace}:" if namespace else CACHE_KEY_PREFIX)
+    if backend == "sqlite":
+        from cache_backends import SQLiteCache, CACHE_SQLITE_PATH
+        if not namespace:
+            return SQLiteCache()
+        root, ext = os.path.splitext(CACHE_SQLITE_PATH)
+        return SQLiteCache(path=f"{root}-{namespace}{ext}")
+    if backend != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND '{backend}', using in-process memory cache")
+    return AnswerCache()
+
+
+# Singleton instance
+answer_cache = create_answer_cache()
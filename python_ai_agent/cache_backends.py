@@ -0,0 +1,389 @@
+"""
+Cache Backends Module - Answer caches shared across workers and replicas
+RedisCache talks the Redis protocol (Redis 7+, Valkey or a local
+stand-in) so every uvicorn worker and container shares one cache.
+SQLiteCache keeps the cache in a WAL-mode SQLite file for single-host
+deployments running several workers. Values are serialized with msgpack.
+Both use wall-clock expiry, since monotonic clocks differ between processes.
+"""
+import os
+import time
+import sqlite3
+import logging
+from threading import Lock
+import msgpack
+from cache import CacheBackend, CACHE_TTL, CACHE_STALE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, FRESH, STALE
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT_SECONDS", 0.5))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "ai_shopify:")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "answer_cache.sqlite3")
+# How long one worker's claim on refreshing a stale key lasts if it never releases it
+REFRESH_CLAIM_SECONDS = 120
+
+
+def _default(value):
+    """msgpack fallback for NumPy scalars and other non-native values"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def pack(value) -> bytes:
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+
+def unpack(data: bytes):
+    return msgpack.unpackb(data, raw=False)
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = Lock()
+        self.values = {"hits": 0, "stale_hits": 0, "misses": 0, "errors": 0}
+
+    def add(self, name: str, amount: int = 1):
+        with self._lock:
+            self.values[name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = dict(self.values)
+        lookups = values["hits"] + values["stale_hits"] + values["misses"]
+        served = values["hits"] + values["stale_hits"]
+        values["hit_rate_percent"] = round(served / lookups * 100, 2) if lookups else 0
+        return values
+
+
+class RedisCache(CacheBackend):
+    """
+    Shared backend over the Redis protocol. Each entry is one key holding
+    msgpack([expires_at, value]) with a server-side TTL covering the stale
+    window; tags are Redis sets of keys that expire with their longest-lived
+    entry (PEXPIRE NX/GT, Redis 7+ or Valkey). Memory is bounded by the
+    server's maxmemory policy. Connection errors degrade to cache misses.
+    """
+    name = "redis"
+    blocking = True
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = CACHE_TTL, stale_ttl: int = CACHE_STALE_TTL,
+                 prefix: str = CACHE_KEY_PREFIX, client=None):
+        super().__init__()
+        import redis
+        self._errors = redis.RedisError
+        self._redis = client or redis.Redis.from_url(
+            url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+        )
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix
+        self._counters = _Counters()
+
+    def _key(self, kind: str, key: str) -> str:
+        return f"{self.prefix}{kind}:{key}"
+
+    def _failed(self, operation: str, error: Exception):
+        self._counters.add("errors")
+        logger.warning(f"Redis cache {operation} failed: {error}")
+
+    def get(self, key: str):
+        try:
+            raw = self._redis.get(self._key("answer", key))
+        except self._errors as e:
+            self._failed("get", e)
+            raw = None
+        if raw is None:
+            self._counters.add("misses")
+            return None, None
+        expires_at, value = unpack(raw)
+        if time.time() < expires_at:
+            self._counters.add("hits")
+            return value, FRESH
+        self._counters.add("stale_hits")
+        return value, STALE
+
+    def peek(self, key: str):
+        try:
+            raw = self._redis.get(self._key("answer", key))
+        except self._errors as e:
+            self._failed("peek", e)
+            return None
+        if raw is None:
+            return None
+        expires_at, _ = unpack(raw)
+        return FRESH if time.time() < expires_at else STALE
+
+    def set(self, key: str, value, ttl: int = None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self._redis.set(
+                self._key("answer", key), pack([time.time() + ttl, value]),
+                px=int((ttl + self.stale_ttl) * 1000)
+            )
+        except self._errors as e:
+            self._failed("set", e)
+
+    def delete(self, key: str):
+        try:
+            self._redis.delete(self._key("answer", key))
+        except self._errors as e:
+            self._failed("delete", e)
+
+    def clear(self):
+        try:
+            batch = []
+            for redis_key in self._redis.scan_iter(match=f"{self.prefix}*", count=500):
+                batch.append(redis_key)
+                if len(batch) >= 500:
+                    self._redis.delete(*batch)
+                    batch = []
+            if batch:
+                self._redis.delete(*batch)
+        except self._errors as e:
+            self._failed("clear", e)
+
+    def tag(self, key: str, tags, ttl: int = None):
+        # A tag set must outlive every entry in it, so its expiry only ever moves later
+        expire_ms = int(((self.ttl if ttl is None else ttl) + self.stale_ttl) * 1000)
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for tag in tags:
+                tag_key = self._key("tag", tag)
+                pipeline.sadd(tag_key, key)
+                pipeline.pexpire(tag_key, expire_ms, nx=True)
+                pipeline.pexpire(tag_key, expire_ms, gt=True)
+            pipeline.execute()
+        except self._errors as e:
+            self._failed("tag", e)
+
+    def invalidate_tags(self, tags) -> int:
+        try:
+            keys = set()
+            for tag in tags:
+                keys |= {member.decode() if isinstance(member, bytes) else member
+                         for member in self._redis.smembers(self._key("tag", tag))}
+            dropped = self._redis.delete(*[self._key("answer", key) for key in keys]) if keys else 0
+            self._redis.delete(*[self._key("tag", tag) for tag in tags])
+            return int(dropped)
+        except self._errors as e:
+            self._failed("invalidate", e)
+            return 0
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the refresh across all workers; only one of them regenerates the answer"""
+        try:
+            return bool(self._redis.set(self._key("refresh", key), 1, nx=True, px=REFRESH_CLAIM_SECONDS * 1000))
+        except self._errors as e:
+            self._failed("begin_refresh", e)
+            return False
+
+    def end_refresh(self, key: str):
+        try:
+            self._redis.delete(self._key("refresh", key))
+        except self._errors as e:
+            self._failed("end_refresh", e)
+
+    def start_expiry_thread(self, interval: int = None):
+        # The server expires keys itself
+        return
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "url": self.url.split("@")[-1], **self._counters.snapshot()}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at);
+CREATE TABLE IF NOT EXISTS answer_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+CREATE TABLE IF NOT EXISTS refresh_claims (
+    key TEXT PRIMARY KEY,
+    until REAL NOT NULL
+);
+"""
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Shared backend for several workers on one host: a WAL-mode SQLite file
+    with the same LRU bounds (entries and bytes) as the in-process cache
+    """
+    name = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES, ttl: int = CACHE_TTL, stale_ttl: int = CACHE_STALE_TTL):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._db = None
+        self._lock = Lock()
+        self._counters = _Counters()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Callers hold self._lock
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT value, expires_at, stale_until FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now >= row[2]:
+                if row is not None:
+                    with db:
+                        db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._counters.add("misses")
+                return None, None
+            with db:
+                db.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+        value = unpack(row[0])
+        if now < row[1]:
+            self._counters.add("hits")
+            return value, FRESH
+        self._counters.add("stale_hits")
+        return value, STALE
+
+    def peek(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT expires_at, stale_until FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or now >= row[1]:
+            return None
+        return FRESH if now < row[0] else STALE
+
+    def set(self, key: str, value, ttl: int = None):
+        ttl = self.ttl if ttl is None else ttl
+        data = pack(value)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO answers (key, value, size, expires_at, stale_until, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, data, len(data), now + ttl, now + ttl + self.stale_ttl, now)
+                )
+                self._evict(db)
+
+    def _evict(self, db: sqlite3.Connection):
+        """Drop least-recently-used entries until both bounds hold"""
+        while True:
+            count, size = db.execute("SELECT count(*), coalesce(sum(size), 0) FROM answers").fetchone()
+            if count <= self.max_entries and size <= self.max_bytes:
+                return
+            overflow = max(count - self.max_entries, 1)
+            db.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM answers WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM answers")
+                db.execute("DELETE FROM answer_tags")
+                db.execute("DELETE FROM refresh_claims")
+
+    def tag(self, key: str, tags, ttl: int = None):
+        # Tag rows are purged with their entry, whatever its TTL
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.executemany("INSERT OR IGNORE INTO answer_tags (tag, key) VALUES (?, ?)",
+                               [(tag, key) for tag in tags])
+
+    def invalidate_tags(self, tags) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        marks = ",".join("?" * len(tags))
+        with self._lock:
+            db = self._conn()
+            with db:
+                cursor = db.execute(
+                    f"DELETE FROM answers WHERE key IN (SELECT key FROM answer_tags WHERE tag IN ({marks}))", tags
+                )
+                db.execute(f"DELETE FROM answer_tags WHERE tag IN ({marks})", tags)
+        return cursor.rowcount
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the refresh across all workers on this host"""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM refresh_claims WHERE key = ? AND until <= ?", (key, now))
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO refresh_claims (key, until) VALUES (?, ?)",
+                    (key, now + REFRESH_CLAIM_SECONDS)
+                )
+        return cursor.rowcount == 1
+
+    def end_refresh(self, key: str):
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM refresh_claims WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            with db:
+                cursor = db.execute("DELETE FROM answers WHERE stale_until <= ?", (now,))
+                db.execute("DELETE FROM answer_tags WHERE key NOT IN (SELECT key FROM answers)")
+                db.execute("DELETE FROM refresh_claims WHERE until <= ?", (now,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn().execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM answers"
+            ).fetchone()
+        return {
+            "backend": self.name,
+            "path": self.path,
+            **self._counters.snapshot(),
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes
+        }
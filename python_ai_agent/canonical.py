@@ -0,0 +1,339 @@
+"""
+Canonical Module - Turns free-text questions into structured cache keys
+Paraphrases such as "top products?" and "What are my top selling products"
+collapse onto the same key: intent, time window, top-N, metric, ranking
+direction and the remaining focus words after case, punctuation and
+stopword normalization. An optional local similarity tier (no network,
+off by default) matches near-paraphrases whose focus words differ slightly.
+"""
+import os
+import re
+import zlib
+from collections import deque, namedtuple
+from functools import lru_cache
+from threading import Lock
+import numpy as np
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_THRESHOLD", 0.82))
+SEMANTIC_ENTRIES_PER_STORE = int(os.getenv("SEMANTIC_ENTRIES_PER_STORE", 256))
+EMBEDDING_DIMENSIONS = 512
+
+STOPWORDS = {
+    "a", "an", "the", "my", "me", "i", "we", "our", "us", "you", "your", "is", "are", "was",
+    "were", "be", "been", "do", "does", "did", "what", "which", "who", "how", "show", "tell",
+    "give", "list", "of", "for", "in", "on", "at", "to", "from", "by", "with", "and", "or",
+    "any", "all", "some", "there", "it", "its", "this", "that", "these", "those", "can",
+    "could", "would", "should", "please", "about", "much", "many", "have", "has", "had",
+    "get", "see", "based", "current", "currently", "so", "far", "up", "into", "store", "shop"
+}
+
+# Words that only restate the intent, metric or ranking direction; they carry no
+# extra focus. Trend and recency words change the answer, so they stay in the focus
+DOMAIN_WORDS = {
+    "top", "best", "selling", "seller", "sell", "sold", "sale", "product", "item", "revenue",
+    "total", "order", "inventory", "stock", "perform", "performing", "popular",
+    "number", "count", "amount", "money", "earn", "earned", "make", "made",
+    "receive", "received", "level", "unit", "quantity", "value",
+    "days", "day", "week", "month", "year", "last", "past", "today", "yesterday", "ago",
+    "next", "expect", "forecast", "predict", "will", "likely", "upcoming", "need"
+}
+
+# Superlatives and levels, folded into one ranking direction per question
+DIRECTION_WORDS = {
+    "top": "high", "best": "high", "most": "high", "high": "high", "highest": "high", "largest": "high",
+    "biggest": "high", "popular": "high", "bottom": "low", "worst": "low", "least": "low", "low": "low",
+    "lowest": "low", "fewest": "low", "smallest": "low"
+}
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "twenty": 20, "thirty": 30
+}
+
+UNIT_DAYS = {"day": 1, "week": 7, "month": 30, "quarter": 90, "year": 365}
+
+CanonicalQuestion = namedtuple(
+    "CanonicalQuestion", ["intent", "window_days", "top_n", "metric", "forecast", "direction", "focus"]
+)
+
+
+def _stem(word: str) -> str:
+    """Very light stemming so plurals and -ing forms line up"""
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_question(question: str) -> list:
+    """Lower-case, strip punctuation, drop stopwords and stem"""
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return [_stem(word) for word in words if word not in STOPWORDS]
+
+
+# Keyword -> what it signals. Keywords match anywhere in the text (as plain
+# substrings); intents are listed in priority order
+INTENT_PRIORITY = ("sales_analysis", "inventory_check", "product_info", "order_info")
+METRIC_PRIORITY = ("revenue", "quantity", "inventory", "orders")
+KEYWORD_SIGNALS = {
+    "intent:sales_analysis": ("sell", "sold", "sales", "revenue", "top", "best"),
+    "intent:inventory_check": ("inventory", "stock", "reorder", "out of stock"),
+    "intent:product_info": ("product", "item"),
+    "intent:order_info": ("order", "recent"),
+    "metric:revenue": ("revenue", "money", "earn", "income", "total sales", "aov"),
+    "metric:quantity": ("units", "quantity", "how many units"),
+    "metric:inventory": ("stock", "inventory", "reorder"),
+    "metric:orders": ("order",),
+    "window:1": ("today",),
+    "window:2": ("yesterday",)
+}
+
+# Capitalized words that are never a product name
+NOT_PRODUCT_WORDS = {
+    "where", "when", "why", "whats", "hi", "hello", "thanks", "shopify", "usd", "black", "friday",
+    "cyber", "monday", "tuesday", "wednesday", "thursday", "saturday", "sunday", "january",
+    "february", "march", "april", "june", "july", "august", "september", "october",
+    "november", "december", "christmas"
+}
+
+ParsedQuestion = namedtuple(
+    "ParsedQuestion", ["intent", "window_days", "top_n", "metric", "forecast", "product"]
+)
+
+
+def _keyword_signals() -> dict:
+    """Signals per keyword, including those of every keyword it contains ("reorder" has "order")"""
+    signals = {}
+    for signal, keywords in KEYWORD_SIGNALS.items():
+        for keyword in keywords:
+            signals.setdefault(keyword, set()).add(signal)
+    return {
+        keyword: frozenset().union(*(found for other, found in signals.items() if other in keyword))
+        for keyword in signals
+    }
+
+
+def _trie_pattern(words) -> str:
+    """
+    Alternation of `words` factored by common prefix ("s(?:ales|ell|old|tock)"),
+    so the regex engine does not retry every keyword at every position. The
+    longest keyword wins at a given position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def render(node) -> str:
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if "" in node:
+            return f"(?:{'|'.join(branches)})?"
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return render(trie)
+
+
+_SIGNALS = _keyword_signals()
+_KEYWORDS = _trie_pattern(_SIGNALS)
+_UNITS = "day|week|month|quarter|year"
+_FORECAST = r"\b(?P<forecast>next|expect|forecast|predict|will|likely|upcoming)\b"
+
+# Every parameter and keyword in one alternation, so a question is scanned once
+QUESTION_PATTERN = re.compile(
+    # Lookaheads capture without consuming, so the text stays visible to the other alternatives
+    rf"(?P<window>last|past|previous|this)(?:(?=\s+(?P<last_n_count>\w+)\s+(?P<last_n_unit>{_UNITS})s?))?"
+    rf"(?:(?=\s+(?P<last_unit_unit>{_UNITS})))?"
+    r"|(?P<ago>\b(?P<ago_count>\w+)\s+(?P<ago_unit>day|week|month)s?\s+ago)"
+    r"|(?P<top>\b(?:top|best|bottom|worst))(?=\s+(?P<top_count>\w+))"
+    rf"|{_FORECAST}"
+    r"|[\"\u201c](?=(?P<quoted>[^\"\u201d]{2,80})[\"\u201d])"
+    r"|\b(?:named|called)\s+(?=(?P<named>[^?.,!\"]{2,80}?)(?:\s+(?:in|over|during|for|from|since|last|past|this)\b|[?.,!\"]|$))"
+    rf"|(?P<keyword>{_KEYWORDS})"
+    r"|(?-i:\b(?P<proper>[A-Z][\w'&-]*(?:\s+(?!(?i:last|past|previous|this|next|top|best|bottom|worst)\b)[A-Z][\w'&-]*)*))",
+    re.IGNORECASE
+)
+# Keywords and forecast words inside text a parameter match consumed
+_FRAGMENT_PATTERN = re.compile(rf"{_FORECAST}|(?P<keyword>{_KEYWORDS})", re.IGNORECASE)
+
+
+def _number(token: str):
+    if token.isdigit():
+        return int(token)
+    return NUMBER_WORDS.get(token)
+
+
+def _window_days(match, kind: str):
+    """Days covered by a "last 3 weeks" / "last week" / "2 months ago" match"""
+    if match is None:
+        return None
+    unit = UNIT_DAYS[match.group(f"{kind}_unit").lower()]
+    if kind == "last_unit":
+        return unit
+    count = _number(match.group(f"{kind}_count").lower())
+    return count * unit if count else None
+
+
+def _product_name(text: str):
+    text = text.strip()
+    words = normalize_question(text)
+    if not words or all(word in DOMAIN_WORDS or word in NOT_PRODUCT_WORDS or len(word) < 2 for word in words):
+        return None
+    return text
+
+
+def _scan_fragment(text: str, signals: set) -> bool:
+    forecast = False
+    for match in _FRAGMENT_PATTERN.finditer(text):
+        if match.lastgroup == "forecast":
+            forecast = True
+        else:
+            signals.update(_SIGNALS[match.group().lower()])
+    return forecast
+
+
+@lru_cache(maxsize=4096)
+def parse_question(question: str) -> ParsedQuestion:
+    """
+    Intent and parameters (time window, top-N, metric, forecast, product
+    name) from a single pass of QUESTION_PATTERN over the question
+    """
+    signals = set()
+    first = {}
+    forecast = False
+    product = None
+    for match in QUESTION_PATTERN.finditer(question):
+        # A lookahead group closes after the top-N keyword itself
+        kind = "top" if match.lastgroup == "top_count" else match.lastgroup
+        if kind == "keyword":
+            signals.update(_SIGNALS[match.group().lower()])
+            continue
+        if kind == "forecast":
+            forecast = True
+            continue
+        if match.group("window") is not None:
+            # "last 3 weeks" and "last week" forms; "this" only takes a bare unit
+            if match.group("last_n_unit") and match.group("window").lower() != "this":
+                first.setdefault("last_n", match)
+            if match.group("last_unit_unit"):
+                first.setdefault("last_unit", match)
+            continue
+        # Only the first occurrence of each parameter counts
+        first.setdefault(kind, match)
+        forecast = _scan_fragment(match.group(), signals) or forecast
+        if product is None and kind in ("quoted", "named", "proper"):
+            product = _product_name(match.group(kind))
+
+    if "window:1" in signals:
+        window_days = 1
+    elif "window:2" in signals:
+        window_days = 2
+    else:
+        window_days = _window_days(first.get("last_n"), "last_n") or _window_days(first.get("last_unit"), "last_unit")
+        window_days = window_days or _window_days(first.get("ago"), "ago")
+
+    top_n = _number(first["top"].group("top_count").lower()) if "top" in first else None
+    return ParsedQuestion(
+        intent=next((intent for intent in INTENT_PRIORITY if f"intent:{intent}" in signals), "general"),
+        window_days=window_days,
+        top_n=top_n,
+        metric=next((metric for metric in METRIC_PRIORITY if f"metric:{metric}" in signals), None),
+        forecast=forecast,
+        product=product
+    )
+
+
+def canonicalize(question: str, intent: str) -> CanonicalQuestion:
+    """Reduce a question to the fields that decide its answer"""
+    parsed = parse_question(question)
+    words = normalize_question(question)
+    directions = {DIRECTION_WORDS[word] for word in words if word in DIRECTION_WORDS}
+    focus = sorted({
+        word for word in words
+        if word not in DOMAIN_WORDS and word not in DIRECTION_WORDS
+        and not word.isdigit() and word not in NUMBER_WORDS
+    })
+    return CanonicalQuestion(
+        intent=intent,
+        window_days=parsed.window_days,
+        top_n=parsed.top_n,
+        metric=parsed.metric,
+        forecast=parsed.forecast,
+        direction="/".join(sorted(directions)) or None,
+        focus=" ".join(focus)
+    )
+
+
+def canonical_key(canonical: CanonicalQuestion) -> str:
+    return (
+        f"{canonical.intent}|w={canonical.window_days}|n={canonical.top_n}|m={canonical.metric}"
+        f"|f={int(canonical.forecast)}|d={canonical.direction}|{canonical.focus}"
+    )
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Local, dependency-free embedding: hashed word and character-trigram
+    features, L2-normalized so a dot product is the cosine similarity.
+    """
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    words = normalize_question(text)
+    features = list(words)
+    for word in words:
+        padded = f" {word} "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    for feature in features:
+        vector[zlib.crc32(feature.encode()) % EMBEDDING_DIMENSIONS] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticIndex:
+    """Per-store ring of recent questions, matched by embedding similarity"""
+
+    def __init__(self, threshold: float = SEMANTIC_THRESHOLD,
+                 entries_per_store: int = SEMANTIC_ENTRIES_PER_STORE):
+        self.threshold = threshold
+        self.entries_per_store = entries_per_store
+        self._stores = {}
+        self._lock = Lock()
+
+    def add(self, store_id: str, canonical: CanonicalQuestion, cache_key: str):
+        if not canonical.focus:
+            return
+        entry = (canonical._replace(focus=""), embed(canonical.focus), cache_key)
+        with self._lock:
+            ring = self._stores.setdefault(store_id, deque(maxlen=self.entries_per_store))
+            ring.append(entry)
+
+    def lookup(self, store_id: str, canonical: CanonicalQuestion):
+        """
+        Cache key of the earlier question with the same parameters whose focus
+        words are most similar, if it clears the threshold
+        """
+        if not canonical.focus:
+            return None
+        structure = canonical._replace(focus="")
+        with self._lock:
+            candidates = [(vector, key) for fields, vector, key in self._stores.get(store_id, ())
+                          if fields == structure]
+        if not candidates:
+            return None
+        scores = np.stack([vector for vector, _ in candidates]) @ embed(canonical.focus)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return candidates[best][1]
+        return None
+
+    def forget_store(self, store_id: str):
+        with self._lock:
+            self._stores.pop(store_id, None)
+
+
+# Singleton instance
+semantic_index = SemanticIndex()
@@ -0,0 +1,77 @@
+"""
+Conversation Module - Token-bounded rolling memory for follow-up questions
+The last few exchanges are kept close to verbatim; older ones are folded
+into a one-line-per-turn summary that is trimmed from the front, so the
+context added to every prompt stays under a fixed token budget however
+long the conversation runs. Only questions that refer back to earlier turns
+get that context; standalone ones are answered (and cached) as if asked alone.
+"""
+import os
+import re
+from collections import deque
+from prompt_packing import estimate_tokens
+
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", 400))
+RECENT_TURNS = 3
+RECENT_ANSWER_CHARS = 200
+SUMMARY_QUESTION_CHARS = 100
+SUMMARY_ANSWER_CHARS = 140
+
+
+# Wording that only makes sense against earlier turns: pronouns, demonstratives
+# and elliptical openers such as "and last week?" or "what about mugs?"
+_REFERS_BACK = re.compile(
+    r"^\s*(?:and|but|also|so|then|what about|how about|why|for|same)\b"
+    r"|\b(?:it|its|they|them|their|those|these|that one|this one|the same|above|earlier"
+    r"|instead|you said|your answer|last answer)\b",
+    re.IGNORECASE
+)
+
+
+def refers_back(question: str) -> bool:
+    """Whether the question leans on earlier turns rather than standing on its own"""
+    return bool(_REFERS_BACK.search(question))
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+class ConversationMemory:
+    """Recent turns plus a rolling summary of older ones, within `token_budget` tokens"""
+
+    def __init__(self, history=None, token_budget: int = CONVERSATION_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.turns = deque()
+        self.summary = deque()
+        self.total_turns = 0
+        for item in history or []:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return self.total_turns
+
+    def append(self, item: dict):
+        """Record one exchange ({"question": ..., "answer": ...})"""
+        self.turns.append({"question": item["question"], "answer": item["answer"][:RECENT_ANSWER_CHARS]})
+        self.total_turns += 1
+        while len(self.turns) > RECENT_TURNS:
+            self._fold(self.turns.popleft())
+        while len(self.turns) > 1 and estimate_tokens(self.context()) > self.token_budget:
+            self._fold(self.turns.popleft())
+        while self.summary and estimate_tokens(self.context()) > self.token_budget:
+            self.summary.popleft()
+
+    def _fold(self, turn: dict):
+        question = _first_sentence(turn["question"], SUMMARY_QUESTION_CHARS)
+        answer = _first_sentence(turn["answer"], SUMMARY_ANSWER_CHARS)
+        self.summary.append(f"- {question} -> {answer}")
+
+    def context(self) -> str:
+        """Prompt block describing the conversation so far"""
+        parts = []
+        if self.summary:
+            parts.append("Earlier in this conversation:\n" + "\n".join(self.summary))
+        parts.extend(f"Previous Q: {turn['question']}\nA: {turn['answer']}..." for turn in self.turns)
+        return "\n".join(parts)
@@ -0,0 +1,217 @@
+"""
+Fetch Planner Module - Works out which datasets a question needs and fetches them together
+A question can need orders, products and inventory levels at once ("what
+should I reorder based on last month's sales?"). The planner picks every
+dataset the intent and wording call for, runs the fetches concurrently under
+a per-store concurrency cap and keeps whatever succeeded when one of them
+fails, listing the rest as unavailable.
+"""
+import os
+import re
+import asyncio
+import logging
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from query_planner import plan_queries, window_days
+from prompt_packing import question_terms
+
+logger = logging.getLogger(__name__)
+
+# Concurrent Shopify fetches allowed per store (shared across requests)
+FETCH_CONCURRENCY_PER_STORE = int(os.getenv("FETCH_CONCURRENCY_PER_STORE", 3))
+# Worker threads shared by every synchronous multi-dataset fetch
+FETCH_THREADS = int(os.getenv("FETCH_THREADS", 16))
+
+ORDERS = "orders"
+PRODUCTS = "products"
+INVENTORY = "inventory"
+DATASETS = (ORDERS, PRODUCTS, INVENTORY)
+
+INTENT_DATASETS = {
+    "sales_analysis": (ORDERS,),
+    "order_info": (ORDERS,),
+    "inventory_check": (PRODUCTS, INVENTORY),
+    "product_info": (PRODUCTS,),
+    "general": (ORDERS, PRODUCTS)
+}
+
+# Wording that pulls in a dataset beyond the intent's primary one. "Top products"
+# is a sales ranking, so only catalogue wording fetches the product list
+_DATASET_CUES = {
+    ORDERS: re.compile(r"\b(sales?|sold|sell(?:ing|s)?|orders?|revenue|demand|velocity|last \w+ (?:days?|weeks?|months?))\b"),
+    PRODUCTS: re.compile(
+        r"\b(catalog(?:ue)?|variants?|prices?|pricing|listings?|(?:active|draft|archived) products?|how many products)\b"
+    ),
+    INVENTORY: re.compile(r"\b(stock|inventory|reorder|restock|run(?:ning)? out|locations?|warehouses?)\b")
+}
+
+# `queries`: QueryPlan per dataset with a projected query; None fetches full records.
+# `focus`: question terms whose matching rows are kept for the prompt whatever their rank
+FetchPlan = namedtuple(
+    "FetchPlan", ["intent", "datasets", "days_back", "max_pages", "queries", "focus"], defaults=(None, ())
+)
+
+
+def plan_datasets(intent: str, question: str = "") -> tuple:
+    """Datasets needed to answer the question, in DATASETS order"""
+    needed = set(INTENT_DATASETS.get(intent, INTENT_DATASETS["general"]))
+    text = question.lower()
+    for dataset, cue in _DATASET_CUES.items():
+        if cue.search(text):
+            needed.add(dataset)
+    # Stock questions are answered per product; inventory levels alone lack titles
+    if INVENTORY in needed:
+        needed.add(PRODUCTS)
+    return tuple(dataset for dataset in DATASETS if dataset in needed)
+
+
+def build_plan(intent: str, question: str, days_back: int, max_pages: int) -> FetchPlan:
+    """Datasets, date window and the smallest query for each, from the question"""
+    datasets = plan_datasets(intent, question)
+    days_back = window_days(question, days_back)
+    return FetchPlan(
+        intent, datasets, days_back, max_pages, plan_queries(intent, question, datasets, days_back),
+        tuple(sorted(question_terms(question)))
+    )
+
+
+def _fetchers(client, plan: FetchPlan) -> dict:
+    """One zero-argument callable per planned dataset (sync or async client alike)"""
+    calls = {
+        ORDERS: lambda: client.get_all_orders(days_back=plan.days_back, max_pages=plan.max_pages, focus=plan.focus),
+        PRODUCTS: lambda: client.get_all_products(max_pages=plan.max_pages, focus=plan.focus),
+        INVENTORY: lambda: client.get_all_inventory_levels(max_pages=plan.max_pages, focus=plan.focus)
+    }
+    queries = plan.queries or {}
+
+    def planned(query_plan):
+        return lambda: client.get_all_planned(query_plan, max_pages=plan.max_pages, focus=plan.focus)
+
+    return {
+        dataset: planned(queries[dataset]) if dataset in queries else calls[dataset]
+        for dataset in plan.datasets
+    }
+
+
+def _failure(response):
+    """Error text for a failed dataset response, or None if it succeeded"""
+    # gather(return_exceptions=True) also returns BaseExceptions such as CancelledError
+    if isinstance(response, BaseException):
+        return str(response) or type(response).__name__
+    if "error" in response:
+        return str(response["error"])
+    if "errors" in response:
+        return str(response["errors"])
+    return None
+
+
+def combine_results(results: dict) -> dict:
+    """
+    Merge per-dataset responses into {dataset: response, "unavailable": {...},
+    "pending": {...}}; pending datasets are partial while a snapshot load runs.
+    If every dataset failed, the first failure is returned as-is so callers
+    report it like a single failed fetch.
+    """
+    combined, unavailable, pending = {}, {}, {}
+    for dataset, response in results.items():
+        error = _failure(response)
+        if error is None:
+            combined[dataset] = response
+            if response.get("pending"):
+                pending[dataset] = response["pending"]
+        else:
+            logger.warning(f"Fetching {dataset} failed: {error}")
+            unavailable[dataset] = error
+    if not combined and unavailable:
+        dataset, error = next(iter(unavailable.items()))
+        response = results[dataset]
+        return response if isinstance(response, dict) else {"error": error}
+    if unavailable:
+        combined["unavailable"] = unavailable
+    if pending:
+        combined["pending"] = pending
+    return combined
+
+
+class _InUseLimits:
+    """Semaphores keyed by store that exist only while a fetch holds them, so idle stores cost nothing"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._entries = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [self._factory(), 0]
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._entries[key]
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+
+class FetchPlanner:
+    """Runs fetch plans with at most FETCH_CONCURRENCY_PER_STORE fetches in flight per store"""
+
+    def __init__(self, concurrency_per_store: int = FETCH_CONCURRENCY_PER_STORE, threads: int = FETCH_THREADS):
+        self.concurrency_per_store = max(1, concurrency_per_store)
+        self._semaphores = _InUseLimits(lambda: BoundedSemaphore(self.concurrency_per_store))
+        # Keyed by loop too: an asyncio.Semaphore is bound to the loop that first waits on it
+        self._async_semaphores = _InUseLimits(lambda: asyncio.Semaphore(self.concurrency_per_store))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="fetch")
+
+    def execute(self, client, plan: FetchPlan) -> dict:
+        """Fetch every planned dataset on worker threads"""
+        fetchers = _fetchers(client, plan)
+        with self._semaphores.hold(client.store_domain) as semaphore:
+
+            def run(fetch):
+                with semaphore:
+                    try:
+                        return fetch()
+                    except Exception as e:
+                        return e
+
+            if len(fetchers) == 1:
+                results = {dataset: run(fetch) for dataset, fetch in fetchers.items()}
+            else:
+                # Copy the context so spans recorded on worker threads land on this request's trace
+                futures = {dataset: self._pool.submit(contextvars.copy_context().run, run, fetch)
+                           for dataset, fetch in fetchers.items()}
+                results = {dataset: future.result() for dataset, future in futures.items()}
+        return combine_results(results)
+
+    async def execute_async(self, client, plan: FetchPlan) -> dict:
+        """Fetch every planned dataset concurrently on the event loop"""
+        fetchers = _fetchers(client, plan)
+        key = (client.store_domain, id(asyncio.get_running_loop()))
+        with self._async_semaphores.hold(key) as semaphore:
+
+            async def run(fetch):
+                async with semaphore:
+                    return await fetch()
+
+            outcomes = await asyncio.gather(*(run(fetch) for fetch in fetchers.values()), return_exceptions=True)
+        return combine_results(dict(zip(fetchers, outcomes)))
+
+    def stats(self) -> dict:
+        stores = set(self._semaphores.keys()) | {store for store, _ in self._async_semaphores.keys()}
+        return {"concurrency_per_store": self.concurrency_per_store, "active_stores": len(stores)}
+
+
+# Singleton instance
+fetch_planner = FetchPlanner()
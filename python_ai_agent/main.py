@@ -1,21 +1,53 @@
 import time
-from fastapi import FastAPI, HTTPException
+import json
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from agent import AnalyticsAgent
+from contextlib import asynccontextmanager
+from agent import AnalyticsAgent, async_analysis_flight
+from sessions import session_store
+from shopify_client import AsyncShopifyClient, InvalidStoreDomain, async_shopify_flight
 from metrics import metrics
+from rate_limiter import rate_limiter
+from fetch_planner import fetch_planner
+from snapshot import snapshot_store
+from webhooks import webhook_receiver, verify_webhook, UNINSTALL_TOPIC
+from answer_reuse import answer_reuse
+from admission import llm_scheduler, AdmissionRejected, set_request_deadline
+from prewarm import prewarmer
+from cache import answer_cache
+from tracing import start_trace, profiler
 import uvicorn
 import os
 import logging
+from typing import List, Optional
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Most questions accepted by one /analyze/batch request
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 20))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    answer_cache.start_expiry_thread()
+    profiler.start()
+    prewarmer.start()
+    yield
+    await prewarmer.stop()
+    profiler.stop()
+    answer_cache.stop_expiry_thread()
+    # Release pooled Shopify connections
+    await AsyncShopifyClient.close_all()
+
 app = FastAPI(
     title="Shopify AI Analytics Agent",
     description="LLM-powered analytics service for Shopify stores",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS for dashboard
@@ -31,6 +63,14 @@ class QuestionRequest(BaseModel):
     store_id: str
     question: str
     access_token: str
+    # Continue a conversation: same agent, memory and recent data across requests
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    store_id: str
+    questions: List[str]
+    access_token: str
+    session_id: Optional[str] = None
 
 @app.get("/health")
 def health_check():
@@ -39,11 +79,60 @@ def health_check():
 @app.get("/metrics")
 def get_metrics():
     """Expose metrics for monitoring and dashboard"""
-    return metrics.get_metrics()
+    return {
+        **metrics.get_metrics(),
+        "answer_cache": answer_cache.stats(),
+        "single_flight": {
+            "analyses": async_analysis_flight.stats(),
+            "shopify_queries": async_shopify_flight.stats()
+        },
+        "shopify_rate_limits": rate_limiter.get_status(),
+        "fetch_planner": fetch_planner.stats(),
+        "snapshot": snapshot_store.stats(),
+        "webhooks": webhook_receiver.stats(),
+        "answer_reuse": answer_reuse.stats(),
+        "llm_admission": llm_scheduler.stats(),
+        "prewarm": prewarmer.stats(),
+        "sessions": session_store.stats()
+    }
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics():
+    """Expose metrics in the Prometheus text exposition format"""
+    cache_stats = answer_cache.stats()
+    gauges = {
+        f"answer_cache_{name}": cache_stats[name]
+        for name in ("hits", "stale_hits", "misses", "evictions", "expirations", "entries", "bytes")
+        if name in cache_stats
+    }
+    admission = llm_scheduler.stats()
+    for name in ("in_flight", "queue_depth", "max_queue_depth", "admitted", "rejected", "expired"):
+        gauges[f"llm_{name}"] = admission[name]
+    gauges["coalesced_analyses"] = async_analysis_flight.stats()["coalesced"]
+    gauges["coalesced_shopify_queries"] = async_shopify_flight.stats()["coalesced"]
+    return PlainTextResponse(metrics.prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+def _apply_client_timeout(http_request: Request):
+    """Honour the caller's timeout so queued model calls are dropped once it has given up"""
+    timeout = http_request.headers.get("X-Request-Timeout")
+    try:
+        if timeout:
+            set_request_deadline(float(timeout))
+    except ValueError:
+        pass
+
+def _overloaded(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _observe(agent: AnalyticsAgent, access_token: str, questions: list):
+    """Let the prewarmer learn the store's common questions"""
+    for question in questions:
+        prewarmer.observe(agent.store_id, access_token, agent.get_cache_key(question), question)
 
 @app.post("/analyze")
-async def analyze_store(request: QuestionRequest):
+async def analyze_store(request: QuestionRequest, http_request: Request):
     start_time = time.time()
+    trace = start_trace("/analyze", store_id=request.store_id)
     logger.info(f"Received request for store: {request.store_id}")
     
     success = False
@@ -53,16 +142,30 @@ async def analyze_store(request: QuestionRequest):
     
     try:
         # Pass the token to the agent
-        agent = AnalyticsAgent(store_id=request.store_id, access_token=request.access_token)
+        agent = session_store.agent_for(request.store_id, request.session_id, request.access_token)
+        _apply_client_timeout(http_request)
+        _observe(agent, request.access_token, [request.question])
         
-        result = agent.process_question(request.question)
+        result = await agent.process_question_async(request.question)
         
         # Extract metadata for metrics
         success = "error" not in result
+        intent = result.get("intent")
         cache_hit = result.get("cached", False)
+        if not success:
+            error_type = "ShopifyError"
         
         return result
         
+    except AdmissionRejected as e:
+        logger.warning(f"Shedding request for store {request.store_id}: {e}")
+        error_type = type(e).__name__
+        raise _overloaded(e)
+
+    except InvalidStoreDomain as e:
+        error_type = type(e).__name__
+        raise HTTPException(status_code=400, detail=str(e))
+
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         error_type = type(e).__name__
@@ -79,6 +182,167 @@ async def analyze_store(request: QuestionRequest):
             error_type=error_type,
             cache_hit=cache_hit
         )
+        trace.attributes["intent"] = intent
+        trace.finish()
+        profiler.schedule_dump(trace)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_store_stream(request: QuestionRequest, http_request: Request):
+    """
+    Server-Sent Events variant of /analyze: sends the intent and computed
+    figures first, then the answer token by token as Gemini generates it.
+    """
+    logger.info(f"Received streaming request for store: {request.store_id}")
+    if llm_scheduler.queue_depth >= llm_scheduler.queue_limit:
+        # Shed before the stream starts so the client still gets a real 429
+        e = AdmissionRejected("Model queue is full", llm_scheduler.retry_after())
+        raise _overloaded(e)
+    try:
+        agent = session_store.agent_for(request.store_id, request.session_id, request.access_token)
+    except InvalidStoreDomain as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _observe(agent, request.access_token, [request.question])
+
+    async def event_stream():
+        start_time = time.time()
+        trace = start_trace("/analyze/stream", store_id=request.store_id)
+        _apply_client_timeout(http_request)
+        first_byte_ms = first_token_ms = last_token_ms = None
+        success = False
+        error_type = None
+        intent = None
+        cache_hit = False
+        try:
+            async for event, data in agent.stream_question(request.question):
+                elapsed_ms = (time.time() - start_time) * 1000
+                if first_byte_ms is None:
+                    first_byte_ms = elapsed_ms
+                if event == "meta":
+                    intent = data.get("intent")
+                    cache_hit = data.get("cached", False)
+                elif event == "token":
+                    if first_token_ms is None:
+                        first_token_ms = elapsed_ms
+                    last_token_ms = elapsed_ms
+                elif event == "done":
+                    success = True
+                elif event == "error":
+                    error_type = "AdmissionRejected" if "retry_after" in data else "ShopifyError"
+                yield _sse(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming request: {str(e)}")
+            error_type = type(e).__name__
+            yield _sse("error", {"error": str(e)})
+        finally:
+            response_time_ms = (time.time() - start_time) * 1000
+            metrics.record_stream(first_byte_ms, first_token_ms, last_token_ms)
+            metrics.record_request(
+                store_id=request.store_id,
+                success=success,
+                response_time_ms=response_time_ms,
+                intent=intent,
+                error_type=error_type,
+                cache_hit=cache_hit
+            )
+            trace.attributes["intent"] = intent
+            trace.finish()
+            profiler.schedule_dump(trace)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/analyze/batch")
+async def analyze_store_batch(request: BatchRequest, http_request: Request):
+    """
+    Answer several questions about one store in a single request. Each
+    dataset is fetched once for the whole batch and uncached questions share
+    combined model calls; results come back in question order.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+
+    start_time = time.time()
+    trace = start_trace("/analyze/batch", store_id=request.store_id)
+    logger.info(f"Received batch of {len(request.questions)} questions for store: {request.store_id}")
+
+    results = []
+    error_type = None
+    try:
+        agent = session_store.agent_for(request.store_id, request.session_id, request.access_token)
+        _apply_client_timeout(http_request)
+        _observe(agent, request.access_token, request.questions)
+        results = await agent.process_batch_async(request.questions)
+        return {"results": results}
+
+    except AdmissionRejected as e:
+        logger.warning(f"Shedding batch for store {request.store_id}: {e}")
+        error_type = type(e).__name__
+        raise _overloaded(e)
+
+    except InvalidStoreDomain as e:
+        error_type = type(e).__name__
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error(f"Error processing batch: {str(e)}")
+        error_type = type(e).__name__
+        raise HTTPException(status_code=500, detail=str(e))
+
+    finally:
+        # One metrics record per question, sharing the batch's response time
+        response_time_ms = (time.time() - start_time) * 1000
+        for result in results or [{}] * len(request.questions):
+            success = error_type is None and "error" not in result
+            metrics.record_request(
+                store_id=request.store_id,
+                success=success,
+                response_time_ms=response_time_ms,
+                intent=result.get("intent"),
+                error_type=error_type or (None if success else
+                                          "AdmissionRejected" if "retry_after" in result else "ShopifyError"),
+                cache_hit=result.get("cached", False)
+            )
+        trace.attributes["questions"] = len(request.questions)
+        trace.finish()
+        profiler.schedule_dump(trace)
+
+@app.post("/webhooks/shopify")
+async def shopify_webhook(request: Request):
+    """
+    Receiver for orders/create, orders/updated, orders/delete,
+    products/update, products/delete, inventory_levels/update and
+    app/uninstalled. Applies the change to the local snapshot and
+    invalidates only the affected store's dependent cached answers.
+    """
+    body = await request.body()
+    if not verify_webhook(body, request.headers.get("X-Shopify-Hmac-Sha256")):
+        webhook_receiver.rejected += 1
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+    store = request.headers.get("X-Shopify-Shop-Domain")
+    result = await asyncio.to_thread(
+        webhook_receiver.handle,
+        store,
+        request.headers.get("X-Shopify-Topic"),
+        payload
+    )
+    if result.get("status") == "ok":
+        if result["topic"] == UNINSTALL_TOPIC:
+            prewarmer.forget(store)
+        else:
+            prewarmer.notify_change(store)
+    return result
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
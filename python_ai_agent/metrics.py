@@ -1,16 +1,183 @@
 """
 Metrics Module - Tracks analytics for the AI service
-Provides in-memory metrics with optional persistence
+Provides in-memory metrics in fixed memory: latencies go into mergeable
+log-bucket histograms, per-store counts into a bounded heavy-hitters table
+and hourly counts into a ring buffer. Threads record into one of a fixed set
+of shards picked by thread id, so the hot path takes no global lock and
+short-lived worker threads leave nothing behind; shards are merged when scraped.
 """
+import os
+import math
 import time
 from datetime import datetime
 from collections import defaultdict
-from threading import Lock
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+HOURS_TRACKED = 24
+MAX_TRACKED_STORES = int(os.getenv("METRICS_MAX_STORES", 500))
+METRICS_SHARDS = int(os.getenv("METRICS_SHARDS", 16))
+
+# Prometheus histogram bucket bounds, in seconds
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram (HDR style): about 1% relative error from
+    10us to one hour in ~1000 fixed buckets. Histograms merge by adding counts.
+    """
+    MIN_MS = 0.01
+    MAX_MS = 3_600_000.0
+    GROWTH = 1.02
+    _LOG_GROWTH = math.log(GROWTH)
+    BUCKETS = int(math.ceil(math.log(MAX_MS / MIN_MS) / _LOG_GROWTH)) + 2
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def _index(cls, value_ms: float) -> int:
+        if value_ms <= cls.MIN_MS:
+            return 0
+        return min(cls.BUCKETS - 1, int(math.log(value_ms / cls.MIN_MS) / cls._LOG_GROWTH) + 1)
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> float:
+        return cls.MIN_MS * cls.GROWTH ** index
+
+    def record(self, value_ms: float):
+        self.counts[self._index(value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def merge(self, other: "LatencyHistogram"):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                # Geometric midpoint of the bucket, never above the observed max
+                return min(self.max, self.MIN_MS * self.GROWTH ** (i - 0.5)) if i else self.MIN_MS
+        return self.max
+
+    def cumulative(self, bounds_ms) -> list:
+        """Counts of observations at or below each bound (for Prometheus buckets)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds_ms:
+            while index < self.BUCKETS and self._upper_bound(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self, unit: str = "_ms") -> dict:
+        return {
+            "count": self.count,
+            f"average{unit}": round(self.total / self.count, 2) if self.count else 0,
+            f"p50{unit}": round(self.quantile(0.50), 2),
+            f"p95{unit}": round(self.quantile(0.95), 2),
+            f"p99{unit}": round(self.quantile(0.99), 2),
+            f"max{unit}": round(self.max, 2)
+        }
+
+
+class HeavyHitters:
+    """Space-Saving top-k counter: at most `capacity` keys, counts over-estimated by at most the evicted minimum"""
+
+    def __init__(self, capacity: int = MAX_TRACKED_STORES):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key, n: int = 1):
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = self.counts.get(key, 0) + n
+            return
+        smallest = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(smallest)
+        self.counts[key] = floor + n
+
+    def merge(self, other: "HeavyHitters"):
+        for key, n in list(other.counts.items()):
+            self.add(key, n)
+
+    def top(self, n: int = None) -> dict:
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return dict(ranked[:n] if n else ranked)
+
+
+class HourlyRing:
+    """Request counts for the last `hours` hours in a fixed ring of slots"""
+
+    def __init__(self, hours: int = HOURS_TRACKED):
+        self.hours = hours
+        self.slots = [(-1, 0)] * hours
+
+    def add(self, timestamp: float, n: int = 1):
+        hour = int(timestamp // 3600)
+        slot = hour % self.hours
+        slot_hour, count = self.slots[slot]
+        self.slots[slot] = (hour, count + n if slot_hour == hour else n)
+
+    def merge(self, other: "HourlyRing"):
+        for hour, count in other.slots:
+            if hour < 0:
+                continue
+            slot = hour % self.hours
+            slot_hour, existing = self.slots[slot]
+            if slot_hour == hour:
+                self.slots[slot] = (hour, existing + count)
+            elif slot_hour < hour:
+                self.slots[slot] = (hour, count)
+
+    def as_dict(self, now: float) -> dict:
+        current = int(now // 3600)
+        return {
+            datetime.fromtimestamp(hour * 3600).strftime("%Y-%m-%d %H:00"): count
+            for hour, count in sorted(self.slots)
+            if hour >= 0 and current - hour < self.hours
+        }
+
+
+class _Shard:
+    """One slice of the metrics, written by the threads hashed onto it under its own lock"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = defaultdict(float)
+        self.by_intent = defaultdict(int)
+        self.by_error = defaultdict(int)
+        self.by_cache_outcome = defaultdict(int)
+        self.by_store = HeavyHitters()
+        self.hourly = HourlyRing()
+        self.histograms = defaultdict(LatencyHistogram)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
 
 class MetricsCollector:
     _instance = None
     _lock = Lock()
-    
+
     def __new__(cls):
         if cls._instance is None:
             with cls._lock:
@@ -18,105 +185,236 @@ class MetricsCollector:
                     cls._instance = super().__new__(cls)
                     cls._instance._initialize()
         return cls._instance
-    
+
     def _initialize(self):
         """Initialize metrics storage"""
-        self.metrics = {
-            "total_requests": 0,
-            "successful_requests": 0,
-            "failed_requests": 0,
-            "cache_hits": 0,
-            "cache_misses": 0,
-            "total_response_time_ms": 0,
-            "requests_by_intent": defaultdict(int),
-            "requests_by_store": defaultdict(int),
-            "errors_by_type": defaultdict(int),
-            "hourly_requests": defaultdict(int),
-            "start_time": datetime.now().isoformat()
-        }
-        self._request_times = []  # For percentile calculations
-    
-    def record_request(self, store_id: str, success: bool, response_time_ms: float, 
+        self.start_time = datetime.now().isoformat()
+        self._shards = [_Shard() for _ in range(max(1, METRICS_SHARDS))]
+
+    @contextmanager
+    def _shard(self):
+        """The calling thread's shard, held for the duration of one update"""
+        shard = self._shards[hash(get_ident()) % len(self._shards)]
+        with shard.lock:
+            yield shard
+
+    def record_request(self, store_id: str, success: bool, response_time_ms: float,
                        intent: str = None, error_type: str = None, cache_hit: bool = False):
         """Record a single request's metrics"""
-        with self._lock:
-            self.metrics["total_requests"] += 1
-            self.metrics["total_response_time_ms"] += response_time_ms
-            self.metrics["requests_by_store"][store_id] += 1
-            
-            # Track hourly distribution
-            hour_key = datetime.now().strftime("%Y-%m-%d %H:00")
-            self.metrics["hourly_requests"][hour_key] += 1
-            
+        with self._shard() as shard:
+            counters = shard.counters
+            counters["total_requests"] += 1
+            counters["total_response_time_ms"] += response_time_ms
+            shard.by_store.add(store_id)
+            shard.hourly.add(time.time())
+
             if success:
-                self.metrics["successful_requests"] += 1
+                counters["successful_requests"] += 1
             else:
-                self.metrics["failed_requests"] += 1
+                counters["failed_requests"] += 1
                 if error_type:
-                    self.metrics["errors_by_type"][error_type] += 1
-            
+                    shard.by_error[error_type] += 1
+
             if intent:
-                self.metrics["requests_by_intent"][intent] += 1
-            
+                shard.by_intent[intent] += 1
+
             if cache_hit:
-                self.metrics["cache_hits"] += 1
+                counters["cache_hits"] += 1
             else:
-                self.metrics["cache_misses"] += 1
-            
-            # Store response times for percentile calculation (keep last 1000)
-            self._request_times.append(response_time_ms)
-            if len(self._request_times) > 1000:
-                self._request_times.pop(0)
-    
+                counters["cache_misses"] += 1
+
+            shard.histograms["request"].record(response_time_ms)
+
+    def record_stream(self, first_byte_ms: float, first_token_ms: float, last_token_ms: float):
+        """Record latency milestones of one streamed /analyze response"""
+        with self._shard() as shard:
+            for name, value in (("stream_first_byte", first_byte_ms), ("stream_first_token", first_token_ms),
+                                ("stream_last_token", last_token_ms)):
+                if value is not None:
+                    shard.histograms[name].record(value)
+
+    def record_stage(self, stage: str, duration_ms: float):
+        """Record the latency of one pipeline stage (see tracing.span)"""
+        with self._shard() as shard:
+            shard.histograms[f"stage:{stage}"].record(duration_ms)
+
+    def record_value(self, name: str, value: float):
+        """Record a size or cost (prompt chars, Shopify query cost, ...) into its distribution"""
+        with self._shard() as shard:
+            shard.histograms[f"value:{name}"].record(value)
+
+    def record_cache_outcome(self, outcome: str):
+        """Count a cache lookup outcome: hit, stale, miss, coalesced or bypass"""
+        with self._shard() as shard:
+            shard.by_cache_outcome[outcome] += 1
+
+    def _merged(self) -> _Shard:
+        """Merge every shard into one snapshot"""
+        merged = _Shard()
+        for shard in self._shards:
+            with shard.lock:
+                for name, value in shard.counters.items():
+                    merged.counters[name] += value
+                for name, value in shard.by_intent.items():
+                    merged.by_intent[name] += value
+                for name, value in shard.by_error.items():
+                    merged.by_error[name] += value
+                for name, value in shard.by_cache_outcome.items():
+                    merged.by_cache_outcome[name] += value
+                merged.by_store.merge(shard.by_store)
+                merged.hourly.merge(shard.hourly)
+                for name, histogram in shard.histograms.items():
+                    merged.histograms[name].merge(histogram)
+        return merged
+
+    def requests_by_store(self, top: int = None) -> dict:
+        """Request counts of the busiest stores"""
+        return self._merged().by_store.top(top)
+
     def get_metrics(self) -> dict:
         """Return current metrics snapshot"""
-        with self._lock:
-            total = self.metrics["total_requests"]
-            avg_response_time = (
-                self.metrics["total_response_time_ms"] / total if total > 0 else 0
-            )
-            
-            # Calculate percentiles
-            p50, p95, p99 = 0, 0, 0
-            if self._request_times:
-                sorted_times = sorted(self._request_times)
-                n = len(sorted_times)
-                p50 = sorted_times[int(n * 0.5)] if n > 0 else 0
-                p95 = sorted_times[int(n * 0.95)] if n > 0 else 0
-                p99 = sorted_times[int(n * 0.99)] if n > 0 else 0
-            
-            cache_total = self.metrics["cache_hits"] + self.metrics["cache_misses"]
-            cache_hit_rate = (
-                self.metrics["cache_hits"] / cache_total * 100 if cache_total > 0 else 0
-            )
-            
-            success_rate = (
-                self.metrics["successful_requests"] / total * 100 if total > 0 else 0
-            )
-            
-            return {
-                "summary": {
-                    "total_requests": total,
-                    "successful_requests": self.metrics["successful_requests"],
-                    "failed_requests": self.metrics["failed_requests"],
-                    "success_rate_percent": round(success_rate, 2),
-                    "cache_hit_rate_percent": round(cache_hit_rate, 2),
-                    "uptime_since": self.metrics["start_time"]
-                },
-                "response_times": {
-                    "average_ms": round(avg_response_time, 2),
-                    "p50_ms": round(p50, 2),
-                    "p95_ms": round(p95, 2),
-                    "p99_ms": round(p99, 2)
-                },
-                "breakdown": {
-                    "by_intent": dict(self.metrics["requests_by_intent"]),
-                    "by_store": dict(self.metrics["requests_by_store"]),
-                    "by_error_type": dict(self.metrics["errors_by_type"]),
-                    "hourly": dict(list(self.metrics["hourly_requests"].items())[-24:])
-                }
+        snapshot = self._merged()
+        counters = snapshot.counters
+        total = int(counters["total_requests"])
+        avg_response_time = (
+            counters["total_response_time_ms"] / total if total > 0 else 0
+        )
+
+        request_times = snapshot.histograms["request"]
+        streaming = {}
+        for name in ("first_byte", "first_token", "last_token"):
+            histogram = snapshot.histograms[f"stream_{name}"]
+            streaming[f"time_to_{name}_ms"] = {
+                "p50": round(histogram.quantile(0.50), 2),
+                "p95": round(histogram.quantile(0.95), 2),
+                "p99": round(histogram.quantile(0.99), 2)
+            }
+
+        cache_total = counters["cache_hits"] + counters["cache_misses"]
+        cache_hit_rate = (
+            counters["cache_hits"] / cache_total * 100 if cache_total > 0 else 0
+        )
+
+        success_rate = (
+            counters["successful_requests"] / total * 100 if total > 0 else 0
+        )
+
+        return {
+            "summary": {
+                "total_requests": total,
+                "successful_requests": int(counters["successful_requests"]),
+                "failed_requests": int(counters["failed_requests"]),
+                "success_rate_percent": round(success_rate, 2),
+                "cache_hit_rate_percent": round(cache_hit_rate, 2),
+                "uptime_since": self.start_time
+            },
+            "response_times": {
+                "average_ms": round(avg_response_time, 2),
+                "p50_ms": round(request_times.quantile(0.50), 2),
+                "p95_ms": round(request_times.quantile(0.95), 2),
+                "p99_ms": round(request_times.quantile(0.99), 2)
+            },
+            "streaming": streaming,
+            "stages": {
+                name.split(":", 1)[1]: histogram.summary()
+                for name, histogram in sorted(snapshot.histograms.items()) if name.startswith("stage:")
+            },
+            "values": {
+                name.split(":", 1)[1]: histogram.summary(unit="")
+                for name, histogram in sorted(snapshot.histograms.items()) if name.startswith("value:")
+            },
+            "breakdown": {
+                "by_intent": dict(snapshot.by_intent),
+                "by_cache_outcome": dict(snapshot.by_cache_outcome),
+                "by_store": snapshot.by_store.top(),
+                "by_error_type": dict(snapshot.by_error),
+                "hourly": snapshot.hourly.as_dict(time.time())
             }
-    
+        }
+
+    def prometheus(self, gauges: dict = None) -> str:
+        """
+        Render metrics in the Prometheus text exposition format.
+        `gauges` maps extra metric names to numeric values (e.g. cache sizes).
+        """
+        snapshot = self._merged()
+        counters = snapshot.counters
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric("agent_requests_total", "counter", "Analyze requests by outcome", [
+            ({"status": "success"}, int(counters["successful_requests"])),
+            ({"status": "failure"}, int(counters["failed_requests"]))
+        ])
+        metric("agent_cache_lookups_total", "counter", "Answer cache lookups by result", [
+            ({"result": "hit"}, int(counters["cache_hits"])),
+            ({"result": "miss"}, int(counters["cache_misses"]))
+        ])
+        metric("agent_requests_by_intent_total", "counter", "Analyze requests by classified intent",
+               [({"intent": k}, v) for k, v in snapshot.by_intent.items()])
+        metric("agent_errors_total", "counter", "Failed requests by error type",
+               [({"type": k}, v) for k, v in snapshot.by_error.items()])
+
+        metric("agent_cache_outcomes_total", "counter", "Answer cache lookups by outcome",
+               [({"outcome": k}, v) for k, v in snapshot.by_cache_outcome.items()])
+
+        bounds_ms = [bound * 1000 for bound in PROMETHEUS_BUCKETS]
+
+        def histogram_samples(name, histogram, labels):
+            cumulative = histogram.cumulative(bounds_ms)
+            for bound, count in zip(list(PROMETHEUS_BUCKETS) + ["+Inf"], cumulative + [histogram.count]):
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in {**labels, "le": bound}.items())
+                lines.append(f"{name}_bucket{{{label_text}}} {count}")
+            label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+            suffix = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{name}_sum{suffix} {histogram.total / 1000}")
+            lines.append(f"{name}_count{suffix} {histogram.count}")
+
+        histogram_help = {
+            "request": "End-to-end /analyze latency",
+            "stream_first_byte": "Streaming time to first byte",
+            "stream_first_token": "Streaming time to first answer token",
+            "stream_last_token": "Streaming time to last answer token"
+        }
+        for key, histogram in sorted(snapshot.histograms.items()):
+            if ":" in key:
+                continue
+            name = f"agent_{key}_duration_seconds"
+            lines.append(f"# HELP {name} {histogram_help.get(key, key)}")
+            lines.append(f"# TYPE {name} histogram")
+            histogram_samples(name, histogram, {})
+
+        stages = [(key.split(":", 1)[1], h) for key, h in sorted(snapshot.histograms.items())
+                  if key.startswith("stage:")]
+        if stages:
+            lines.append("# HELP agent_stage_duration_seconds Latency of each pipeline stage")
+            lines.append("# TYPE agent_stage_duration_seconds histogram")
+            for stage, histogram in stages:
+                histogram_samples("agent_stage_duration_seconds", histogram, {"stage": stage})
+
+        values = [(key.split(":", 1)[1], h) for key, h in sorted(snapshot.histograms.items())
+                  if key.startswith("value:")]
+        if values:
+            lines.append("# HELP agent_value Distribution of per-request sizes and costs")
+            lines.append("# TYPE agent_value summary")
+            for name, histogram in values:
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(f'agent_value{{name="{_escape_label(name)}",quantile="{q}"}} '
+                                 f'{round(histogram.quantile(q), 3)}')
+                lines.append(f'agent_value_sum{{name="{_escape_label(name)}"}} {histogram.total}')
+                lines.append(f'agent_value_count{{name="{_escape_label(name)}"}} {histogram.count}')
+
+        for name, value in sorted((gauges or {}).items()):
+            metric(f"agent_{name}", "gauge", name.replace("_", " "), [({}, value)])
+
+        return "\n".join(lines) + "\n"
+
     def reset(self):
         """Reset all metrics (useful for testing)"""
         with self._lock:
@@ -0,0 +1,201 @@
+"""
+Prewarm Module - Background precomputation of common answers for active stores
+The busiest stores (from metrics.requests_by_store) get their most asked
+canonical questions, plus a few quick-action defaults, answered ahead of
+time on a schedule and shortly after a webhook reports a data change. Work
+runs only while model slots are idle and the store's Shopify bucket is
+healthy, within a CPU share and an hourly model-call quota, so warm-up
+never competes with live traffic.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from threading import Lock
+from agent import AnalyticsAgent, async_analysis_flight
+from admission import llm_scheduler
+from cache import answer_cache, call_async, FRESH
+from sessions import session_store
+from metrics import metrics, MAX_TRACKED_STORES
+from rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "true").lower() == "true"
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", 900))
+PREWARM_TOP_STORES = int(os.getenv("PREWARM_TOP_STORES", 10))
+# Most asked questions per store warmed in addition to the defaults
+PREWARM_TOP_QUESTIONS = int(os.getenv("PREWARM_TOP_QUESTIONS", 3))
+PREWARM_QUESTIONS = [q.strip() for q in os.getenv(
+    "PREWARM_QUESTIONS",
+    "What are my top 5 selling products?|Which products are low on stock?|What was my revenue in the last 7 days?"
+).split("|") if q.strip()]
+# Share of one CPU the warm-up may use (measured on the whole process, so live load counts too)
+PREWARM_CPU_BUDGET = float(os.getenv("PREWARM_CPU_BUDGET", 0.1))
+PREWARM_MAX_CALLS_PER_HOUR = int(os.getenv("PREWARM_MAX_CALLS_PER_HOUR", 60))
+# Fraction of the Shopify query bucket that must be free before warming a store
+PREWARM_MIN_BUCKET = float(os.getenv("PREWARM_MIN_BUCKET", 0.5))
+# Wait after a webhook so a burst of changes is warmed once
+PREWARM_CHANGE_DELAY = float(os.getenv("PREWARM_CHANGE_DELAY", 30))
+PREWARM_TICK = 5.0
+QUESTIONS_TRACKED_PER_STORE = 50
+
+
+class Prewarmer:
+    """Keeps the answer cache warm for the questions active stores ask most"""
+
+    def __init__(self):
+        self._lock = Lock()
+        # store -> access token seen on its last live request; memory only
+        self._credentials = OrderedDict()
+        # store -> Counter of cache keys, and the latest wording of each key
+        self._asked = {}
+        self._wording = {}
+        self._changed = {}
+        self._calls = deque()
+        self._next_cycle = 0.0
+        self._task = None
+        self._counters = {"cycles": 0, "warmed": 0, "already_warm": 0, "deferred": 0, "failed": 0}
+
+    def observe(self, store_id: str, access_token: str, cache_key: str, question: str):
+        """Note a live question so the store and its common questions are warmed later"""
+        with self._lock:
+            self._credentials[store_id] = access_token
+            self._credentials.move_to_end(store_id)
+            if len(self._credentials) > MAX_TRACKED_STORES:
+                old_store, _ = self._credentials.popitem(last=False)
+                self._asked.pop(old_store, None)
+                self._wording.pop(old_store, None)
+            asked = self._asked.setdefault(store_id, Counter())
+            wording = self._wording.setdefault(store_id, {})
+            asked[cache_key] += 1
+            wording[cache_key] = question
+            if len(asked) > QUESTIONS_TRACKED_PER_STORE:
+                rare_key, _ = min(asked.items(), key=lambda item: item[1])
+                del asked[rare_key]
+                wording.pop(rare_key, None)
+
+    def notify_change(self, store_id: str):
+        """A webhook changed the store's data; rewarm it once the burst settles"""
+        with self._lock:
+            if store_id in self._credentials:
+                self._changed.setdefault(store_id, time.monotonic() + PREWARM_CHANGE_DELAY)
+
+    def forget(self, store_id: str):
+        """The store uninstalled the app; its token is revoked, so stop warming it"""
+        with self._lock:
+            self._credentials.pop(store_id, None)
+            self._asked.pop(store_id, None)
+            self._wording.pop(store_id, None)
+            self._changed.pop(store_id, None)
+
+    def questions_for(self, store_id: str) -> list:
+        with self._lock:
+            asked = self._asked.get(store_id, Counter())
+            wording = self._wording.get(store_id, {})
+            common = [wording[key] for key, _ in asked.most_common(PREWARM_TOP_QUESTIONS)]
+        return list(dict.fromkeys(common + PREWARM_QUESTIONS))
+
+    def _due_stores(self, now: float) -> list:
+        with self._lock:
+            due = [store for store, at in self._changed.items() if at <= now]
+            known = set(self._credentials)
+        if now >= self._next_cycle:
+            self._next_cycle = now + PREWARM_INTERVAL
+            self._counters["cycles"] += 1
+            due += [store for store in metrics.requests_by_store(PREWARM_TOP_STORES) if store in known]
+        return list(dict.fromkeys(due))
+
+    def _quota_left(self, now: float) -> bool:
+        while self._calls and self._calls[0] <= now - 3600:
+            self._calls.popleft()
+        return len(self._calls) < PREWARM_MAX_CALLS_PER_HOUR
+
+    def _idle(self, agent: AnalyticsAgent) -> bool:
+        """Live traffic owns the model slots and the Shopify bucket; only use spare capacity"""
+        admission = llm_scheduler.stats()
+        if admission["queue_depth"] or admission["in_flight"] * 2 >= admission["max_concurrency"]:
+            return False
+        bucket = rate_limiter.for_store(agent.client.store_domain).bucket.snapshot()
+        return bucket["available"] >= bucket["maximum_available"] * PREWARM_MIN_BUCKET
+
+    async def warm_store(self, store_id: str) -> bool:
+        """Answer the store's warm-up questions that are missing or stale; False if deferred"""
+        with self._lock:
+            access_token = self._credentials.get(store_id)
+        # The agent one-off requests for the store share, with its pooled clients
+        agent = session_store.agent_for(store_id, access_token=access_token)
+        for question in self.questions_for(store_id):
+            cache_key = agent.get_cache_key(question)
+            # Peek, so warm-up checks do not count as cache hits or misses
+            if await call_async(answer_cache, answer_cache.peek, cache_key) == FRESH:
+                self._counters["already_warm"] += 1
+                continue
+            if not self._idle(agent) or not self._quota_left(time.monotonic()):
+                self._counters["deferred"] += 1
+                return False
+
+            cpu_start, wall_start = time.process_time(), time.monotonic()
+            self._calls.append(wall_start)
+            try:
+                result = await async_analysis_flight.do(cache_key, lambda: agent._answer_async(question))
+                self._counters["failed" if "error" in result else "warmed"] += 1
+            except Exception as e:
+                logger.warning(f"Prewarm failed for {store_id}: {e}")
+                self._counters["failed"] += 1
+            # Pace so warm-up CPU stays within its share of wall time
+            cpu_used = time.process_time() - cpu_start
+            pause = cpu_used / PREWARM_CPU_BUDGET - (time.monotonic() - wall_start)
+            if pause > 0:
+                await asyncio.sleep(pause)
+        return True
+
+    async def run_once(self):
+        """Warm every store that is due; deferred stores are retried on the next tick"""
+        due = self._due_stores(time.monotonic())
+        for position, store_id in enumerate(due):
+            if await self.warm_store(store_id):
+                with self._lock:
+                    self._changed.pop(store_id, None)
+                continue
+            with self._lock:
+                for store in due[position:]:
+                    self._changed.setdefault(store, time.monotonic() + PREWARM_TICK)
+            break
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PREWARM_TICK)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Prewarm cycle failed: {e}")
+
+    def start(self):
+        if PREWARM_ENABLED and self._task is None:
+            self._next_cycle = time.monotonic() + PREWARM_INTERVAL
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "enabled": PREWARM_ENABLED,
+                "tracked_stores": len(self._credentials),
+                "pending_changes": len(self._changed),
+                "model_calls_last_hour": len(self._calls)
+            }
+
+
+# Singleton instance
+prewarmer = Prewarmer()
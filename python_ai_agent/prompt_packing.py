@@ -0,0 +1,240 @@
+"""
+Prompt Packing Module - Token-budgeted serialization of store data
+Strips the GraphQL edges/node/shopMoney nesting, emits one dense CSV row per
+order line or product, ranks the rows by how useful they are for the intent
+and keeps whole rows until the token budget is spent. PromptNodes picks the
+few nodes any of those rankings can use while pages stream past, so fetches
+need not hold every record.
+"""
+import os
+import re
+import csv
+import io
+import heapq
+from analytics import unwrap_nodes, to_float, dataset_responses
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))
+# Nodes kept per ranking while streaming a dataset; a budgeted prompt never uses more
+PROMPT_RETAINED_NODES = int(os.getenv("PROMPT_RETAINED_NODES", 200))
+
+ORDER_LINE_HEADER = ["order", "date", "product", "qty", "unit_price", "line_total", "order_total"]
+PRODUCT_HEADER = ["product", "status", "inventory", "variants", "min_price", "max_price"]
+INVENTORY_HEADER = ["sku", "tracked", "location", "available"]
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local token estimate: words, runs of up to three digits and punctuation each
+    count as one token. A heuristic; set EXACT_TOKEN_COUNT to measure with the model.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+
+def question_terms(question: str) -> set:
+    """Words of the question that boost rows mentioning them"""
+    return {word for word in re.findall(r"[a-z0-9]+", question.lower()) if len(word) > 2}
+
+
+def _mentions(title: str, terms: set) -> bool:
+    return bool(terms) and bool(terms & set(re.findall(r"[a-z0-9]+", title.lower())))
+
+
+def order_line_rows(orders: list, intent: str, question: str = "") -> list:
+    """Flatten orders into (score, row) pairs, one per line item"""
+    terms = question_terms(question)
+    rows = []
+    for recency, order in enumerate(orders):
+        money = (order.get("totalPriceSet") or {}).get("shopMoney") or {}
+        order_total = to_float(money.get("amount"))
+        date = (order.get("createdAt") or "")[:10]
+        for item in unwrap_nodes(order.get("lineItems")) or [{}]:
+            title = item.get("title") or ""
+            quantity = item.get("quantity") or 0
+            price = to_float((item.get("variant") or {}).get("price"))
+            line_total = round(quantity * price, 2)
+            if intent == "sales_analysis":
+                score = line_total
+            else:
+                # Orders arrive newest first
+                score = -recency
+            if _mentions(title, terms):
+                score += 1e9
+            rows.append((score, [order.get("name") or order.get("id"), date, title, quantity,
+                                 price, line_total, order_total]))
+    return rows
+
+
+def product_rows(products: list, intent: str, question: str = "") -> list:
+    """Flatten products into (score, row) pairs"""
+    terms = question_terms(question)
+    rows = []
+    for position, product in enumerate(products):
+        prices = [to_float(v.get("price")) for v in unwrap_nodes(product.get("variants"))]
+        inventory = product.get("totalInventory")
+        if intent == "inventory_check":
+            # Lowest stock first
+            score = -to_float(inventory)
+        else:
+            score = -position
+        title = product.get("title") or ""
+        if _mentions(title, terms):
+            score += 1e9
+        rows.append((score, [title, product.get("status"), inventory, len(prices),
+                             min(prices) if prices else "", max(prices) if prices else ""]))
+    return rows
+
+
+def inventory_rows(items: list, intent: str, question: str = "") -> list:
+    """Flatten inventory items into (score, row) pairs, one per location level"""
+    terms = question_terms(question)
+    rows = []
+    for item in items:
+        sku = item.get("sku") or ""
+        for level in unwrap_nodes(item.get("inventoryLevels")):
+            available = level.get("available")
+            # Emptiest levels first
+            score = -to_float(available)
+            if _mentions(sku, terms):
+                score += 1e9
+            rows.append((score, [sku, item.get("tracked"), (level.get("location") or {}).get("name"),
+                                 available]))
+    return rows
+
+
+def _best_line_total(order: dict) -> float:
+    lines = unwrap_nodes(order.get("lineItems"))
+    return max(((line.get("quantity") or 0) * to_float((line.get("variant") or {}).get("price"))
+                for line in lines), default=0.0)
+
+
+def _emptiest_level(item: dict) -> float:
+    return -min((to_float(level.get("available")) for level in unwrap_nodes(item.get("inventoryLevels"))),
+                default=0.0)
+
+
+# Per connection: the ranking packing applies beyond arrival order, and the titles it matches terms against
+_NODE_RANKINGS = {
+    "orders": _best_line_total,
+    "products": lambda product: -to_float(product.get("totalInventory")),
+    "inventoryItems": _emptiest_level
+}
+_NODE_TITLES = {
+    "orders": lambda order: [line.get("title") or "" for line in unwrap_nodes(order.get("lineItems"))],
+    "products": lambda product: [product.get("title") or ""],
+    "inventoryItems": lambda item: [item.get("sku") or ""]
+}
+
+
+class PromptNodes:
+    """
+    Bounded pick of a connection's nodes as pages stream past: the first
+    `limit` (rows are otherwise ranked by arrival), the top `limit` by the
+    connection's ranking and up to `limit` mentioning the question's terms.
+    Kept nodes come back in arrival order, so positional scores still hold.
+    """
+
+    def __init__(self, connection: str, terms=(), limit: int = None):
+        self.ranking = _NODE_RANKINGS.get(connection)
+        self.titles = _NODE_TITLES.get(connection, lambda node: [])
+        self.terms = set(terms)
+        self.limit = PROMPT_RETAINED_NODES if limit is None else limit
+        self.seen = 0
+        self._first = []
+        self._top = []
+        self._mentioned = []
+
+    def add_page(self, nodes: list):
+        for node in nodes:
+            sequence = self.seen
+            self.seen += 1
+            if sequence < self.limit:
+                self._first.append((sequence, node))
+            if self.ranking is not None and self.limit:
+                # Min-heap of the best `limit`; sequences are unique, so nodes are never compared
+                entry = (self.ranking(node), sequence, node)
+                if len(self._top) < self.limit:
+                    heapq.heappush(self._top, entry)
+                else:
+                    heapq.heappushpop(self._top, entry)
+            if (len(self._mentioned) < self.limit
+                    and any(_mentions(title, self.terms) for title in self.titles(node))):
+                self._mentioned.append((sequence, node))
+
+    def nodes(self) -> list:
+        kept = dict(self._first + self._mentioned)
+        kept.update((sequence, node) for _, sequence, node in self._top)
+        return [kept[sequence] for sequence in sorted(kept)]
+
+
+def pack_rows(header: list, scored_rows: list, token_budget: int, count_tokens=None) -> str:
+    """
+    Greedily keep the highest-scoring whole rows within `token_budget`.
+    Rows are sized with the local estimate; when `count_tokens` (a real
+    tokenizer) is given, the packed block is measured once and trimmed until
+    it fits.
+    """
+    if not scored_rows or token_budget <= 0:
+        return ""
+    ranked = [_csv_line(row) for _, row in sorted(scored_rows, key=lambda pair: pair[0], reverse=True)]
+    header_line = _csv_line(header)
+
+    def render(count):
+        note = f"# {count} of {len(ranked)} rows, most relevant first"
+        return "\n".join([note, header_line] + ranked[:count])
+
+    used = estimate_tokens(render(0)) + 1
+    kept = 0
+    for line in ranked:
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        used += cost
+        kept += 1
+
+    if count_tokens is not None:
+        for _ in range(3):
+            if kept == 0:
+                break
+            actual = count_tokens(render(kept))
+            if actual <= token_budget:
+                break
+            kept = int(kept * token_budget / actual * 0.95)
+    return render(kept) if kept else ""
+
+
+def pack_store_data(data: dict, intent: str, question: str = "",
+                    token_budget: int = PROMPT_TOKEN_BUDGET, count_tokens=None) -> str:
+    """Serialize a fetch_relevant_data payload into budgeted CSV sections"""
+    sections = []
+    for response in dataset_responses(data):
+        payload = (response or {}).get("data") or {}
+        if "orders" in payload:
+            sections.append(("Order lines", ORDER_LINE_HEADER,
+                             order_line_rows(unwrap_nodes(payload["orders"]), intent, question)))
+        if "products" in payload:
+            sections.append(("Products", PRODUCT_HEADER,
+                             product_rows(unwrap_nodes(payload["products"]), intent, question)))
+        if "inventoryItems" in payload:
+            sections.append(("Inventory levels", INVENTORY_HEADER,
+                             inventory_rows(unwrap_nodes(payload["inventoryItems"]), intent, question)))
+
+    sections = [section for section in sections if section[2]]
+    if not sections:
+        return ""
+
+    # Split the budget evenly between datasets
+    share = token_budget // len(sections)
+    blocks = []
+    for title, header, rows in sections:
+        block = pack_rows(header, rows, share, count_tokens)
+        if block:
+            blocks.append(f"{title}:\n{block}")
+    return "\n\n".join(blocks)
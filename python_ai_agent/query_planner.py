@@ -0,0 +1,166 @@
+"""
+Query Planner Module - Smallest GraphQL query for each planned dataset
+From the parsed question, picks only the fields the answer needs (order
+line items and product variants are the expensive nested connections),
+a server-side search filter (date window, product title) and a sort key
+that puts the relevant records on the first pages. The snapshot applies
+the same plan locally.
+"""
+import os
+import re
+from collections import namedtuple
+from canonical import parse_question, normalize_question
+from shopify_client import orders_date_filter
+
+# Longest window a question may ask for ("last year")
+MAX_WINDOW_DAYS = int(os.getenv("MAX_WINDOW_DAYS", 365))
+
+QueryPlan = namedtuple(
+    "QueryPlan", ["dataset", "connection", "query", "variables", "days_back", "title_terms", "nested"]
+)
+
+ORDER_FIELDS = """
+        id
+        name
+        createdAt
+        totalPriceSet {
+          shopMoney {
+            amount
+            currencyCode
+          }
+        }"""
+
+ORDER_LINE_ITEMS = """
+        lineItems(first: 10) {
+          edges {
+            node {
+              title
+              quantity
+              variant {
+                price
+              }
+            }
+          }
+        }"""
+
+PRODUCT_FIELDS = """
+        id
+        title
+        status
+        totalInventory"""
+
+PRODUCT_VARIANTS = """
+        variants(first: 5) {
+          edges {
+            node {
+              id
+              title
+              price
+              inventoryQuantity
+            }
+          }
+        }"""
+
+# Intents whose answers are about individual products, so orders need their line items
+LINE_ITEM_INTENTS = ("inventory_check", "product_info", "general")
+_LINE_ITEM_CUES = re.compile(
+    r"\b(products?|items?|sell\w*|sold|best|top|units?|quantity|bought|purchased|reorder\w*|restock\w*"
+    r"|demand|velocity|run(?:ning)? out)\b"
+)
+_VARIANT_CUES = re.compile(r"\b(variants?|sizes?|colou?rs?|prices?|priced|pricing|skus?|options?|cheap\w*|expensive)\b")
+_LARGEST_CUES = re.compile(r"\b(largest|biggest|highest|most expensive)\b")
+_LOW_STOCK_CUES = re.compile(r"\b(low|lowest|out of stock|run(?:ning)? out|reorder\w*|restock\w*)\b")
+
+
+def _connection_query(operation: str, connection: str, sort_type: str, fields: str) -> str:
+    return f"""
+query {operation}($first: Int!, $after: String, $query: String,
+               $sortKey: {sort_type}, $reverse: Boolean) {{
+  {connection}(first: $first, after: $after, query: $query, sortKey: $sortKey, reverse: $reverse) {{
+    pageInfo {{
+      hasNextPage
+      endCursor
+    }}
+    edges {{
+      node {{{fields}
+      }}
+    }}
+  }}
+}}
+"""
+
+
+def window_days(question: str, default: int) -> int:
+    """Days of orders to fetch: the question's own window, else `default`"""
+    days = parse_question(question).window_days
+    return min(days, MAX_WINDOW_DAYS) if days else default
+
+
+def title_search(terms) -> str:
+    """Shopify search syntax matching titles with a word starting with each term"""
+    return " AND ".join(f"title:{term}*" for term in terms)
+
+
+def plan_orders(intent: str, question: str, days_back: int) -> QueryPlan:
+    parsed = parse_question(question)
+    text = question.lower()
+    line_items = bool(
+        intent in LINE_ITEM_INTENTS or parsed.top_n or parsed.product or _LINE_ITEM_CUES.search(text)
+    )
+    sort_key, reverse = ("TOTAL_PRICE", True) if _LARGEST_CUES.search(text) else ("CREATED_AT", True)
+    query = _connection_query(
+        "GetOrdersPlanned", "orders", "OrderSortKeys", ORDER_FIELDS + (ORDER_LINE_ITEMS if line_items else "")
+    )
+    variables = {"query": orders_date_filter(days_back), "sortKey": sort_key, "reverse": reverse}
+    return QueryPlan("orders", "orders", query, variables, days_back, (), line_items)
+
+
+def plan_products(intent: str, question: str) -> QueryPlan:
+    parsed = parse_question(question)
+    text = question.lower()
+    terms = tuple(normalize_question(parsed.product)) if parsed.product else ()
+    variants = bool(terms or _VARIANT_CUES.search(text))
+    if intent == "inventory_check" or _LOW_STOCK_CUES.search(text):
+        # Lowest stock first, so a page cap keeps the products that matter
+        sort_key, reverse = "INVENTORY_TOTAL", False
+    else:
+        sort_key, reverse = "ID", False
+    query = _connection_query(
+        "GetProductsPlanned", "products", "ProductSortKeys", PRODUCT_FIELDS + (PRODUCT_VARIANTS if variants else "")
+    )
+    variables = {"query": title_search(terms) or None, "sortKey": sort_key, "reverse": reverse}
+    return QueryPlan("products", "products", query, variables, None, terms, variants)
+
+
+def plan_queries(intent: str, question: str, datasets, days_back: int) -> dict:
+    """QueryPlan per dataset that has a projected form (inventory keeps its fixed query)"""
+    queries = {}
+    if "orders" in datasets:
+        queries["orders"] = plan_orders(intent, question, days_back)
+    if "products" in datasets:
+        queries["products"] = plan_products(intent, question)
+    return queries
+
+
+def _title_matches(title: str, terms) -> bool:
+    words = normalize_question(title or "")
+    return all(any(word.startswith(term) for word in words) for term in terms)
+
+
+def apply_locally(nodes: list, plan: QueryPlan) -> list:
+    """The plan's filter, sort and projection over full locally stored nodes"""
+    if plan.title_terms:
+        nodes = [node for node in nodes if _title_matches(node.get("title"), plan.title_terms)]
+    sort_key = plan.variables.get("sortKey")
+    if sort_key == "INVENTORY_TOTAL":
+        nodes = sorted(nodes, key=lambda node: node.get("totalInventory") or 0)
+    elif sort_key == "TOTAL_PRICE":
+        nodes = sorted(
+            nodes,
+            key=lambda node: float(((node.get("totalPriceSet") or {}).get("shopMoney") or {}).get("amount") or 0),
+            reverse=True
+        )
+    if not plan.nested:
+        nested = "lineItems" if plan.dataset == "orders" else "variants"
+        nodes = [{key: value for key, value in node.items() if key != nested} for node in nodes]
+    return nodes
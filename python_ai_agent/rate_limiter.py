@@ -0,0 +1,193 @@
+"""
+Rate Limiter Module - Cost-aware pacing for the Shopify GraphQL Admin API
+Mirrors each store's leaky bucket from `extensions.cost.throttleStatus`, so
+queries are delayed before Shopify would throttle them, and trips a per-store
+circuit breaker when a store keeps failing.
+"""
+import os
+import random
+import time
+import hashlib
+from threading import Lock
+
+# Shopify's standard plan defaults until the first response tells us otherwise
+DEFAULT_MAXIMUM_AVAILABLE = 1000.0
+DEFAULT_RESTORE_RATE = 50.0
+DEFAULT_QUERY_COST = 50.0
+
+MAX_RETRIES = int(os.getenv("SHOPIFY_MAX_RETRIES", 4))
+BACKOFF_BASE_SECONDS = float(os.getenv("SHOPIFY_BACKOFF_BASE", 0.5))
+BACKOFF_CAP_SECONDS = float(os.getenv("SHOPIFY_BACKOFF_CAP", 20))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("SHOPIFY_BREAKER_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("SHOPIFY_BREAKER_RESET", 30))
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open after a cooldown"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = Lock()
+
+    def allow_request(self) -> bool:
+        """Whether a call may go out now; only one trial call passes while half-open"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a trial call through"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class ThrottleBucket:
+    """
+    Local model of a store's query-cost leaky bucket.
+    Callers reserve the expected cost before sending; the reservation is
+    reconciled with Shopify's throttleStatus after every response.
+    """
+
+    def __init__(self):
+        self.maximum_available = DEFAULT_MAXIMUM_AVAILABLE
+        self.restore_rate = DEFAULT_RESTORE_RATE
+        self.available = DEFAULT_MAXIMUM_AVAILABLE
+        self.updated_at = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.available = min(self.maximum_available, self.available + elapsed * self.restore_rate)
+        self.updated_at = now
+
+    def reserve(self, cost: float) -> float:
+        """Reserve `cost` points and return how long to wait before sending"""
+        with self._lock:
+            self._refill(time.monotonic())
+            cost = min(cost, self.maximum_available)
+            self.available -= cost
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.restore_rate
+
+    def update(self, throttle_status: dict):
+        """Reconcile with the throttleStatus Shopify reported"""
+        with self._lock:
+            self.maximum_available = float(throttle_status.get("maximumAvailable", self.maximum_available))
+            self.restore_rate = float(throttle_status.get("restoreRate", self.restore_rate)) or DEFAULT_RESTORE_RATE
+            self.available = float(throttle_status.get("currentlyAvailable", self.available))
+            self.updated_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "available": round(self.available, 1),
+                "maximum_available": self.maximum_available,
+                "restore_rate": self.restore_rate
+            }
+
+
+class StoreLimiter:
+    """Bucket, breaker and learned query costs for a single store"""
+
+    def __init__(self):
+        self.bucket = ThrottleBucket()
+        self.breaker = CircuitBreaker()
+        self.throttled_count = 0
+        self._query_costs = {}
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return hashlib.md5(query.encode()).hexdigest()
+
+    def estimated_cost(self, query: str) -> float:
+        return self._query_costs.get(self._query_key(query), DEFAULT_QUERY_COST)
+
+    def reserve(self, query: str) -> float:
+        """Reserve the expected cost of `query`; returns the delay before sending"""
+        return self.bucket.reserve(self.estimated_cost(query))
+
+    def observe(self, query: str, body: dict):
+        """Learn the query's cost and the bucket state from a GraphQL response"""
+        cost = (body.get("extensions") or {}).get("cost") or {}
+        if "requestedQueryCost" in cost:
+            self._query_costs[self._query_key(query)] = float(cost["requestedQueryCost"])
+        if cost.get("throttleStatus"):
+            self.bucket.update(cost["throttleStatus"])
+
+    def record_throttle(self):
+        """Count a THROTTLED response; the next reserve() waits for the refill"""
+        self.throttled_count += 1
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's hint"""
+        jitter = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+        return max(jitter, retry_after or 0.0)
+
+
+class ShopifyRateLimiter:
+    """Registry of per-store limiters"""
+
+    def __init__(self):
+        self._stores = {}
+        self._lock = Lock()
+
+    def for_store(self, store_domain: str) -> StoreLimiter:
+        with self._lock:
+            limiter = self._stores.get(store_domain)
+            if limiter is None:
+                limiter = StoreLimiter()
+                self._stores[store_domain] = limiter
+            return limiter
+
+    def get_status(self) -> dict:
+        """Bucket and breaker state for every known store"""
+        with self._lock:
+            stores = dict(self._stores)
+        return {
+            store: {
+                **limiter.bucket.snapshot(),
+                "breaker": limiter.breaker.state,
+                "throttled": limiter.throttled_count
+            }
+            for store, limiter in stores.items()
+        }
+
+
+# Singleton instance
+rate_limiter = ShopifyRateLimiter()
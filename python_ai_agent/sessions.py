@@ -0,0 +1,120 @@
+"""
+Sessions Module - Reusable agents for multi-turn conversations
+Requests that carry a session id get the same AnalyticsAgent (and so the
+same Shopify clients, Gemini model, conversation memory and recent fetch)
+for every turn. Idle sessions expire and the least recently used are
+evicted beyond SESSION_MAX_COUNT, so memory stays bounded. Requests
+without a session id share one stateless agent per store and credentials.
+"""
+import os
+import time
+import hmac
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+from agent import AnalyticsAgent
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", 1000))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", 1800))
+SHARED_AGENT_MAX_COUNT = int(os.getenv("SHARED_AGENT_MAX_COUNT", 100))
+
+
+def _token_digest(access_token: str) -> bytes:
+    return hashlib.sha256((access_token or "").encode()).digest()
+
+
+class _Session:
+    __slots__ = ("agent", "token_digest", "last_used")
+
+    def __init__(self, agent: AnalyticsAgent, token_digest: bytes):
+        self.agent = agent
+        self.token_digest = token_digest
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """LRU map of (store, session id) -> agent with idle expiry"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT, idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 max_shared: int = SHARED_AGENT_MAX_COUNT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_shared = max_shared
+        self._sessions = OrderedDict()
+        self._shared = OrderedDict()
+        self._lock = Lock()
+        self._counters = {"created": 0, "reused": 0, "expired": 0, "evicted": 0, "shared_created": 0}
+
+    def agent_for(self, store_id: str, session_id: str = None, access_token: str = None) -> AnalyticsAgent:
+        """The session's agent, or the store's shared stateless agent when no session id is given"""
+        digest = _token_digest(access_token)
+        if not session_id:
+            return self._shared_agent(store_id, access_token, digest)
+        key = (store_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(key)
+            # A session only continues for the credentials that started it
+            if session is not None and hmac.compare_digest(session.token_digest, digest):
+                session.last_used = now
+                self._sessions.move_to_end(key)
+                self._counters["reused"] += 1
+                return session.agent
+
+        agent = AnalyticsAgent(store_id=store_id, access_token=access_token)
+        with self._lock:
+            self._sessions[key] = _Session(agent, digest)
+            self._sessions.move_to_end(key)
+            self._counters["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters["evicted"] += 1
+        return agent
+
+    def _shared_agent(self, store_id: str, access_token: str, digest: bytes) -> AnalyticsAgent:
+        """One stateless agent (clients and model) per store and credentials, LRU-bounded"""
+        key = (store_id, digest)
+        with self._lock:
+            agent = self._shared.get(key)
+            if agent is not None:
+                self._shared.move_to_end(key)
+                return agent
+
+        agent = AnalyticsAgent(store_id=store_id, access_token=access_token, stateful=False)
+        with self._lock:
+            # Another request may have built one meanwhile; keep the first
+            if self._shared.setdefault(key, agent) is agent:
+                self._counters["shared_created"] += 1
+            agent = self._shared[key]
+            self._shared.move_to_end(key)
+            while len(self._shared) > self.max_shared:
+                self._shared.popitem(last=False)
+        return agent
+
+    def _expire(self, now: float):
+        """Drop sessions idle past the timeout; the LRU end is always the oldest"""
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_timeout:
+                break
+            del self._sessions[key]
+            self._counters["expired"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                **self._counters,
+                "active": len(self._sessions),
+                "shared_agents": len(self._shared),
+                "max_sessions": self.max_sessions,
+                "idle_timeout_seconds": self.idle_timeout
+            }
+
+
+# Singleton instance
+session_store = SessionStore()
@@ -1,135 +1,656 @@
 import requests
+import httpx
+import asyncio
 import json
 import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from rate_limiter import rate_limiter, MAX_RETRIES
+from singleflight import SingleFlight, AsyncSingleFlight
+from tracing import span, record_value
+from analytics import analytics_for, TOP_N
+from prompt_packing import PromptNodes
+from bulk_operations import (
+    RUN_BULK_QUERY_MUTATION, BULK_OPERATION_STATUS_QUERY, BULK_FAILED_STATUSES,
+    BULK_POLL_INTERVAL, BULK_POLL_MAX_INTERVAL, BULK_TIMEOUT, rebuild_bulk_records, parse_jsonl_lines
+)
 
 logger = logging.getLogger(__name__)
 
+API_VERSION = "2024-10"
+REQUEST_TIMEOUT = float(os.getenv("SHOPIFY_TIMEOUT_SECONDS", 30))
+MAX_CONNECTIONS_PER_STORE = int(os.getenv("SHOPIFY_MAX_CONNECTIONS", 10))
+PAGE_SIZE = 100  # Shopify allows up to 250 nodes per page
+# Point the clients at a local stand-in instead of https://<store>
+SHOPIFY_API_BASE_URL = os.getenv("SHOPIFY_API_BASE_URL")
+# Store ids a caller may name; any other host would be sent the caller's access token
+STORE_DOMAIN_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]*\.myshopify\.com$")
+
+ORDERS_QUERY = """
+query GetOrders($first: Int!, $after: String, $query: String,
+               $sortKey: OrderSortKeys = CREATED_AT, $reverse: Boolean = true) {
+  orders(first: $first, after: $after, query: $query, sortKey: $sortKey, reverse: $reverse) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    edges {
+      node {
+        id
+        name
+        createdAt
+        updatedAt
+        totalPriceSet {
+          shopMoney {
+            amount
+            currencyCode
+          }
+        }
+        lineItems(first: 10) {
+          edges {
+            node {
+              title
+              quantity
+              variant {
+                price
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+PRODUCTS_QUERY = """
+query GetProducts($first: Int!, $after: String, $query: String,
+                 $sortKey: ProductSortKeys = ID, $reverse: Boolean = false) {
+  products(first: $first, after: $after, query: $query, sortKey: $sortKey, reverse: $reverse) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    edges {
+      node {
+        id
+        title
+        status
+        updatedAt
+        totalInventory
+        variants(first: 5) {
+          edges {
+            node {
+              id
+              title
+              price
+              inventoryQuantity
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+INVENTORY_QUERY = """
+query GetInventory($first: Int!, $after: String) {
+  inventoryItems(first: $first, after: $after) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    edges {
+      node {
+        id
+        sku
+        tracked
+        inventoryLevels(first: 5) {
+          edges {
+            node {
+              available
+              location {
+                name
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class ShopifyAPIError(Exception):
+    """Raised by the paginated iterators when Shopify returns an error page"""
+
+
+class RetryableShopifyError(Exception):
+    """A throttle, 5xx or network failure worth retrying after a backoff"""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _is_throttled(body: dict) -> bool:
+    return any(
+        (error.get("extensions") or {}).get("code") == "THROTTLED"
+        for error in body.get("errors") or []
+        if isinstance(error, dict)
+    )
+
+
+def _parse_response(limiter, query: str, status_code: int, headers, read_json, size: int = None) -> dict:
+    """Turn an HTTP response into a GraphQL body, raising on throttles and failures"""
+    if status_code == 429:
+        retry_after = headers.get("Retry-After")
+        raise RetryableShopifyError(
+            "Shopify rate limit exceeded (429)",
+            retry_after=float(retry_after) if retry_after else None
+        )
+    if status_code >= 500:
+        raise RetryableShopifyError(f"Shopify server error ({status_code})")
+    if status_code >= 400:
+        raise ShopifyAPIError(f"Shopify returned HTTP {status_code}")
+
+    body = read_json()
+    limiter.observe(query, body)
+    cost = (body.get("extensions") or {}).get("cost") or {}
+    record_value("shopify_query_cost", cost.get("actualQueryCost") or cost.get("requestedQueryCost"))
+    record_value("shopify_response_bytes", size)
+    if _is_throttled(body):
+        limiter.record_throttle()
+        raise RetryableShopifyError("Shopify query THROTTLED")
+    return body
+
+
+def orders_date_filter(days_back: int = None):
+    """Build the search filter restricting orders to the last `days_back` days"""
+    if not days_back:
+        return None
+    since = (datetime.now(timezone.utc) - timedelta(days=days_back)).strftime("%Y-%m-%d")
+    return f"created_at:>={since}"
+
+
+def _extract_connection(result: dict, connection: str) -> dict:
+    """Return the connection object of a GraphQL response, raising on errors"""
+    if "error" in result:
+        raise ShopifyAPIError(result["error"])
+    if "errors" in result:
+        raise ShopifyAPIError(str(result["errors"]))
+    return ((result.get("data") or {}).get(connection)) or {}
+
+
+def _next_cursor(connection_data: dict):
+    """Return the cursor of the next page, or None when this was the last one"""
+    page_info = connection_data.get("pageInfo") or {}
+    if not page_info.get("hasNextPage"):
+        return None
+    return page_info.get("endCursor")
+
+
+def collect_pages(connection: str, pages, focus=()) -> dict:
+    """
+    Fold each page of nodes into the connection's figures as it arrives and
+    keep only the nodes a prompt can use (see prompt_packing.PromptNodes), so
+    memory stays bounded however many pages there are. Returns a response
+    shaped like a single GraphQL page plus the plain "figures" dict.
+    """
+    collector = _PageCollector(connection, focus)
+    for page in pages:
+        collector.add_page(page)
+    return collector.response()
+
+
+async def collect_pages_async(connection: str, pages, focus=()) -> dict:
+    """Async counterpart of collect_pages over an async iterator of pages"""
+    collector = _PageCollector(connection, focus)
+    async for page in pages:
+        collector.add_page(page)
+    return collector.response()
+
+
+class _PageCollector:
+    def __init__(self, connection: str, focus):
+        self.connection = connection
+        self.analytics = analytics_for(connection)
+        self.kept = PromptNodes(connection, focus)
+
+    def add_page(self, nodes: list):
+        if self.analytics is not None:
+            self.analytics.add_page(nodes)
+        self.kept.add_page(nodes)
+
+    def response(self) -> dict:
+        response = {"data": {self.connection: {"edges": [{"node": node} for node in self.kept.nodes()]}}}
+        if self.analytics is not None:
+            response["figures"] = self.analytics.summary(top_n=TOP_N)
+        return response
+
+
+# Identical concurrent GraphQL calls share one request
+shopify_flight = SingleFlight()
+async_shopify_flight = AsyncSingleFlight()
+
+
+def _flight_key(store_domain: str, access_token: str, query: str, variables: dict) -> tuple:
+    return (store_domain, access_token, query, json.dumps(variables or {}, sort_keys=True))
+
+
+class InvalidStoreDomain(ValueError):
+    """The store id is not a *.myshopify.com domain"""
+
+
+def store_domain_for(store_id: str) -> str:
+    """
+    The Shopify host to call for a request: the configured SHOPIFY_STORE_URL,
+    else the caller's store id if it is a *.myshopify.com domain
+    """
+    configured = os.getenv("SHOPIFY_STORE_URL")
+    if configured:
+        return configured
+    domain = (store_id or "").strip().lower()
+    if not STORE_DOMAIN_PATTERN.match(domain):
+        raise InvalidStoreDomain(f"Store id must be a *.myshopify.com domain: {store_id!r}")
+    return domain
+
+
+def _graphql_url(store_domain: str) -> str:
+    base = SHOPIFY_API_BASE_URL.rstrip("/") if SHOPIFY_API_BASE_URL else f"https://{store_domain}"
+    return f"{base}/admin/api/{API_VERSION}/graphql.json"
+
+
+def _shopifyql_to_query(query: str):
+    """Map a ShopifyQL-style query string onto one of the standard GraphQL fetches"""
+    query_lower = query.lower()
+
+    if "order" in query_lower or "sales" in query_lower or "revenue" in query_lower:
+        return "orders", 100
+    elif "product" in query_lower or "inventory" in query_lower or "stock" in query_lower:
+        return "products", 100
+    else:
+        # Default to orders
+        return "orders", 50
+
+
 class ShopifyClient:
+    # Keep-alive sessions shared by every client talking to the same store
+    _sessions = {}
+    _sessions_lock = Lock()
+
     def __init__(self, store_domain, access_token):
         self.store_domain = store_domain
         self.access_token = access_token
         # Use latest stable API version
-        self.graphql_url = f"https://{store_domain}/admin/api/2024-10/graphql.json"
+        self.graphql_url = _graphql_url(store_domain)
         self.headers = {
             "Content-Type": "application/json",
             "X-Shopify-Access-Token": access_token
         }
+        self.session = self._get_session(store_domain)
+
+    @classmethod
+    def _get_session(cls, store_domain) -> requests.Session:
+        """Return the pooled session for a store, creating it on first use"""
+        with cls._sessions_lock:
+            session = cls._sessions.get(store_domain)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=MAX_CONNECTIONS_PER_STORE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._sessions[store_domain] = session
+            return session
 
     def execute_graphql(self, query: str, variables: dict = None):
-        """Execute a GraphQL query against Shopify Admin API"""
+        """
+        Execute a GraphQL query against Shopify Admin API.
+        Paced by the store's cost bucket and retried with jittered backoff on
+        throttles, 5xx and network errors. Concurrent identical calls are
+        coalesced into one request.
+        """
+        key = _flight_key(self.store_domain, self.access_token, query, variables)
+        with span("shopify_query"):
+            return shopify_flight.do(key, lambda: self._execute_graphql(query, variables))
+
+    def _execute_graphql(self, query: str, variables: dict = None):
         payload = {"query": query}
         if variables:
             payload["variables"] = variables
-        
-        try:
-            response = requests.post(self.graphql_url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            logger.error(f"Shopify API Error: {str(e)}")
-            return {"error": str(e)}
+
+        limiter = rate_limiter.for_store(self.store_domain)
+        if not limiter.breaker.allow_request():
+            return {"error": f"Shopify circuit open for {self.store_domain}, retry in "
+                             f"{limiter.breaker.retry_after():.0f}s"}
+
+        last_error = None
+        for attempt in range(MAX_RETRIES + 1):
+            delay = limiter.reserve(query)
+            if delay:
+                time.sleep(delay)
+            try:
+                response = self.session.post(
+                    self.graphql_url, json=payload, headers=self.headers, timeout=REQUEST_TIMEOUT
+                )
+                body = _parse_response(
+                    limiter, query, response.status_code, response.headers, response.json, len(response.content)
+                )
+                limiter.breaker.record_success()
+                return body
+            except (RetryableShopifyError, requests.RequestException) as e:
+                last_error = e
+                if attempt < MAX_RETRIES:
+                    wait = limiter.backoff(attempt, getattr(e, "retry_after", None))
+                    logger.warning(f"Shopify call failed ({e}), retrying in {wait:.2f}s")
+                    time.sleep(wait)
+            except Exception as e:
+                last_error = e
+                break
+
+        limiter.breaker.record_failure()
+        logger.error(f"Shopify API Error: {str(last_error)}")
+        return {"error": str(last_error)}
 
     def get_orders(self, first: int = 50, days_back: int = 30):
         """Fetch recent orders"""
-        query = """
-        query GetOrders($first: Int!) {
-          orders(first: $first, sortKey: CREATED_AT, reverse: true) {
-            edges {
-              node {
-                id
-                name
-                createdAt
-                totalPriceSet {
-                  shopMoney {
-                    amount
-                    currencyCode
-                  }
-                }
-                lineItems(first: 10) {
-                  edges {
-                    node {
-                      title
-                      quantity
-                      variant {
-                        price
-                      }
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
-        """
-        return self.execute_graphql(query, {"first": first})
+        return self.execute_graphql(ORDERS_QUERY, {"first": first, "query": orders_date_filter(days_back)})
 
     def get_products(self, first: int = 50):
         """Fetch products with inventory"""
-        query = """
-        query GetProducts($first: Int!) {
-          products(first: $first) {
-            edges {
-              node {
-                id
-                title
-                status
-                totalInventory
-                variants(first: 5) {
-                  edges {
-                    node {
-                      id
-                      title
-                      price
-                      inventoryQuantity
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
+        return self.execute_graphql(PRODUCTS_QUERY, {"first": first})
+
+    def iter_pages(self, query: str, connection: str, variables: dict = None,
+                   page_size: int = PAGE_SIZE, max_pages: int = None):
+        """
+        Follow `endCursor` through a connection, yielding each page's nodes as
+        soon as it arrives. Only one page is held in memory at a time.
         """
-        return self.execute_graphql(query, {"first": first})
+        variables = dict(variables or {})
+        after = None
+        pages = 0
+        while True:
+            result = self.execute_graphql(query, {**variables, "first": page_size, "after": after})
+            connection_data = _extract_connection(result, connection)
+            yield [edge["node"] for edge in connection_data.get("edges", [])]
+            pages += 1
+            after = _next_cursor(connection_data)
+            if after is None or (max_pages and pages >= max_pages):
+                return
+
+    def iter_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None):
+        """Stream pages of orders created in the last `days_back` days"""
+        return self.iter_pages(
+            ORDERS_QUERY, "orders", {"query": orders_date_filter(days_back)}, page_size, max_pages
+        )
+
+    def iter_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, search: str = None):
+        """Stream pages of products"""
+        return self.iter_pages(PRODUCTS_QUERY, "products", {"query": search}, page_size, max_pages)
+
+    def get_all_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every order in the date window, collected into a single response"""
+        try:
+            return collect_pages("orders", self.iter_orders(days_back, page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    def get_all_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every product page, collected into a single response"""
+        try:
+            return collect_pages("products", self.iter_products(page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    def get_all_planned(self, query_plan, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every page of a query_planner.QueryPlan, collected into a single response"""
+        try:
+            return collect_pages(query_plan.connection, self.iter_pages(
+                query_plan.query, query_plan.connection, query_plan.variables, page_size, max_pages
+            ), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
 
     def get_inventory_levels(self, first: int = 50):
         """Fetch inventory levels"""
-        query = """
-        query GetInventory($first: Int!) {
-          inventoryItems(first: $first) {
-            edges {
-              node {
-                id
-                sku
-                tracked
-                inventoryLevels(first: 5) {
-                  edges {
-                    node {
-                      available
-                      location {
-                        name
-                      }
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
+        return self.execute_graphql(INVENTORY_QUERY, {"first": first})
+
+    def iter_inventory_levels(self, page_size: int = PAGE_SIZE, max_pages: int = None):
+        """Stream pages of inventory items with their per-location levels"""
+        return self.iter_pages(INVENTORY_QUERY, "inventoryItems", None, page_size, max_pages)
+
+    def get_all_inventory_levels(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every inventory item page, collected into a single response"""
+        try:
+            return collect_pages("inventoryItems", self.iter_inventory_levels(page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    def start_bulk_query(self, bulk_query: str) -> str:
+        """Start a bulk operation for `bulk_query` and return its id"""
+        result = self.execute_graphql(RUN_BULK_QUERY_MUTATION, {"query": bulk_query})
+        payload = _extract_connection(result, "bulkOperationRunQuery")
+        user_errors = payload.get("userErrors") or []
+        if user_errors:
+            raise ShopifyAPIError("; ".join(error.get("message", "") for error in user_errors))
+        operation_id = (payload.get("bulkOperation") or {}).get("id")
+        if not operation_id:
+            raise ShopifyAPIError("Shopify did not start the bulk operation")
+        return operation_id
+
+    def poll_bulk_operation(self, operation_id: str, timeout: float = BULK_TIMEOUT) -> dict:
+        """Wait for a bulk operation to finish, backing off between status checks"""
+        deadline = time.monotonic() + timeout
+        interval = BULK_POLL_INTERVAL
+        while True:
+            operation = _extract_connection(
+                self.execute_graphql(BULK_OPERATION_STATUS_QUERY, {"id": operation_id}), "node"
+            )
+            status = operation.get("status")
+            if status == "COMPLETED":
+                return operation
+            if status in BULK_FAILED_STATUSES:
+                raise ShopifyAPIError(f"Bulk operation {status.lower()} ({operation.get('errorCode')})")
+            if time.monotonic() + interval > deadline:
+                raise ShopifyAPIError(f"Bulk operation {operation_id} still {status} after {timeout:.0f}s")
+            time.sleep(interval)
+            interval = min(interval * 1.5, BULK_POLL_MAX_INTERVAL)
+
+    def iter_bulk_results(self, url: str):
+        """Stream-download a bulk result file, yielding one parsed JSONL object at a time"""
+        # The result URL is pre-signed; the store's access token must not be sent there
+        with self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code >= 400:
+                raise ShopifyAPIError(f"Bulk result download returned HTTP {response.status_code}")
+            yield from parse_jsonl_lines(response.iter_lines())
+
+    def run_bulk_query(self, bulk_query: str, timeout: float = BULK_TIMEOUT):
+        """
+        Bulk mode: run `bulk_query` server-side, wait for it, then stream the
+        result back as nested top-level nodes (line items under their orders)
         """
-        return self.execute_graphql(query, {"first": first})
+        with span("shopify_bulk_operation"):
+            operation = self.poll_bulk_operation(self.start_bulk_query(bulk_query), timeout)
+        record_value("shopify_bulk_objects", float(operation.get("objectCount") or 0))
+        if not operation.get("url"):
+            # Completed without matching any records
+            return
+        yield from rebuild_bulk_records(self.iter_bulk_results(operation["url"]))
 
     def execute_shopifyql(self, query: str):
         """
         Backward compatibility - now fetches data based on query intent
         Since ShopifyQL is not available, we use standard GraphQL instead
         """
-        query_lower = query.lower()
-        
-        # Determine what data to fetch based on the query
-        if "order" in query_lower or "sales" in query_lower or "revenue" in query_lower:
-            return self.get_orders(first=100)
-        elif "product" in query_lower or "inventory" in query_lower or "stock" in query_lower:
-            return self.get_products(first=100)
-        else:
-            # Default to orders
-            return self.get_orders(first=50)
\ No newline at end of file
+        dataset, first = _shopifyql_to_query(query)
+        if dataset == "products":
+            return self.get_products(first=first)
+        return self.get_orders(first=first)
+
+
+class AsyncShopifyClient:
+    """
+    Non-blocking variant of ShopifyClient for use inside the FastAPI event loop.
+    Every client for the same store shares one pooled keep-alive httpx.AsyncClient,
+    so repeated requests reuse TCP+TLS connections instead of reconnecting.
+    """
+    _http_clients = {}
+
+    def __init__(self, store_domain, access_token):
+        self.store_domain = store_domain
+        self.access_token = access_token
+        self.graphql_url = _graphql_url(store_domain)
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-Shopify-Access-Token": access_token
+        }
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client for this store, creating it on first use"""
+        client = self._http_clients.get(self.store_domain)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS_PER_STORE,
+                    max_keepalive_connections=MAX_CONNECTIONS_PER_STORE
+                )
+            )
+            self._http_clients[self.store_domain] = client
+        return client
+
+    @classmethod
+    async def close_all(cls):
+        """Close every pooled connection (called on application shutdown)"""
+        clients = list(cls._http_clients.values())
+        cls._http_clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    async def execute_graphql(self, query: str, variables: dict = None):
+        """Execute a GraphQL query without blocking (see ShopifyClient.execute_graphql)"""
+        key = _flight_key(self.store_domain, self.access_token, query, variables)
+        with span("shopify_query"):
+            return await async_shopify_flight.do(key, lambda: self._execute_graphql(query, variables))
+
+    async def _execute_graphql(self, query: str, variables: dict = None):
+        payload = {"query": query}
+        if variables:
+            payload["variables"] = variables
+
+        limiter = rate_limiter.for_store(self.store_domain)
+        if not limiter.breaker.allow_request():
+            return {"error": f"Shopify circuit open for {self.store_domain}, retry in "
+                             f"{limiter.breaker.retry_after():.0f}s"}
+
+        last_error = None
+        for attempt in range(MAX_RETRIES + 1):
+            delay = limiter.reserve(query)
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                response = await self.http.post(self.graphql_url, json=payload, headers=self.headers)
+                body = _parse_response(
+                    limiter, query, response.status_code, response.headers, response.json, len(response.content)
+                )
+                limiter.breaker.record_success()
+                return body
+            except (RetryableShopifyError, httpx.TransportError) as e:
+                last_error = e
+                if attempt < MAX_RETRIES:
+                    wait = limiter.backoff(attempt, getattr(e, "retry_after", None))
+                    logger.warning(f"Shopify call failed ({e}), retrying in {wait:.2f}s")
+                    await asyncio.sleep(wait)
+            except Exception as e:
+                last_error = e
+                break
+
+        limiter.breaker.record_failure()
+        logger.error(f"Shopify API Error: {str(last_error)}")
+        return {"error": str(last_error)}
+
+    async def get_orders(self, first: int = 50, days_back: int = 30):
+        """Fetch recent orders"""
+        return await self.execute_graphql(ORDERS_QUERY, {"first": first, "query": orders_date_filter(days_back)})
+
+    async def get_products(self, first: int = 50):
+        """Fetch products with inventory"""
+        return await self.execute_graphql(PRODUCTS_QUERY, {"first": first})
+
+    async def iter_pages(self, query: str, connection: str, variables: dict = None,
+                         page_size: int = PAGE_SIZE, max_pages: int = None):
+        """Async iterator over a connection's pages (see ShopifyClient.iter_pages)"""
+        variables = dict(variables or {})
+        after = None
+        pages = 0
+        while True:
+            result = await self.execute_graphql(query, {**variables, "first": page_size, "after": after})
+            connection_data = _extract_connection(result, connection)
+            yield [edge["node"] for edge in connection_data.get("edges", [])]
+            pages += 1
+            after = _next_cursor(connection_data)
+            if after is None or (max_pages and pages >= max_pages):
+                return
+
+    def iter_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None):
+        """Stream pages of orders created in the last `days_back` days"""
+        return self.iter_pages(
+            ORDERS_QUERY, "orders", {"query": orders_date_filter(days_back)}, page_size, max_pages
+        )
+
+    def iter_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, search: str = None):
+        """Stream pages of products"""
+        return self.iter_pages(PRODUCTS_QUERY, "products", {"query": search}, page_size, max_pages)
+
+    async def get_all_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every order in the date window, collected into a single response"""
+        try:
+            return await collect_pages_async("orders", self.iter_orders(days_back, page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    async def get_all_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every product page, collected into a single response"""
+        try:
+            return await collect_pages_async("products", self.iter_products(page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    async def get_all_planned(self, query_plan, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every page of a query_planner.QueryPlan, collected into a single response"""
+        try:
+            pages = self.iter_pages(query_plan.query, query_plan.connection, query_plan.variables, page_size, max_pages)
+            return await collect_pages_async(query_plan.connection, pages, focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    async def get_inventory_levels(self, first: int = 50):
+        """Fetch inventory levels"""
+        return await self.execute_graphql(INVENTORY_QUERY, {"first": first})
+
+    def iter_inventory_levels(self, page_size: int = PAGE_SIZE, max_pages: int = None):
+        """Stream pages of inventory items with their per-location levels"""
+        return self.iter_pages(INVENTORY_QUERY, "inventoryItems", None, page_size, max_pages)
+
+    async def get_all_inventory_levels(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Fetch every inventory item page, collected into a single response"""
+        try:
+            return await collect_pages_async("inventoryItems", self.iter_inventory_levels(page_size, max_pages), focus)
+        except ShopifyAPIError as e:
+            return {"error": str(e)}
+
+    async def execute_shopifyql(self, query: str):
+        """Async counterpart of ShopifyClient.execute_shopifyql"""
+        dataset, first = _shopifyql_to_query(query)
+        if dataset == "products":
+            return await self.get_products(first=first)
+        return await self.get_orders(first=first)
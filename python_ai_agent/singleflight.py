@@ -0,0 +1,98 @@
+"""
+Single-flight Module - Coalesces identical concurrent work
+While a call for a key is in flight, later callers with the same key wait
+for its result instead of repeating the work (thundering-herd protection).
+"""
+import asyncio
+from threading import Lock, Event
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-based coalescing for the synchronous code paths"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time; concurrent callers share its outcome"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+class AsyncSingleFlight:
+    """asyncio coalescing: concurrent callers await one shared task"""
+
+    def __init__(self):
+        self._tasks = {}
+        self.coalesced = 0
+
+    async def do(self, key, coro_factory):
+        """Await coro_factory() once per key at a time; concurrent callers share its result"""
+        task, _ = self.join(key, coro_factory)
+        # Shield so one caller giving up does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def join(self, key, coro_factory):
+        """
+        (task, leader): the key's running task, or a new one for coro_factory()
+        when none is; registered before returning, so later callers find it
+        """
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task, False
+        task = asyncio.ensure_future(coro_factory())
+        self._tasks[key] = task
+        task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        return task, True
+
+    def in_flight(self, key) -> bool:
+        return key in self._tasks
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "coalesced": self.coalesced}
@@ -0,0 +1,516 @@
+"""
+Snapshot Module - Local per-store copy of orders and products
+Orders and products are materialized in SQLite and kept current with
+incremental syncs: each sync asks Shopify only for records whose
+`updated_at` is at or past the stored watermark, walking them oldest-update
+first so a sync cut short by the page cap resumes where it stopped. Reads
+are local, so repeat questions skip the network and analyses can cover the
+whole synced order history rather than a single page. With
+SNAPSHOT_BULK_INITIAL_SYNC, a store's first load goes through a Shopify bulk
+operation instead of paging, which large stores need to finish at all.
+Either way a first load runs in the background; reads meanwhile return what
+has been loaded so far, marked pending. Deletions arrive by webhook
+(orders/delete, products/delete), since incremental syncs never see them.
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread
+from shopify_client import ORDERS_QUERY, PRODUCTS_QUERY, PAGE_SIZE, ShopifyAPIError, _shopifyql_to_query, collect_pages
+from bulk_operations import bulk_query, BULK_BATCH_SIZE
+from query_planner import apply_locally
+from singleflight import SingleFlight, AsyncSingleFlight
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_STORE", "true").lower() == "true"
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshots.sqlite3")
+SNAPSHOT_SYNC_INTERVAL = float(os.getenv("SNAPSHOT_SYNC_INTERVAL", 60))  # seconds between incremental syncs
+SNAPSHOT_MAX_SYNC_PAGES = int(os.getenv("SNAPSHOT_MAX_SYNC_PAGES", 200))
+SNAPSHOT_BULK_INITIAL_SYNC = os.getenv("SNAPSHOT_BULK_INITIAL_SYNC", "false").lower() == "true"
+
+# Dataset -> (query, connection, sort key that walks records by update time)
+SYNCED_DATASETS = {
+    "orders": (ORDERS_QUERY, "orders", "UPDATED_AT"),
+    "products": (PRODUCTS_QUERY, "products", "UPDATED_AT")
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    store TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT,
+    node TEXT NOT NULL,
+    PRIMARY KEY (store, dataset, id)
+);
+CREATE INDEX IF NOT EXISTS records_created ON records (store, dataset, created_at);
+CREATE TABLE IF NOT EXISTS watermarks (
+    store TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    updated_at TEXT,
+    synced_at REAL,
+    PRIMARY KEY (store, dataset)
+);
+"""
+
+
+def updated_since_filter(watermark: str = None):
+    """Search filter for records updated at or after the watermark (re-reading the boundary is harmless)"""
+    if not watermark:
+        return None
+    return f"updated_at:>='{watermark}'"
+
+
+def _initial_load_message(dataset: str) -> str:
+    return f"initial load of {dataset} still in progress; figures cover only the records loaded so far"
+
+
+class SnapshotStore:
+    """SQLite-backed store of synced records, keyed by (store, dataset, id)"""
+
+    def __init__(self, path: str = SNAPSHOT_PATH, sync_interval: float = SNAPSHOT_SYNC_INTERVAL,
+                 max_sync_pages: int = SNAPSHOT_MAX_SYNC_PAGES):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.max_sync_pages = max_sync_pages
+        self._db = None
+        self._lock = Lock()
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+        # Separate from the SQLite lock, so the event loop can check it without waiting on writes
+        self._load_lock = Lock()
+        self._initial_loads = set()
+        self._initial_failures = {}
+        self._load_tasks = set()
+        self._counters = {"syncs": 0, "bulk_loads": 0, "sync_failures": 0, "records_synced": 0, "reads": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        # Callers hold self._lock
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def watermark(self, store: str, dataset: str):
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT updated_at FROM watermarks WHERE store = ? AND dataset = ?", (store, dataset)
+            ).fetchone()
+        return row[0] if row else None
+
+    def needs_sync(self, store: str, dataset: str) -> bool:
+        """
+        Whether the last completed sync is older than sync_interval. The time is
+        kept in the database so every worker sharing the file shares the schedule.
+        """
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT synced_at FROM watermarks WHERE store = ? AND dataset = ?", (store, dataset)
+            ).fetchone()
+        last = row[0] if row else None
+        return last is None or time.time() - last >= self.sync_interval
+
+    def mark_stale(self, store: str, dataset: str = None):
+        """Force the next read to sync first"""
+        sql = "UPDATE watermarks SET synced_at = NULL WHERE store = ?"
+        params = [store]
+        if dataset is not None:
+            sql += " AND dataset = ?"
+            params.append(dataset)
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute(sql, params)
+
+    def upsert(self, store: str, dataset: str, nodes: list, advance_watermark: bool = True) -> int:
+        """
+        Insert or replace records (never with an older version) and advance the
+        dataset's watermark. Out-of-band writes such as webhooks must not move
+        the watermark, or changes they skipped over would never be synced.
+        """
+        rows = [
+            (store, dataset, node["id"], node.get("createdAt"), node.get("updatedAt"),
+             json.dumps(node, separators=(",", ":")))
+            for node in nodes if node.get("id")
+        ]
+        if not rows:
+            return 0
+        newest = max((row[4] for row in rows if row[4]), default=None)
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.executemany(
+                    "INSERT INTO records (store, dataset, id, created_at, updated_at, node) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (store, dataset, id) DO UPDATE SET "
+                    "created_at = excluded.created_at, updated_at = excluded.updated_at, node = excluded.node "
+                    "WHERE coalesce(excluded.updated_at, '') >= coalesce(records.updated_at, '')", rows
+                )
+                if newest and advance_watermark:
+                    db.execute(
+                        "INSERT INTO watermarks (store, dataset, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (store, dataset) DO UPDATE SET "
+                        "updated_at = max(coalesce(updated_at, ''), excluded.updated_at)",
+                        (store, dataset, newest)
+                    )
+        return len(rows)
+
+    def delete(self, store: str, dataset: str, ids: list) -> int:
+        """Remove records deleted in Shopify; syncs only return records that still exist"""
+        with self._lock:
+            db = self._conn()
+            with db:
+                cursor = db.executemany(
+                    "DELETE FROM records WHERE store = ? AND dataset = ? AND id = ?",
+                    [(store, dataset, record_id) for record_id in ids]
+                )
+        return cursor.rowcount
+
+    def read(self, store: str, dataset: str, created_since: str = None, limit: int = None) -> list:
+        """Stored nodes, newest first for orders; optionally limited to a creation cutoff"""
+        sql = "SELECT node FROM records WHERE store = ? AND dataset = ?"
+        params = [store, dataset]
+        if created_since:
+            sql += " AND created_at >= ?"
+            params.append(created_since)
+        sql += " ORDER BY created_at DESC, id" if dataset == "orders" else " ORDER BY id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn().execute(sql, params).fetchall()
+            self._counters["reads"] += 1
+        return [json.loads(row[0]) for row in rows]
+
+    def has_data(self, store: str, dataset: str) -> bool:
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT 1 FROM records WHERE store = ? AND dataset = ? LIMIT 1", (store, dataset)
+            ).fetchone()
+        return row is not None
+
+    def forget_store(self, store: str):
+        """Drop every record and watermark for a store that uninstalled the app"""
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM records WHERE store = ?", (store,))
+                db.execute("DELETE FROM watermarks WHERE store = ?", (store,))
+
+    def _sync_variables(self, store: str, dataset: str) -> dict:
+        _, _, sort_key = SYNCED_DATASETS[dataset]
+        return {"query": updated_since_filter(self.watermark(store, dataset)), "sortKey": sort_key, "reverse": False}
+
+    def _finish_sync(self, store: str, dataset: str, synced: int):
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.execute(
+                    "INSERT INTO watermarks (store, dataset, synced_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (store, dataset) DO UPDATE SET synced_at = excluded.synced_at",
+                    (store, dataset, time.time())
+                )
+        self._counters["syncs"] += 1
+        self._counters["records_synced"] += synced
+        logger.info(f"Snapshot sync for {store} {dataset}: {synced} records")
+        return synced
+
+    def sync(self, client, dataset: str) -> int:
+        """Pull records changed since the watermark; concurrent syncs of a dataset share one run"""
+        store = client.store_domain
+
+        def run():
+            query, connection, _ = SYNCED_DATASETS[dataset]
+            synced = 0
+            pages = client.iter_pages(query, connection, self._sync_variables(store, dataset),
+                                      PAGE_SIZE, self.max_sync_pages)
+            for nodes in pages:
+                synced += self.upsert(store, dataset, nodes)
+            return self._finish_sync(store, dataset, synced)
+
+        return self._flight.do((store, dataset), run)
+
+    async def sync_async(self, client, dataset: str) -> int:
+        """Async counterpart of sync; SQLite work runs on a worker thread"""
+        store = client.store_domain
+
+        async def run():
+            query, connection, _ = SYNCED_DATASETS[dataset]
+            variables = await asyncio.to_thread(self._sync_variables, store, dataset)
+            synced = 0
+            async for nodes in client.iter_pages(query, connection, variables, PAGE_SIZE, self.max_sync_pages):
+                synced += await asyncio.to_thread(self.upsert, store, dataset, nodes)
+            return await asyncio.to_thread(self._finish_sync, store, dataset, synced)
+
+        return await self._async_flight.do((store, dataset), run)
+
+    def bulk_load(self, client, dataset: str, batch_size: int = BULK_BATCH_SIZE) -> int:
+        """
+        Load everything changed since the watermark (everything, on first load)
+        through a bulk operation on a synchronous ShopifyClient, in batches
+        """
+        store = client.store_domain
+
+        def run():
+            batch, loaded = [], 0
+            search = updated_since_filter(self.watermark(store, dataset))
+            for node in client.run_bulk_query(bulk_query(dataset, search)):
+                batch.append(node)
+                if len(batch) >= batch_size:
+                    loaded += self.upsert(store, dataset, batch)
+                    batch = []
+            loaded += self.upsert(store, dataset, batch)
+            self._counters["bulk_loads"] += 1
+            return self._finish_sync(store, dataset, loaded)
+
+        return self._flight.do((store, dataset), run)
+
+    def never_synced(self, store: str, dataset: str) -> bool:
+        """True until a first sync or bulk load of the dataset has completed"""
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT 1 FROM watermarks WHERE store = ? AND dataset = ?", (store, dataset)
+            ).fetchone()
+        return row is None
+
+    def initial_loading(self, store: str, dataset: str) -> bool:
+        with self._load_lock:
+            return (store, dataset) in self._initial_loads
+
+    def _claim_initial_load(self, store: str, dataset: str):
+        """(claimed, failure of the previous attempt): at most one first load per dataset"""
+        key = (store, dataset)
+        with self._load_lock:
+            failure = self._initial_failures.get(key)
+            if key in self._initial_loads:
+                return False, failure
+            self._initial_loads.add(key)
+            return True, failure
+
+    def _end_initial_load(self, store: str, dataset: str, error: Exception = None):
+        key = (store, dataset)
+        if error is not None:
+            self.record_sync_failure(store, dataset, error)
+        with self._load_lock:
+            self._initial_loads.discard(key)
+            if error is None:
+                self._initial_failures.pop(key, None)
+            else:
+                self._initial_failures[key] = str(error)
+
+    def start_initial_load(self, client, dataset: str):
+        """
+        Run a dataset's first load on a background thread: bulk_load with
+        SNAPSHOT_BULK_INITIAL_SYNC, otherwise a paged sync of up to
+        max_sync_pages. No request waits on it. Returns the error of the
+        previous attempt, if that one failed.
+        """
+        store = client.store_domain
+        claimed, failure = self._claim_initial_load(store, dataset)
+        if not claimed:
+            return failure
+
+        def run():
+            error = None
+            try:
+                if SNAPSHOT_BULK_INITIAL_SYNC:
+                    self.bulk_load(client, dataset)
+                else:
+                    self.sync(client, dataset)
+            except Exception as e:
+                error = e
+            finally:
+                self._end_initial_load(store, dataset, error)
+
+        Thread(target=run, name=f"snapshot-initial-{dataset}", daemon=True).start()
+        return failure
+
+    def start_initial_load_async(self, client, dataset: str):
+        """start_initial_load for an AsyncShopifyClient: a paged sync on a task of the running loop"""
+        store = client.store_domain
+        claimed, failure = self._claim_initial_load(store, dataset)
+        if not claimed:
+            return failure
+
+        async def run():
+            error = None
+            try:
+                await self.sync_async(client, dataset)
+            except Exception as e:
+                error = e
+            finally:
+                self._end_initial_load(store, dataset, error)
+
+        task = asyncio.get_running_loop().create_task(run())
+        # The loop keeps only weak references to tasks
+        self._load_tasks.add(task)
+        task.add_done_callback(self._load_tasks.discard)
+        return failure
+
+    def record_sync_failure(self, store: str, dataset: str, error: Exception):
+        self._counters["sync_failures"] += 1
+        logger.warning(f"Snapshot sync for {store} {dataset} failed: {error}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT dataset, count(*) FROM records GROUP BY dataset"
+            ).fetchall() if self._db is not None else []
+            return {**self._counters, "records": dict(rows), "path": self.path}
+
+
+def _created_since(days_back: int = None):
+    if not days_back:
+        return None
+    return (datetime.now(timezone.utc) - timedelta(days=days_back)).strftime("%Y-%m-%d")
+
+
+def _response(nodes: list, refreshed: tuple, connection: str, query_plan=None, focus=()) -> dict:
+    """Collect snapshot rows like a paged fetch: figures over all, prompt rows bounded"""
+    error, pending = refreshed
+    if error and not nodes:
+        return {"error": error}
+    if query_plan is not None:
+        nodes = apply_locally(nodes, query_plan)
+    response = collect_pages(connection, [nodes], focus)
+    if pending:
+        response["pending"] = pending
+    return response
+
+
+class SnapshotReader:
+    """
+    Drop-in for ShopifyClient's bulk reads: orders and products come from the
+    snapshot (synced first when due), everything else goes to the client.
+    If a sync fails, previously synced records are still served.
+    """
+
+    def __init__(self, client, store: SnapshotStore = None):
+        self.client = client
+        self.snapshots = store or snapshot_store
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _refresh(self, dataset: str):
+        """
+        Sync when due. Returns (error, pending): the message of a failed sync,
+        or a note that a background first load has not finished yet
+        """
+        store = self.client.store_domain
+        if self.snapshots.initial_loading(store, dataset):
+            return None, _initial_load_message(dataset)
+        if not self.snapshots.needs_sync(store, dataset):
+            return None, None
+        try:
+            with span("snapshot_sync", dataset=dataset):
+                if self.snapshots.never_synced(store, dataset):
+                    failure = self.snapshots.start_initial_load(self.client, dataset)
+                    return failure, (None if failure else _initial_load_message(dataset))
+                self.snapshots.sync(self.client, dataset)
+        except ShopifyAPIError as e:
+            self.snapshots.record_sync_failure(store, dataset, e)
+            return str(e), None
+        return None, None
+
+    def _read(self, dataset: str, created_since: str = None, limit: int = None, query_plan=None, focus=()) -> dict:
+        refreshed = self._refresh(dataset)
+        with span("snapshot_read", dataset=dataset):
+            nodes = self.snapshots.read(self.client.store_domain, dataset, created_since, limit)
+        connection = query_plan.connection if query_plan is not None else dataset
+        return _response(nodes, refreshed, connection, query_plan, focus)
+
+    def get_all_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Every synced order in the date window (no page cap: the read is local)"""
+        return self._read("orders", _created_since(days_back), focus=focus)
+
+    def get_all_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """Every synced product"""
+        return self._read("products", focus=focus)
+
+    def get_all_planned(self, query_plan, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        """A planned query answered from the snapshot: same filter, sort and fields"""
+        return self._read(
+            query_plan.dataset, _created_since(query_plan.days_back), query_plan=query_plan, focus=focus
+        )
+
+    def execute_shopifyql(self, query: str):
+        """ShopifyClient.execute_shopifyql served from the snapshot"""
+        dataset, first = _shopifyql_to_query(query)
+        return self._read(dataset, limit=first)
+
+
+class AsyncSnapshotReader:
+    """
+    Async counterpart of SnapshotReader for AsyncShopifyClient. First loads
+    run on a background thread with the synchronous `bulk_client` (bulk loads
+    need it), or as a task on the loop without one.
+    """
+
+    def __init__(self, client, store: SnapshotStore = None, bulk_client=None):
+        self.client = client
+        self.snapshots = store or snapshot_store
+        self.bulk_client = bulk_client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def _refresh(self, dataset: str):
+        """Async counterpart of SnapshotReader._refresh; SQLite calls run on worker threads"""
+        store = self.client.store_domain
+        if self.snapshots.initial_loading(store, dataset):
+            return None, _initial_load_message(dataset)
+        if not await asyncio.to_thread(self.snapshots.needs_sync, store, dataset):
+            return None, None
+        try:
+            with span("snapshot_sync", dataset=dataset):
+                if await asyncio.to_thread(self.snapshots.never_synced, store, dataset):
+                    if self.bulk_client is not None:
+                        failure = self.snapshots.start_initial_load(self.bulk_client, dataset)
+                    else:
+                        failure = self.snapshots.start_initial_load_async(self.client, dataset)
+                    return failure, (None if failure else _initial_load_message(dataset))
+                await self.snapshots.sync_async(self.client, dataset)
+        except ShopifyAPIError as e:
+            self.snapshots.record_sync_failure(store, dataset, e)
+            return str(e), None
+        return None, None
+
+    async def _read(self, dataset: str, created_since: str = None, limit: int = None, query_plan=None, focus=()) -> dict:
+        refreshed = await self._refresh(dataset)
+        with span("snapshot_read", dataset=dataset):
+            nodes = await asyncio.to_thread(
+                self.snapshots.read, self.client.store_domain, dataset, created_since, limit
+            )
+        connection = query_plan.connection if query_plan is not None else dataset
+        return await asyncio.to_thread(_response, nodes, refreshed, connection, query_plan, focus)
+
+    async def get_all_orders(self, days_back: int = 30, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        return await self._read("orders", _created_since(days_back), focus=focus)
+
+    async def get_all_products(self, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        return await self._read("products", focus=focus)
+
+    async def get_all_planned(self, query_plan, page_size: int = PAGE_SIZE, max_pages: int = None, focus=()):
+        return await self._read(
+            query_plan.dataset, _created_since(query_plan.days_back), query_plan=query_plan, focus=focus
+        )
+
+    async def execute_shopifyql(self, query: str):
+        dataset, first = _shopifyql_to_query(query)
+        return await self._read(dataset, limit=first)
+
+
+# Singleton instance
+snapshot_store = SnapshotStore()
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import pytest
+from admission import LLMScheduler, AdmissionRejected, AdmissionTimeout, _parse_weights
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def served_order(scheduler: LLMScheduler, stores: list) -> list:
+    """Hold the only slot, queue a call per store, then let them through one at a time"""
+    order = []
+    await scheduler.acquire("holder")
+
+    async def call(store):
+        async with scheduler.slot(store):
+            order.append(store)
+
+    tasks = [asyncio.create_task(call(store)) for store in stores]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_busy_store_does_not_starve_others():
+    order = run(served_order(LLMScheduler(max_concurrency=1), ["a", "a", "a", "b"]))
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_weighted_store_gets_proportionally_more_turns():
+    scheduler = LLMScheduler(max_concurrency=1, weights={"big": 2.0})
+    order = run(served_order(scheduler, ["small", "small", "big", "big", "big", "big"]))
+    assert order == ["big", "small", "big", "big", "small", "big"]
+
+
+def test_full_queue_rejects_with_retry_hint():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, queue_limit=1)
+        await scheduler.acquire("a")
+        waiting = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await scheduler.acquire("b")
+        assert rejected.value.retry_after >= 1
+        scheduler.release()
+        await waiting
+        return scheduler.stats()
+
+    stats = run(scenario())
+    assert stats["rejected"] == 1 and stats["admitted"] == 2 and stats["queue_depth"] == 0
+
+
+def test_waiter_past_its_deadline_is_dropped():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, deadline=0.05)
+        await scheduler.acquire("a")
+        with pytest.raises(AdmissionTimeout):
+            await scheduler.acquire("b")
+        scheduler.release()
+        return scheduler.stats()
+
+    stats = run(scenario())
+    assert stats["expired"] == 1 and stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire("a")
+        waiting = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        scheduler.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return scheduler.stats()
+
+    stats = run(scenario())
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_blocking_callers_queue_in_the_same_pool():
+    scheduler = LLMScheduler(max_concurrency=1)
+    admitted = threading.Event()
+
+    def worker():
+        with scheduler.slot_blocking("b"):
+            admitted.set()
+
+    async def scenario():
+        await scheduler.acquire("a")
+        thread = threading.Thread(target=worker)
+        thread.start()
+        await asyncio.sleep(0.05)
+        # The thread waits behind the async holder of the only slot
+        assert not admitted.is_set() and scheduler.stats()["queue_depth"] == 1
+        scheduler.release()
+        await asyncio.to_thread(thread.join, 5)
+
+    run(scenario())
+    assert admitted.is_set()
+    assert scheduler.stats()["in_flight"] == 0 and scheduler.stats()["admitted"] == 2
+
+
+def test_blocking_waiter_past_its_deadline_is_dropped():
+    scheduler = LLMScheduler(max_concurrency=1, deadline=0.05)
+    scheduler.acquire_blocking("a")
+    with pytest.raises(AdmissionTimeout):
+        scheduler.acquire_blocking("b")
+    scheduler.release()
+    stats = scheduler.stats()
+    assert stats["expired"] == 1 and stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def test_parse_weights_skips_invalid_entries():
+    assert _parse_weights("a.myshopify.com=3, b.myshopify.com=x,c.myshopify.com=0,") == {"a.myshopify.com": 3.0}
@@ -0,0 +1,60 @@
+import json
+import asyncio
+import pytest
+import shopify_client
+import prompt_packing
+from analytics import OrderAnalytics, summarize_store_data, unwrap_nodes
+from shopify_client import ShopifyClient, AsyncShopifyClient
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store
+
+STORE = "analytics-test.myshopify.com"
+
+
+@pytest.fixture
+def pages_folded(monkeypatch):
+    server = FakeShopifyServer(synthetic_store(orders=25, products=5, days=10), latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(shopify_client, "SHOPIFY_API_BASE_URL", server.start())
+    sizes = []
+    add_page = OrderAnalytics.add_page
+
+    def counting(self, orders):
+        sizes.append(len(orders))
+        add_page(self, orders)
+
+    monkeypatch.setattr(OrderAnalytics, "add_page", counting)
+    yield sizes
+    server.stop()
+
+
+def test_orders_are_folded_page_by_page(pages_folded):
+    response = ShopifyClient(STORE, "token").get_all_orders(days_back=30, page_size=10)
+    assert pages_folded == [10, 10, 5]
+    figures = summarize_store_data(response)
+    assert figures["orders"]["order_count"] == 25
+    # Summarizing reuses the figures computed while paging
+    assert pages_folded == [10, 10, 5]
+    assert figures == summarize_store_data({"data": response["data"]})
+    # The response is plain data, so it can be cached or logged as-is
+    assert "analytics" not in response
+    json.dumps(response)
+
+
+def test_paged_fetch_keeps_only_prompt_rows(monkeypatch, pages_folded):
+    monkeypatch.setattr(prompt_packing, "PROMPT_RETAINED_NODES", 3)
+    response = ShopifyClient(STORE, "token").get_all_orders(days_back=30, page_size=10)
+    kept = unwrap_nodes(response["data"]["orders"])
+    assert 3 <= len(kept) < 25
+    # Figures still cover every order fetched
+    assert summarize_store_data(response)["orders"]["order_count"] == 25
+
+
+def test_async_orders_are_folded_page_by_page(pages_folded):
+    async def run():
+        try:
+            return await AsyncShopifyClient(STORE, "token").get_all_orders(days_back=30, page_size=10)
+        finally:
+            await AsyncShopifyClient.close_all()
+
+    response = asyncio.run(run())
+    assert pages_folded == [10, 10, 5]
+    assert len(unwrap_nodes(response["data"]["orders"])) == 25
@@ -0,0 +1,70 @@
+import asyncio
+from admission import AdmissionRejected
+from agent import AnalyticsAgent
+from fetch_planner import build_plan
+
+
+def pending(*questions):
+    items = []
+    for index, (question, intent) in enumerate(questions):
+        items.append((index, question, intent, build_plan(intent, question, 30, 10)))
+    return items
+
+
+def test_different_windows_fetch_separately():
+    groups = AnalyticsAgent._batch_fetch_plans(pending(
+        ("What was my revenue in the last 7 days?", "sales_analysis"),
+        ("What was my revenue?", "sales_analysis")
+    ))
+    assert sorted(plan.days_back for plan, _ in groups) == [7, 30]
+
+
+def test_matching_questions_share_a_fetch():
+    groups = AnalyticsAgent._batch_fetch_plans(pending(
+        ("What was my revenue last week?", "sales_analysis"),
+        ("How many orders did I get last week?", "order_info")
+    ))
+    assert len(groups) == 1
+    plan, members = groups[0]
+    assert plan.days_back == 7 and members == [0, 1]
+
+
+def test_conflicting_queries_fetch_separately():
+    groups = AnalyticsAgent._batch_fetch_plans(pending(
+        ("Show me my largest orders", "order_info"),
+        ("How many orders did I get?", "order_info")
+    ))
+    assert len(groups) == 2
+
+
+class OrdersSource:
+    store_domain = "batch-test.myshopify.com"
+
+    async def get_all_orders(self, days_back=30, max_pages=None, focus=()):
+        return {"data": {"orders": {"edges": [
+            {"node": {"id": "gid://shopify/Order/1", "createdAt": "2024-05-01T00:00:00Z",
+                      "totalPriceSet": {"shopMoney": {"amount": "41.00", "currencyCode": "USD"}}}}
+        ]}}}
+
+    async def get_all_planned(self, query_plan, max_pages=None, focus=()):
+        return await self.get_all_orders()
+
+
+def test_rejected_fallback_keeps_the_rest_of_the_batch(monkeypatch):
+    agent = AnalyticsAgent(store_id="batch-test.myshopify.com", access_token="token", stateful=False)
+    agent.async_data_source = OrdersSource()
+
+    async def answer_group(group, context):
+        # The combined reply covers only the first question
+        return {group[0][0]: "Sales were 41 dollars."}
+
+    async def rejected(*args):
+        raise AdmissionRejected("Model queue is full", 3)
+
+    monkeypatch.setattr(agent, "_answer_group_async", answer_group)
+    monkeypatch.setattr(agent, "_analyze_and_respond_async", rejected)
+    results = asyncio.run(agent.process_batch_async([
+        "What were my sales for the shed batch?", "How many orders in the shed batch?"
+    ]))
+    assert results[0]["answer"] == "Sales were 41 dollars."
+    assert results[1] == {"error": "Model queue is full", "retry_after": 3}
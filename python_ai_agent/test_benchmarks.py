@@ -0,0 +1,73 @@
+import json
+import asyncio
+import httpx
+from benchmarks import run as bench
+from benchmarks.fake_model import _answer_text
+
+
+def test_question_mix_is_seeded():
+    assert bench.question_mix(50, 0.3, 3, seed=7) == bench.question_mix(50, 0.3, 3, seed=7)
+    assert all(question in bench.QUESTIONS for _, question in bench.question_mix(50, 0.0, 3, seed=7))
+    one_off = bench.question_mix(50, 1.0, 3, seed=7)
+    assert not any(question in bench.QUESTIONS for _, question in one_off)
+    assert {store for store, _ in one_off} == {0, 1, 2}
+
+
+def test_compare_flags_regressions_by_direction():
+    baseline = {"requests_per_second": 100, "latency": {"p95_ms": 200}, "cache_hit_rate": 0.5}
+    current = {"requests_per_second": 80, "latency": {"p95_ms": 150}, "cache_hit_rate": 0.5}
+    comparison = bench.compare(current, baseline)
+    assert comparison["requests_per_second"] == {
+        "baseline": 100, "current": 80, "change_percent": -20.0, "regression": True
+    }
+    assert not comparison["latency.p95_ms"]["regression"]
+    assert not comparison["cache_hit_rate"]["regression"]
+    # Metrics missing from either run are left out
+    assert "memory.max_rss_mb" not in comparison
+
+
+def test_drive_counts_cached_answers_and_errors():
+    bodies = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        bodies.append(body)
+        if "region" in body["question"]:
+            return httpx.Response(500, json={"error": "boom"})
+        return httpx.Response(200, json={"answer": "ok", "cached": len(bodies) % 2 == 0})
+
+    async def run():
+        async with httpx.AsyncClient(base_url="http://bench", transport=httpx.MockTransport(handler)) as client:
+            return await bench.drive(client, [(0, bench.QUESTIONS[0])] * 8 + [(1, "Sales for region x?")] * 2,
+                                     concurrency=3, duration=0, sessions=True)
+
+    results = asyncio.run(run())
+    assert results["requests"] == 10 and results["latency"]["count"] == 10
+    assert results["status_codes"] == {"200": 8, "500": 2}
+    assert results["error_rate"] == 0.2
+    assert 0 < results["cache_hit_rate"] < 0.8
+    assert {body["session_id"] for body in bodies} <= {"bench-user-0", "bench-user-1", "bench-user-2"}
+
+
+def test_fake_model_answers_each_batched_question():
+    prompt = "Questions:\n1. (intent: sales_analysis) Sales?\n2. (intent: inventory) Stock?\n"
+    answers = json.loads(_answer_text(prompt, {"response_mime_type": "application/json"}))["answers"]
+    assert [answer["id"] for answer in answers] == [1, 2]
+    assert _answer_text(prompt, None).startswith("Synthetic answer")
+
+
+def test_benchmark_run_end_to_end(tmp_path, capsys):
+    output = tmp_path / "results.json"
+    status = bench.main([
+        "--requests", "12", "--concurrency", "3", "--orders", "30", "--products", "5", "--days", "10",
+        "--shopify-latency-ms", "0", "--shopify-jitter-ms", "0",
+        "--model-latency-ms", "0", "--model-jitter-ms", "0", "--output", str(output)
+    ])
+    assert status == 0
+    report = json.loads(output.read_text())
+    results = report["results"]
+    assert results["requests"] == 12
+    assert results["status_codes"] == {"200": 12}
+    assert results["shopify"]["requests"] > 0
+    assert report["config"]["concurrency"] == 3
+    assert "req/s" in capsys.readouterr().out
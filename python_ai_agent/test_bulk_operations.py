@@ -0,0 +1,84 @@
+import time
+import pytest
+import shopify_client
+from bulk_operations import rebuild_bulk_records, parse_jsonl_lines, bulk_query
+from shopify_client import ShopifyClient
+from snapshot import SnapshotStore, SnapshotReader
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store, bulk_jsonl
+
+CANNED_ORDERS = b"""\
+{"id": "gid://shopify/Order/1", "name": "#1001", "updatedAt": "2024-05-01T00:00:00Z"}
+{"id": "gid://shopify/LineItem/11", "title": "Mug", "quantity": 2, "__parentId": "gid://shopify/Order/1"}
+{"id": "gid://shopify/LineItem/12", "title": "Cap", "quantity": 1, "__parentId": "gid://shopify/Order/1"}
+
+{"id": "gid://shopify/Order/2", "name": "#1002", "updatedAt": "2024-05-02T00:00:00Z"}
+{"id": "gid://shopify/LineItem/21", "title": "Mug", "quantity": 5, "__parentId": "gid://shopify/Order/2"}
+"""
+
+
+def test_rebuild_nests_children_under_their_parent():
+    orders = list(rebuild_bulk_records(parse_jsonl_lines(CANNED_ORDERS.splitlines())))
+    assert [order["name"] for order in orders] == ["#1001", "#1002"]
+    assert [edge["node"]["title"] for edge in orders[0]["lineItems"]["edges"]] == ["Mug", "Cap"]
+    assert orders[1]["lineItems"]["edges"][0]["node"]["quantity"] == 5
+    assert "__parentId" not in orders[1]["lineItems"]["edges"][0]["node"]
+
+
+def test_rebuild_drops_orphans_and_nests_grandchildren():
+    records = [
+        {"id": "gid://shopify/InventoryItem/1"},
+        {"id": "gid://shopify/InventoryLevel/7", "__parentId": "gid://shopify/InventoryItem/1"},
+        {"id": "gid://shopify/Location/3", "__parentId": "gid://shopify/InventoryLevel/7"},
+        {"id": "gid://shopify/LineItem/9", "__parentId": "gid://shopify/Order/404"}
+    ]
+    (item,) = rebuild_bulk_records(records)
+    level = item["inventoryLevels"]["edges"][0]["node"]
+    assert level["locations"]["edges"][0]["node"]["id"] == "gid://shopify/Location/3"
+
+
+def test_rebuild_is_lazy():
+    def records():
+        yield {"id": "gid://shopify/Order/1"}
+        yield {"id": "gid://shopify/Order/2"}
+        raise AssertionError("read past the second record")
+
+    assert next(rebuild_bulk_records(records()))["id"] == "gid://shopify/Order/1"
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    server = FakeShopifyServer(synthetic_store(orders=40, products=10), latency_ms=0, jitter_ms=0,
+                               bulk_files={"orders": CANNED_ORDERS})
+    monkeypatch.setattr(shopify_client, "SHOPIFY_API_BASE_URL", server.start())
+    monkeypatch.setattr(shopify_client, "BULK_POLL_INTERVAL", 0.01)
+    yield server
+    server.stop()
+
+
+def test_run_bulk_query_against_stand_in(stand_in):
+    client = ShopifyClient(store_domain="bulk-test.myshopify.com", access_token="token")
+    orders = list(client.run_bulk_query(bulk_query("orders")))
+    assert [order["id"] for order in orders] == ["gid://shopify/Order/1", "gid://shopify/Order/2"]
+    assert len(orders[0]["lineItems"]["edges"]) == 2
+    assert stand_in.stats()["bulk_operations"] == 1
+
+
+def test_generated_bulk_file_round_trips():
+    store = synthetic_store(orders=5, products=3)
+    rebuilt = list(rebuild_bulk_records(parse_jsonl_lines(bulk_jsonl(store["products"]).splitlines())))
+    assert rebuilt == store["products"]
+
+
+def test_snapshot_bulk_load_runs_in_background(stand_in, tmp_path, monkeypatch):
+    monkeypatch.setattr("snapshot.SNAPSHOT_BULK_INITIAL_SYNC", True)
+    snapshots = SnapshotStore(str(tmp_path / "snapshot.sqlite3"))
+    reader = SnapshotReader(ShopifyClient(store_domain="bulk-test.myshopify.com", access_token="token"), snapshots)
+    first = reader.get_all_products()
+    assert "pending" in first
+    deadline = time.monotonic() + 10
+    while snapshots.initial_loading("bulk-test.myshopify.com", "products") and time.monotonic() < deadline:
+        time.sleep(0.02)
+    loaded = reader.get_all_products()
+    assert "pending" not in loaded
+    assert len(loaded["data"]["products"]["edges"]) == 10
+    assert snapshots.stats()["bulk_loads"] == 1
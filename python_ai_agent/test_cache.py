@@ -0,0 +1,220 @@
+import time
+import asyncio
+import threading
+import pytest
+import agent as agent_module
+from agent import AnalyticsAgent
+from answer_reuse import AnswerReuse
+from cache import AnswerCache, FRESH, STALE, answer_cache
+from cache_backends import RedisCache, SQLiteCache
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return AnswerCache(max_entries=3, ttl=60, stale_ttl=60)
+    if request.param == "sqlite":
+        return SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=3, ttl=60, stale_ttl=60)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(ttl=60, stale_ttl=60, client=fakeredis.FakeRedis())
+
+
+def test_set_get_delete(cache):
+    cache.set("a", {"answer": "42"})
+    assert cache.get("a") == ({"answer": "42"}, FRESH)
+    cache.delete("a")
+    assert cache.get("a") == (None, None)
+
+
+def test_stale_window(cache):
+    cache.set("a", {"answer": "42"}, ttl=0)
+    assert cache.get("a") == ({"answer": "42"}, STALE)
+
+
+def test_peek_does_not_count_a_lookup(cache):
+    cache.set("a", {"answer": "42"})
+    cache.set("b", {"answer": "43"}, ttl=0)
+    before = cache.stats()
+    assert cache.peek("a") == FRESH
+    assert cache.peek("b") == STALE
+    assert cache.peek("missing") is None
+    after = cache.stats()
+    assert [after[name] for name in ("hits", "stale_hits", "misses")] == \
+        [before[name] for name in ("hits", "stale_hits", "misses")]
+
+
+def test_invalidate_tags(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.tag("a", ["shop|orders"])
+    cache.tag("b", ["shop|products"])
+    assert cache.invalidate_tags(["shop|orders"]) == 1
+    assert cache.get("a") == (None, None)
+    assert cache.get("b") == (2, FRESH)
+
+
+def test_refresh_claim(cache):
+    assert cache.begin_refresh("a")
+    assert not cache.begin_refresh("a")
+    cache.end_refresh("a")
+    assert cache.begin_refresh("a")
+
+
+def test_lru_bound():
+    cache = AnswerCache(max_entries=2, ttl=60, stale_ttl=60)
+    for key in "abc":
+        cache.set(key, key)
+    assert cache.get("a") == (None, None)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_redis_tag_outlives_long_lived_entries():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    cache = RedisCache(ttl=300, stale_ttl=600, client=client, prefix="t:")
+    cache.set("long", 1, ttl=3600)
+    cache.tag("long", ["shop|orders"], ttl=3600)
+    # A later, shorter-lived answer with the same tag must not shorten the set
+    cache.set("short", 2)
+    cache.tag("short", ["shop|orders"])
+    assert client.pttl("t:tag:shop|orders") > 4000 * 1000
+    assert cache.invalidate_tags(["shop|orders"]) == 2
+
+
+def test_redis_errors_degrade_to_misses():
+    redis = pytest.importorskip("redis")
+
+    class Broken:
+        def get(self, key):
+            raise redis.ConnectionError("down")
+
+    cache = RedisCache(client=Broken())
+    assert cache.get("a") == (None, None)
+    assert cache.stats()["errors"] == 1
+
+
+def test_sqlite_shared_between_instances(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    SQLiteCache(path).set("a", {"answer": time.time()})
+    assert SQLiteCache(path).get("a")[1] == FRESH
+
+
+def test_answer_reuse_keeps_fingerprints_out_of_the_answer_cache():
+    reuse = AnswerReuse()
+    before = answer_cache.stats()
+    reuse.put("f" * 64, "Sales were up.", "high", "sales_analysis")
+    assert reuse.get("f" * 64)["answer"] == "Sales were up."
+    assert reuse.cache is not answer_cache
+    assert answer_cache.stats() == before
+
+
+def test_blocking_backend_stays_off_the_event_loop(tmp_path, monkeypatch):
+    backend = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(agent_module, "answer_cache", backend)
+    agent = AnalyticsAgent(store_id="blocking-cache.myshopify.com", access_token="token")
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        # Another worker holds the database, as a slow write would
+        backend._lock.acquire()
+        threading.Timer(0.3, backend._lock.release).start()
+        try:
+            assert await agent.get_cached_result_async("What were my sales?") == (None, False)
+        finally:
+            task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) >= 10
+
+
+class GatedModel:
+    """Answers once `release` is set, so a refresh can be held in flight"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        self.release.wait(5)
+        return type("Response", (), {"text": "Fresh answer"})()
+
+    async def generate_content_async(self, prompt):
+        self.calls += 1
+        await asyncio.to_thread(self.release.wait, 5)
+        return type("Response", (), {"text": "Fresh answer"})()
+
+
+def stale_agent(monkeypatch, store_id: str, amount: str, question: str):
+    # A distinct amount per test keeps answer reuse from serving another test's answer
+    orders = {"orders": {"data": {"orders": {"edges": [
+        {"node": {"id": "gid://shopify/Order/1", "createdAt": "2024-05-01T00:00:00Z",
+                  "totalPriceSet": {"shopMoney": {"amount": amount, "currencyCode": "USD"}}}}
+    ]}}}}
+    agent = AnalyticsAgent(store_id=store_id, access_token="token", stateful=False)
+    agent.model = GatedModel()
+
+    async def fetch_async(intent, question=""):
+        return orders
+
+    monkeypatch.setattr(agent, "fetch_relevant_data", lambda intent, question="": orders)
+    monkeypatch.setattr(agent, "fetch_relevant_data_async", fetch_async)
+    answer_cache.set(agent.get_cache_key(question), {"answer": "Old answer", "intent": "sales_analysis"}, ttl=-1)
+    return agent
+
+
+def wait_for_refresh(key: str) -> bool:
+    """Wait until the refresh claim on `key` is released, then take and drop it"""
+    for _ in range(200):
+        if answer_cache.begin_refresh(key):
+            answer_cache.end_refresh(key)
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_stale_hit_is_served_while_one_refresh_runs(monkeypatch):
+    question = "What were my sales for the stale sync refresh?"
+    agent = stale_agent(monkeypatch, "stale-sync.myshopify.com", "41.00", question)
+    key = agent.get_cache_key(question)
+
+    first = agent.process_question(question)
+    # A second stale hit while the refresh is running does not start another
+    second = agent.process_question(question)
+    assert first["answer"] == second["answer"] == "Old answer"
+    assert first["cached"] and second["cached"]
+
+    agent.model.release.set()
+    assert wait_for_refresh(key)
+    result, state = answer_cache.get(key)
+    assert result["answer"] == "Fresh answer" and state == FRESH
+    assert agent.model.calls == 1
+
+
+def test_async_stale_hit_is_served_while_one_refresh_runs(monkeypatch):
+    question = "What were my sales for the stale async refresh?"
+    agent = stale_agent(monkeypatch, "stale-async.myshopify.com", "42.00", question)
+    key = agent.get_cache_key(question)
+
+    async def run():
+        first = await agent.process_question_async(question)
+        second = await agent.process_question_async(question)
+        assert len(agent_module._refresh_tasks) == 1
+        agent.model.release.set()
+        await asyncio.gather(*agent_module._refresh_tasks)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["answer"] == second["answer"] == "Old answer"
+    result, state = answer_cache.get(key)
+    assert result["answer"] == "Fresh answer" and state == FRESH
+    assert agent.model.calls == 1
+    assert wait_for_refresh(key)
@@ -0,0 +1,32 @@
+from canonical import canonicalize, canonical_key, parse_question
+
+
+def key(question):
+    return canonical_key(canonicalize(question, parse_question(question).intent))
+
+
+def test_paraphrases_share_a_key():
+    assert key("top products?") == key("What are my top selling products")
+    assert key("What were my sales last week?") == key("sales in the past week")
+
+
+def test_direction_words_change_the_key():
+    keys = {key("Which products have low stock?"), key("Which products have the most stock?"),
+            key("What is my inventory?")}
+    assert len(keys) == 3
+
+
+def test_trend_and_ranking_change_the_key():
+    keys = {key("What are my sales?"), key("What are my top products?"), key("How are sales trending?")}
+    assert len(keys) == 3
+
+
+def test_recent_changes_the_key():
+    assert key("How many orders did I get?") != key("Show recent orders")
+
+
+def test_parameters_are_parsed():
+    parsed = parse_question("What are my top 5 products in the last 2 weeks?")
+    assert parsed.top_n == 5
+    assert parsed.window_days == 14
+    assert parse_question("How many units of \"Blue Hoodie\" sold?").product == "Blue Hoodie"
@@ -0,0 +1,63 @@
+import asyncio
+from fetch_planner import FetchPlanner, FetchPlan, combine_results, plan_datasets
+
+
+class FakeClient:
+    store_domain = "planner-test.myshopify.com"
+
+    async def get_all_orders(self, days_back=30, max_pages=None, focus=()):
+        return {"data": {"orders": {"edges": []}}}
+
+    async def get_all_products(self, max_pages=None, focus=()):
+        raise asyncio.CancelledError()
+
+    async def get_all_inventory_levels(self, max_pages=None, focus=()):
+        return {"errors": [{"message": "Access denied"}]}
+
+
+def test_plan_datasets_follows_wording():
+    assert plan_datasets("sales_analysis", "What were my sales?") == ("orders",)
+    assert plan_datasets("sales_analysis", "What should I reorder based on sales?") == (
+        "orders", "products", "inventory"
+    )
+
+
+def test_top_products_is_a_sales_question():
+    assert plan_datasets("sales_analysis", "What are my top selling products?") == ("orders",)
+    assert plan_datasets("sales_analysis", "Top products last month") == ("orders",)
+    assert plan_datasets("sales_analysis", "Which variants sold best?") == ("orders", "products")
+
+
+class SyncClient:
+    def __init__(self, store_domain):
+        self.store_domain = store_domain
+
+    def get_all_orders(self, days_back=30, max_pages=None, focus=()):
+        return {"data": {"orders": {"edges": []}}}
+
+    def get_all_products(self, max_pages=None, focus=()):
+        return {"data": {"products": {"edges": []}}}
+
+
+def test_idle_stores_hold_no_semaphores_or_threads():
+    planner = FetchPlanner(threads=2)
+    plan = FetchPlan("general", ("orders", "products"), 30, 1)
+    for number in range(20):
+        assert "orders" in planner.execute(SyncClient(f"store-{number}.myshopify.com"), plan)
+    assert asyncio.run(planner.execute_async(FakeClient(), plan))
+    assert planner.stats()["active_stores"] == 0
+    # Every multi-dataset fetch ran on the one shared pool
+    assert len(planner._pool._threads) <= 2
+
+
+def test_failed_datasets_are_listed_as_unavailable():
+    plan = FetchPlan("general", ("orders", "products", "inventory"), 30, 1)
+    combined = asyncio.run(FetchPlanner().execute_async(FakeClient(), plan))
+    assert "orders" in combined
+    assert set(combined["unavailable"]) == {"products", "inventory"}
+    assert combined["unavailable"]["products"] == "CancelledError"
+
+
+def test_all_failures_return_the_first_error():
+    assert combine_results({"orders": {"error": "down"}, "products": ValueError("bad")}) == {"error": "down"}
+    assert combine_results({"orders": asyncio.CancelledError()}) == {"error": "CancelledError"}
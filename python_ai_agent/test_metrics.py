@@ -0,0 +1,21 @@
+import threading
+from metrics import metrics
+
+
+def test_short_lived_threads_share_a_fixed_set_of_shards():
+    metrics.reset()
+    shards = len(metrics._shards)
+
+    def work():
+        for _ in range(50):
+            metrics.record_request("metrics-test.myshopify.com", True, 12.0, intent="general")
+
+    threads = [threading.Thread(target=work) for _ in range(100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(metrics._shards) == shards
+    assert metrics.get_metrics()["summary"]["total_requests"] == 5000
+    metrics.reset()
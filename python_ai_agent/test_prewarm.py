@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+import prewarm
+from agent import AnalyticsAgent
+from cache import AnswerCache
+from prewarm import Prewarmer
+from sessions import SessionStore
+
+STORE = "prewarm-test.myshopify.com"
+
+
+@pytest.fixture
+def warm(monkeypatch):
+    cache = AnswerCache(ttl=60, stale_ttl=60)
+    sessions = SessionStore()
+    monkeypatch.setattr(prewarm, "answer_cache", cache)
+    monkeypatch.setattr(prewarm, "session_store", sessions)
+    monkeypatch.setattr(prewarm, "PREWARM_CPU_BUDGET", 1000.0)
+    answered_by = []
+
+    async def answer(self, question, context=""):
+        answered_by.append(self)
+        result = {"answer": f"Warm answer to {question}", "intent": "general"}
+        cache.set(self.get_cache_key(question), result)
+        return result
+
+    monkeypatch.setattr(AnalyticsAgent, "_answer_async", answer)
+    prewarmer = Prewarmer()
+    prewarmer.observe(STORE, "token", "key", "What were my sales?")
+    return prewarmer, cache, sessions, answered_by
+
+
+def test_warm_store_uses_the_shared_agent(warm):
+    prewarmer, _, sessions, answered_by = warm
+    assert asyncio.run(prewarmer.warm_store(STORE))
+    assert answered_by
+    shared = sessions.agent_for(STORE, access_token="token")
+    assert all(agent is shared for agent in answered_by)
+    assert sessions.stats()["shared_agents"] == 1
+
+
+def test_warm_up_checks_leave_cache_stats_alone(warm):
+    prewarmer, cache, _, answered_by = warm
+    asyncio.run(prewarmer.warm_store(STORE))
+    warmed = len(answered_by)
+    before = cache.stats()
+    # Everything is warm now: a second pass answers nothing and counts no lookups
+    assert asyncio.run(prewarmer.warm_store(STORE))
+    assert len(answered_by) == warmed
+    after = cache.stats()
+    assert (after["hits"], after["misses"]) == (before["hits"], before["misses"])
+    assert prewarmer.stats()["already_warm"] == warmed
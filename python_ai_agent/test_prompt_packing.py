@@ -0,0 +1,35 @@
+import asyncio
+import threading
+import agent as agent_module
+from agent import AnalyticsAgent
+from prompt_packing import pack_rows, estimate_tokens
+
+ORDERS = {"orders": {"data": {"orders": {"edges": [
+    {"node": {"name": f"#{n}", "createdAt": "2024-05-01T00:00:00Z",
+              "totalPriceSet": {"shopMoney": {"amount": "10.00"}},
+              "lineItems": {"edges": [{"node": {"title": "Mug", "quantity": 1, "variant": {"price": "10.00"}}}]}}}
+    for n in range(50)
+]}}}}
+
+
+def test_pack_rows_keeps_best_rows_within_budget():
+    rows = [(score, [f"item {score}", score]) for score in range(100)]
+    block = pack_rows(["name", "score"], rows, token_budget=60)
+    assert estimate_tokens(block) <= 60
+    assert block.splitlines()[2] == "item 99,99"
+
+
+def test_exact_token_count_runs_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(agent_module, "EXACT_TOKEN_COUNT", True)
+    agent = AnalyticsAgent(store_id="packing-test.myshopify.com", access_token="token")
+    threads = []
+
+    class Model:
+        def count_tokens(self, text):
+            threads.append(threading.current_thread())
+            return type("Count", (), {"total_tokens": estimate_tokens(text)})()
+
+    agent.model = Model()
+    data_slice = asyncio.run(agent._data_slice_async("What were my sales?", ORDERS, "sales_analysis"))
+    assert "Mug" in data_slice[1]
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,74 @@
+import rate_limiter as rate_limiter_module
+import shopify_client
+from rate_limiter import CircuitBreaker, ThrottleBucket, StoreLimiter, DEFAULT_QUERY_COST, rate_limiter
+from shopify_client import ShopifyClient, ORDERS_QUERY
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store
+
+THROTTLE_BODY = {"extensions": {"cost": {
+    "requestedQueryCost": 120,
+    "throttleStatus": {"maximumAvailable": 2000, "currentlyAvailable": 100, "restoreRate": 100}
+}}}
+
+
+def test_bucket_waits_once_reservations_exceed_what_is_available():
+    bucket = ThrottleBucket()
+    bucket.update({"maximumAvailable": 1000, "currentlyAvailable": 100, "restoreRate": 50})
+    assert bucket.reserve(80) == 0.0
+    wait = bucket.reserve(80)
+    assert 1.0 < wait <= 1.2
+
+
+def test_limiter_learns_query_cost_and_bucket_state():
+    limiter = StoreLimiter()
+    assert limiter.estimated_cost("{ orders }") == DEFAULT_QUERY_COST
+    limiter.observe("{ orders }", THROTTLE_BODY)
+    assert limiter.estimated_cost("{ orders }") == 120
+    assert limiter.estimated_cost("{ products }") == DEFAULT_QUERY_COST
+    snapshot = limiter.bucket.snapshot()
+    assert snapshot["maximum_available"] == 2000 and snapshot["restore_rate"] == 100
+
+
+def test_backoff_never_undercuts_retry_after():
+    limiter = StoreLimiter()
+    assert all(limiter.backoff(attempt, retry_after=5.0) >= 5.0 for attempt in range(6))
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert 0 < breaker.retry_after() <= 30
+
+    breaker.opened_at -= 31
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow_request()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.opened_at -= 31
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow_request()
+
+
+def test_client_paces_itself_against_a_small_bucket(monkeypatch):
+    monkeypatch.setattr(rate_limiter_module, "BACKOFF_BASE_SECONDS", 0.01)
+    server = FakeShopifyServer(synthetic_store(orders=60, products=5, days=10), latency_ms=0, jitter_ms=0,
+                               bucket_size=150, restore_rate=1500)
+    monkeypatch.setattr(shopify_client, "SHOPIFY_API_BASE_URL", server.start())
+    try:
+        response = ShopifyClient("limiter-test.myshopify.com", "token").get_all_orders(days_back=30, page_size=10)
+    finally:
+        server.stop()
+    assert "error" not in response
+    assert len(response["data"]["orders"]["edges"]) == 60
+    assert rate_limiter.for_store("limiter-test.myshopify.com").estimated_cost(ORDERS_QUERY) != DEFAULT_QUERY_COST
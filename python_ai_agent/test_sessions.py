@@ -0,0 +1,72 @@
+import pytest
+from agent import AnalyticsAgent
+from sessions import SessionStore
+
+STORE = "sessions-test.myshopify.com"
+ORDERS = {"orders": {"data": {"orders": {"edges": [
+    {"node": {"id": "gid://shopify/Order/1", "createdAt": "2024-05-01T00:00:00Z",
+              "totalPriceSet": {"shopMoney": {"amount": "12.00", "currencyCode": "USD"}}}}
+]}}}}
+
+
+class FakeModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return type("Response", (), {"text": f"answer {len(self.prompts)}"})()
+
+
+@pytest.fixture
+def make_agent(monkeypatch):
+    model = FakeModel()
+
+    def make(store_id, **kwargs):
+        agent = AnalyticsAgent(store_id=store_id, access_token="token", **kwargs)
+        agent.model = model
+        monkeypatch.setattr(agent, "fetch_relevant_data", lambda intent, question="": ORDERS)
+        return agent
+
+    make.model = model
+    return make
+
+
+def test_follow_ups_are_not_shared_between_sessions(make_agent):
+    first, second = make_agent("sessions-a.myshopify.com"), make_agent("sessions-a.myshopify.com")
+    first.process_question("What were my sales?")
+    follow_up = first.process_question("And how many orders did I get?")
+    assert not follow_up["cached"]
+    assert "Previous conversation" in make_agent.model.prompts[-1]
+
+    fresh = second.process_question("And how many orders did I get?")
+    assert not fresh["cached"]
+    assert "Previous conversation" not in make_agent.model.prompts[-1]
+    assert len(make_agent.model.prompts) == 3
+
+
+def test_standalone_questions_in_a_session_use_the_cache(make_agent):
+    first, second = make_agent("sessions-c.myshopify.com"), make_agent("sessions-c.myshopify.com")
+    answer = first.process_question("How many orders did I get?")
+    second.process_question("What were my sales?")
+    # Conversation so far does not matter to a question that does not refer back to it
+    again = second.process_question("How many orders did I get?")
+    assert again["cached"]
+    assert again["answer"] == answer["answer"]
+
+
+def test_turn_is_recorded_once(make_agent):
+    agent = make_agent("sessions-b.myshopify.com")
+    agent.process_question("What were my sales?")
+    agent._refresh("What were my sales?")
+    assert len(agent.conversation_history) == 1
+
+
+def test_requests_without_a_session_share_a_stateless_agent():
+    store = SessionStore()
+    agent = store.agent_for(STORE, access_token="token")
+    assert store.agent_for(STORE, access_token="token") is agent
+    assert store.agent_for(STORE, access_token="other") is not agent
+    assert not agent.stateful
+    agent._remember_turn("What were my sales?", {"answer": "Plenty"})
+    assert len(agent.conversation_history) == 0
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+import shopify_client
+from shopify_client import AsyncShopifyClient, InvalidStoreDomain, store_domain_for
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store
+
+STORE = "client-test.myshopify.com"
+
+
+def test_store_ids_must_be_shopify_domains(monkeypatch):
+    monkeypatch.delenv("SHOPIFY_STORE_URL", raising=False)
+    assert store_domain_for(" Client-Test.myshopify.com ") == STORE
+    for store_id in ("attacker.example.com", "evil.com/x.myshopify.com", "a.myshopify.com.evil.com",
+                     "169.254.169.254", "", None):
+        with pytest.raises(InvalidStoreDomain):
+            store_domain_for(store_id)
+
+
+def test_configured_store_url_wins(monkeypatch):
+    monkeypatch.setenv("SHOPIFY_STORE_URL", "configured.myshopify.com")
+    assert store_domain_for("attacker.example.com") == "configured.myshopify.com"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeShopifyServer(synthetic_store(orders=30, products=5, days=10), latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(shopify_client, "SHOPIFY_API_BASE_URL", server.start())
+    yield server
+    server.stop()
+
+
+def test_async_client_shares_one_pool_per_store(server):
+    async def run():
+        try:
+            first, second = AsyncShopifyClient(STORE, "token"), AsyncShopifyClient(STORE, "token")
+            other = AsyncShopifyClient("other-" + STORE, "token")
+            assert first.http is second.http
+            assert first.http is not other.http
+            orders, products = await asyncio.gather(
+                first.get_all_orders(days_back=30, page_size=10), second.get_all_products(page_size=10)
+            )
+            return orders, products
+        finally:
+            await AsyncShopifyClient.close_all()
+
+    orders, products = asyncio.run(run())
+    assert len(orders["data"]["orders"]["edges"]) == 30
+    assert len(products["data"]["products"]["edges"]) == 5
+    assert AsyncShopifyClient._http_clients == {}
+
+
+def test_async_client_reports_graphql_errors(server):
+    async def run():
+        try:
+            return await AsyncShopifyClient(STORE, "token").get_all_planned(
+                type("Plan", (), {"query": "{ nope }", "connection": "orders", "variables": None})()
+            )
+        finally:
+            await AsyncShopifyClient.close_all()
+
+    assert "error" in asyncio.run(run())
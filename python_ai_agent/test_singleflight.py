@@ -0,0 +1,131 @@
+import time
+import asyncio
+import threading
+import pytest
+from singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", work))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1]
+    assert results == ["result"] * 5
+    assert flight.stats() == {"in_flight": 0, "coalesced": 4}
+
+
+def test_leader_failure_reaches_every_caller_and_is_not_kept():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("shopify down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flight.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["shopify down"] * 2
+    # The next call runs afresh instead of replaying the failure
+    assert flight.do("key", lambda: "recovered") == "recovered"
+
+
+def test_async_concurrent_calls_share_one_task():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert calls == [1]
+    assert flight.stats() == {"in_flight": 0, "coalesced": 4}
+
+
+def test_async_leader_failure_reaches_every_caller():
+    flight = AsyncSingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("shopify down")
+
+    async def run():
+        return await asyncio.gather(flight.do("key", failing), flight.do("key", failing), return_exceptions=True)
+
+    outcomes = asyncio.run(run())
+    assert [str(outcome) for outcome in outcomes] == ["shopify down"] * 2
+    assert not flight.in_flight("key")
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_work():
+    flight = AsyncSingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        # The leader's client disconnects; the follower still gets the answer
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_join_registers_before_returning():
+    flight = AsyncSingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        task, leader = flight.join("key", work)
+        # A caller arriving before the task first runs still finds it
+        same, follower = flight.join("key", work)
+        return leader, follower, same is task, await task
+
+    assert asyncio.run(run()) == (True, False, True, "result")
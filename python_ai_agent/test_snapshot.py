@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import pytest
+import shopify_client
+from shopify_client import AsyncShopifyClient
+from snapshot import SnapshotStore, AsyncSnapshotReader
+from benchmarks.fake_shopify import FakeShopifyServer, synthetic_store
+
+STORE = "snapshot-test.myshopify.com"
+
+
+@pytest.fixture
+def reader(monkeypatch, tmp_path):
+    server = FakeShopifyServer(synthetic_store(orders=30, products=5, days=10), latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(shopify_client, "SHOPIFY_API_BASE_URL", server.start())
+    yield AsyncSnapshotReader(AsyncShopifyClient(STORE, "token"), SnapshotStore(str(tmp_path / "s.sqlite3")))
+    server.stop()
+
+
+async def loaded(reader, dataset: str = "orders"):
+    """Wait for the background first load, as a later request would"""
+    while reader.snapshots.initial_loading(STORE, dataset):
+        await asyncio.sleep(0.01)
+
+
+def test_first_load_runs_in_the_background(reader):
+    async def run():
+        try:
+            first = await reader.get_all_orders(days_back=30)
+            await loaded(reader)
+            second = await reader.get_all_orders(days_back=30)
+            third = await reader.get_all_orders(days_back=30)
+            return first, second, third
+        finally:
+            await AsyncShopifyClient.close_all()
+
+    first, second, third = asyncio.run(run())
+    # The request that found the snapshot empty did not wait for the load
+    assert "pending" in first
+    assert "pending" not in second
+    assert len(second["data"]["orders"]["edges"]) == 30
+    assert second == third
+    assert reader.snapshots.stats()["syncs"] == 1
+
+
+def test_failed_first_load_is_reported(monkeypatch, reader):
+    async def failing(client, dataset):
+        raise shopify_client.ShopifyAPIError("Access denied")
+
+    monkeypatch.setattr(reader.snapshots, "sync_async", failing)
+
+    async def run():
+        try:
+            await reader.get_all_orders(days_back=30)
+            await loaded(reader)
+            return await reader.get_all_orders(days_back=30)
+        finally:
+            await AsyncShopifyClient.close_all()
+
+    assert asyncio.run(run()) == {"error": "Access denied"}
+
+
+def test_busy_snapshot_does_not_block_the_event_loop(reader):
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        # Another thread holds the SQLite lock, as a long upsert would
+        reader.snapshots._lock.acquire()
+        threading.Timer(0.3, reader.snapshots._lock.release).start()
+        try:
+            await reader.get_all_orders(days_back=30)
+            await loaded(reader)
+        finally:
+            task.cancel()
+            await AsyncShopifyClient.close_all()
+        return ticks
+
+    assert asyncio.run(run()) >= 10
@@ -0,0 +1,110 @@
+import json
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi.testclient import TestClient
+import main
+from agent import AnalyticsAgent
+from cache import answer_cache
+
+STORE = "stream-test.myshopify.com"
+CHUNKS = ("Sales ", "were ", "steady.")
+
+
+class StreamingModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+
+        async def chunks():
+            for text in CHUNKS:
+                await asyncio.sleep(0.01)
+                yield SimpleNamespace(text=text)
+
+        return chunks() if stream else SimpleNamespace(text="".join(CHUNKS))
+
+
+@pytest.fixture
+def make_agent(monkeypatch):
+    def make(amount: str):
+        # A distinct amount per test keeps answer reuse from serving another test's answer
+        orders = {"orders": {"data": {"orders": {"edges": [
+            {"node": {"id": "gid://shopify/Order/1", "createdAt": "2024-05-01T00:00:00Z",
+                      "totalPriceSet": {"shopMoney": {"amount": amount, "currencyCode": "USD"}}}}
+        ]}}}}
+        agent = AnalyticsAgent(store_id=STORE, access_token="token", stateful=False)
+        agent.model = StreamingModel()
+
+        async def fetch(intent, question=""):
+            return orders
+
+        monkeypatch.setattr(agent, "fetch_relevant_data_async", fetch)
+        return agent
+
+    return make
+
+
+async def collect(agent, question):
+    return [event async for event in agent.stream_question(question)]
+
+
+def parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_sse_endpoint_streams_tokens(monkeypatch, make_agent):
+    agent = make_agent("31.00")
+    monkeypatch.setattr(main.session_store, "agent_for", lambda *args: agent)
+    monkeypatch.setattr(main, "_observe", lambda *args: None)
+    response = TestClient(main.app).post("/analyze/stream", json={
+        "store_id": STORE, "question": "What were my sales on the stream endpoint?", "access_token": "token"
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event for event, _ in events] == ["meta", "token", "token", "token", "done"]
+    assert events[0][1]["figures"]["orders"]["order_count"] == 1
+    assert "".join(data["text"] for event, data in events if event == "token") == "".join(CHUNKS)
+    assert events[-1][1]["answer"] == "".join(CHUNKS)
+
+
+def test_identical_streams_share_one_model_call(make_agent):
+    agent = make_agent("32.00")
+    question = "What were my sales for coalesced streams?"
+
+    async def run():
+        return await asyncio.gather(collect(agent, question), collect(agent, question))
+
+    first, second = asyncio.run(run())
+    assert agent.model.calls == 1
+    assert first[-1][0] == second[-1][0] == "done"
+    assert first[-1][1]["answer"] == second[-1][1]["answer"] == "".join(CHUNKS)
+    # The stream that joined gets the whole answer as one token
+    assert [event for event, _ in second] == ["meta", "token", "done"]
+
+
+def test_stale_stream_hit_refreshes_in_background(make_agent):
+    agent = make_agent("33.00")
+    question = "What were my sales for the stale stream?"
+    answer_cache.set(agent.get_cache_key(question), {"answer": "Old answer", "intent": "sales_analysis"}, ttl=-1)
+
+    async def run():
+        events = await collect(agent, question)
+        # Give the background refresh time to finish
+        for _ in range(100):
+            if answer_cache.get(agent.get_cache_key(question))[0]["answer"] != "Old answer":
+                break
+            await asyncio.sleep(0.01)
+        return events
+
+    events = asyncio.run(run())
+    assert events[-1][1]["answer"] == "Old answer"
+    assert agent.model.calls == 1
+    assert answer_cache.get(agent.get_cache_key(question))[0]["answer"] == "".join(CHUNKS)
@@ -0,0 +1,58 @@
+import os
+import asyncio
+import threading
+from tracing import SlowRequestProfiler, Trace, start_trace, span, set_attribute
+
+
+def slow_trace(duration_ms: float = 250.0) -> Trace:
+    trace = Trace("/analyze", store_id="tracing-test.myshopify.com")
+    trace.duration_ms = duration_ms
+    return trace
+
+
+def test_spans_land_on_the_current_trace():
+    trace = start_trace("/analyze")
+    with span("fetch_data", dataset="orders"):
+        pass
+    set_attribute("cache", "miss")
+    trace.finish()
+    (recorded,) = trace.spans
+    assert recorded["stage"] == "fetch_data" and recorded["dataset"] == "orders"
+    assert trace.as_dict()["attributes"] == {"cache": "miss"}
+
+
+def test_fast_requests_are_not_dumped(tmp_path):
+    profiler = SlowRequestProfiler(threshold_ms=500, output_dir=str(tmp_path))
+    assert profiler.maybe_dump(slow_trace(100.0)) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_identical_slow_requests_get_separate_files(tmp_path):
+    profiler = SlowRequestProfiler(threshold_ms=100, output_dir=str(tmp_path))
+    first, second = slow_trace(), slow_trace()
+    second.started_at = first.started_at
+    paths = {profiler.maybe_dump(first), profiler.maybe_dump(second)}
+    assert len(paths) == 2
+    assert len(os.listdir(tmp_path)) == 4
+    assert profiler.dumped == 2
+
+
+def test_scheduled_dump_writes_off_the_event_loop(tmp_path):
+    profiler = SlowRequestProfiler(threshold_ms=100, output_dir=str(tmp_path))
+    writers = []
+    write = profiler._write
+
+    def recording(*args):
+        writers.append(threading.get_ident())
+        write(*args)
+
+    profiler._write = recording
+
+    async def run():
+        assert profiler.schedule_dump(slow_trace(50.0)) is None
+        path = await profiler.schedule_dump(slow_trace())
+        return path, threading.get_ident()
+
+    path, loop_thread = asyncio.run(run())
+    assert os.path.exists(path)
+    assert writers and loop_thread not in writers
@@ -0,0 +1,110 @@
+import hmac
+import base64
+import hashlib
+import pytest
+import webhooks
+from cache import answer_cache
+from snapshot import SnapshotStore
+from webhooks import WebhookReceiver, verify_webhook, order_node, utc_timestamp
+
+STORE = "webhook-test.myshopify.com"
+SECRET = "shpss_test"
+ORDER = {
+    "id": 820982911946154500, "name": "#1001", "created_at": "2024-05-01T10:00:00-04:00",
+    "updated_at": "2024-05-01T10:05:00-04:00", "total_price": "25.00", "currency": "USD",
+    "line_items": [{"admin_graphql_api_id": "gid://shopify/LineItem/1", "title": "Mug", "quantity": 2,
+                    "price": "12.50"}]
+}
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def test_verify_webhook():
+    body = b'{"id": 1}'
+    assert verify_webhook(body, sign(body), secret=SECRET)
+    assert not verify_webhook(body + b" ", sign(body), secret=SECRET)
+    assert not verify_webhook(body, sign(body, "other"), secret=SECRET)
+    assert not verify_webhook(body, None, secret=SECRET)
+    # Without a configured secret nothing is trusted
+    assert not verify_webhook(body, sign(body, ""), secret="")
+
+
+def test_order_node_matches_graphql_shape():
+    node = order_node(ORDER)
+    assert node["id"] == "gid://shopify/Order/820982911946154500"
+    assert node["totalPriceSet"]["shopMoney"] == {"amount": "25.00", "currencyCode": "USD"}
+    assert node["lineItems"]["edges"][0]["node"]["variant"]["price"] == "12.50"
+    assert node["createdAt"] == "2024-05-01T14:00:00Z"
+    assert node["updatedAt"] == "2024-05-01T14:05:00Z"
+
+
+def test_utc_timestamp():
+    assert utc_timestamp("2024-05-01T22:30:00+09:00") == "2024-05-01T13:30:00Z"
+    assert utc_timestamp("2024-05-01T13:30:00Z") == "2024-05-01T13:30:00Z"
+    assert utc_timestamp(None) is None
+
+
+@pytest.fixture
+def receiver(monkeypatch, tmp_path):
+    monkeypatch.setattr(webhooks, "snapshot_store", SnapshotStore(str(tmp_path / "snapshot.sqlite3")))
+    monkeypatch.setattr(webhooks, "SNAPSHOT_ENABLED", True)
+    return WebhookReceiver()
+
+
+def cache_answer(receiver, key, datasets):
+    answer_cache.set(key, {"answer": key})
+    receiver.track(STORE, key, datasets)
+
+
+def test_only_dependent_answers_are_invalidated(receiver):
+    cache_answer(receiver, "wh-sales", ["orders"])
+    cache_answer(receiver, "wh-stock", ["products", "inventory"])
+    cache_answer(receiver, "wh-catalog", ["products"])
+
+    result = receiver.handle(STORE, "inventory_levels/update", {"inventory_item_id": 1, "available": 3})
+    assert result == {"status": "ok", "topic": "inventory_levels/update", "invalidated": 2}
+    assert answer_cache.get("wh-sales")[0] == {"answer": "wh-sales"}
+    assert answer_cache.get("wh-stock")[0] is None
+    assert answer_cache.get("wh-catalog")[0] is None
+    assert receiver.covers(STORE) and receiver.answer_ttl(STORE) == webhooks.WEBHOOK_CACHE_TTL
+
+
+def test_order_webhook_is_written_to_the_snapshot(receiver):
+    receiver.handle(STORE, "orders/create", ORDER)
+    (node,) = webhooks.snapshot_store.read(STORE, "orders")
+    assert node["name"] == "#1001"
+
+
+def test_offset_webhook_update_replaces_older_synced_order(receiver):
+    synced = {**order_node(ORDER), "updatedAt": "2024-05-01T13:00:00Z",
+              "totalPriceSet": {"shopMoney": {"amount": "10.00", "currencyCode": "USD"}}}
+    webhooks.snapshot_store.upsert(STORE, "orders", [synced])
+    # 10:05 at -04:00 is 14:05Z, newer than the synced 13:00Z row
+    receiver.handle(STORE, "orders/updated", ORDER)
+    (node,) = webhooks.snapshot_store.read(STORE, "orders", created_since="2024-05-01")
+    assert node["totalPriceSet"]["shopMoney"]["amount"] == "25.00"
+    assert node["updatedAt"] == "2024-05-01T14:05:00Z"
+
+
+def test_delete_webhook_removes_the_record(receiver):
+    receiver.handle(STORE, "orders/create", ORDER)
+    cache_answer(receiver, "wh-deleted-sales", ["orders"])
+    result = receiver.handle(STORE, "orders/delete", {"id": ORDER["id"]})
+    assert result["invalidated"] == 1
+    assert webhooks.snapshot_store.read(STORE, "orders") == []
+
+
+def test_uninstall_forgets_the_store(receiver):
+    receiver.handle(STORE, "orders/create", ORDER)
+    cache_answer(receiver, "wh-uninstalled", ["products"])
+    result = receiver.handle(STORE, "app/uninstalled", {"id": 1})
+    assert result == {"status": "ok", "topic": "app/uninstalled", "invalidated": 1}
+    assert webhooks.snapshot_store.read(STORE, "orders") == []
+    assert not receiver.covers(STORE)
+
+
+def test_unknown_topics_are_ignored(receiver):
+    assert receiver.handle(STORE, "customers/create", {})["status"] == "ignored"
+    assert not receiver.covers(STORE)
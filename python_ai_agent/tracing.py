@@ -0,0 +1,208 @@
+"""
+Tracing Module - Per-stage spans and a slow-request profiler
+Spans time each pipeline stage (intent classification, Shopify fetch,
+aggregation, prompt packing, Gemini call) into per-stage histograms in
+`metrics` and onto the current request's trace. The opt-in sampling
+profiler dumps a flame-graph-ready profile of requests slower than
+PROFILE_SLOW_MS.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque, Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Thread, Event, get_ident
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Profiling is off unless a threshold is configured
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_BUFFER_SAMPLES = int(os.getenv("PROFILE_BUFFER_SAMPLES", 20000))
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans and attributes collected while serving one request"""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def finish(self) -> float:
+        self.duration_ms = self.elapsed_ms()
+        return self.duration_ms
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or self.elapsed_ms(), 2),
+            "attributes": self.attributes,
+            "spans": self.spans
+        }
+
+
+def start_trace(name: str, **attributes) -> Trace:
+    """Begin a trace for the current request context"""
+    trace = Trace(name, **attributes)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def set_attribute(key: str, value):
+    """Attach a value (cache outcome, sizes, ...) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes[key] = value
+
+
+def record_value(name: str, value: float):
+    """Record a size or cost into its distribution and onto the current trace"""
+    if value is None:
+        return
+    metrics.record_value(name, value)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes[name] = trace.attributes.get(name, 0) + value
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Time a pipeline stage; yields a dict for attributes discovered inside it"""
+    trace = _current_trace.get()
+    offset_ms = trace.elapsed_ms() if trace is not None else 0.0
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.record_stage(stage, duration_ms)
+        if trace is not None:
+            trace.spans.append({
+                "stage": stage,
+                "offset_ms": round(offset_ms, 2),
+                "duration_ms": round(duration_ms, 2),
+                **attributes
+            })
+
+
+def _collapse(frame) -> str:
+    """Render a frame chain root-first in the folded-stack format"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """
+    Samples the event-loop thread's stack every PROFILE_INTERVAL_MS into a
+    bounded ring buffer. When a request finishes above the threshold, the
+    samples taken during it are written as folded stacks (input for
+    flamegraph.pl or speedscope) next to a JSON dump of its trace. Samples
+    cover the whole worker, so concurrent requests show up in the same
+    profile; time parked in the selector is time spent awaiting I/O.
+    """
+
+    def __init__(self, threshold_ms: float = PROFILE_SLOW_MS, interval_ms: float = PROFILE_INTERVAL_MS,
+                 output_dir: str = PROFILE_DIR, buffer_samples: int = PROFILE_BUFFER_SAMPLES):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self._samples = deque(maxlen=buffer_samples)
+        self._stop = Event()
+        self._thread = None
+        self._target = None
+        self._dumps = set()
+        self.dumped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def start(self):
+        """Start sampling the calling thread (the event loop thread)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._target = get_ident()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Profiling requests slower than {self.threshold_ms:.0f}ms")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._samples.append((time.time(), _collapse(frame)))
+
+    def _is_slow(self, trace: Trace) -> bool:
+        return self.enabled and trace.duration_ms is not None and trace.duration_ms >= self.threshold_ms
+
+    def maybe_dump(self, trace: Trace):
+        """Write a profile for `trace` if it crossed the slow-request threshold"""
+        if not self._is_slow(trace):
+            return None
+        window_start = trace.started_at
+        window_end = trace.started_at + trace.duration_ms / 1000
+        stacks = Counter(stack for ts, stack in list(self._samples) if window_start <= ts <= window_end)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Unique per dump: slow requests often finish in the same second with the same duration
+        stem = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.started_at))}-{int(trace.duration_ms)}ms"
+            f"-{uuid.uuid4().hex[:8]}"
+        )
+        self._write(stem, stacks, trace)
+        self.dumped += 1
+        logger.warning(f"Slow request ({trace.duration_ms:.0f}ms), profile written to {stem}.folded")
+        return f"{stem}.folded"
+
+    def _write(self, stem: str, stacks: Counter, trace: Trace):
+        with open(f"{stem}.folded", "x") as folded:
+            for stack, count in stacks.most_common():
+                folded.write(f"{stack} {count}\n")
+        with open(f"{stem}.json", "x") as trace_file:
+            json.dump(trace.as_dict(), trace_file, indent=2, default=str)
+
+    def schedule_dump(self, trace: Trace):
+        """
+        maybe_dump from the event loop: the files are written on a worker
+        thread so a slow disk never stalls other requests. Returns the task, if any.
+        """
+        if not self._is_slow(trace):
+            return None
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.maybe_dump, trace))
+        self._dumps.add(task)
+        task.add_done_callback(self._dumps.discard)
+        return task
+
+
+# Singleton instance
+profiler = SlowRequestProfiler()
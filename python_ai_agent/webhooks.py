@@ -0,0 +1,210 @@
+"""
+Webhooks Module - Shopify webhook receiver for targeted invalidation
+Verified orders/products/inventory webhooks are applied straight to the
+local snapshot (deletions included), and only the cached answers that depend
+on the changed dataset for that store are dropped. app/uninstalled forgets
+the store altogether. Stores that deliver webhooks can then
+keep answers far longer than the blind CACHE_TTL.
+"""
+import os
+import hmac
+import base64
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from cache import answer_cache
+from canonical import semantic_index
+from snapshot import snapshot_store, SNAPSHOT_ENABLED
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET", "")
+# Answer TTL for stores whose changes arrive by webhook
+WEBHOOK_CACHE_TTL = int(os.getenv("WEBHOOK_CACHE_TTL", 3600))
+
+TOPIC_DATASETS = {
+    "orders/create": "orders",
+    "orders/updated": "orders",
+    "orders/delete": "orders",
+    "products/update": "products",
+    "products/delete": "products",
+    "inventory_levels/update": "inventory"
+}
+DELETE_TOPICS = {"orders/delete", "products/delete"}
+UNINSTALL_TOPIC = "app/uninstalled"
+
+# Cached answers built from any of these datasets are invalidated by a change to the key
+DEPENDENT_DATASETS = {
+    "orders": {"orders"},
+    "products": {"products"},
+    # Product totals (totalInventory) move with inventory levels
+    "inventory": {"inventory", "products"}
+}
+
+
+def verify_webhook(body: bytes, signature: str, secret: str = None) -> bool:
+    """Check X-Shopify-Hmac-Sha256: base64 HMAC-SHA256 of the raw body under the app secret"""
+    secret = SHOPIFY_WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature.strip())
+
+
+def utc_timestamp(value):
+    """
+    REST timestamps carry the shop's offset ("2024-05-01T10:05:00-04:00");
+    the snapshot compares and buckets GraphQL's UTC form ("2024-05-01T14:05:00Z")
+    as strings, so webhook values are converted to it
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        logger.warning(f"Unparseable webhook timestamp: {value}")
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def record_id(resource: str, payload: dict) -> str:
+    """GraphQL id of a REST payload; delete payloads carry only the numeric id"""
+    return payload.get("admin_graphql_api_id") or f"gid://shopify/{resource}/{payload.get('id')}"
+
+
+def order_node(payload: dict) -> dict:
+    """Webhook (REST) order payload -> the GraphQL node shape the snapshot stores"""
+    money = (payload.get("total_price_set") or {}).get("shop_money") or {}
+    return {
+        "id": record_id("Order", payload),
+        "name": payload.get("name"),
+        "createdAt": utc_timestamp(payload.get("created_at")),
+        "updatedAt": utc_timestamp(payload.get("updated_at")),
+        "totalPriceSet": {"shopMoney": {
+            "amount": money.get("amount", payload.get("total_price")),
+            "currencyCode": money.get("currency_code", payload.get("currency"))
+        }},
+        "lineItems": {"edges": [
+            {"node": {
+                "id": item.get("admin_graphql_api_id"),
+                "title": item.get("title"),
+                "quantity": item.get("quantity"),
+                "variant": {"price": item.get("price")}
+            }}
+            for item in payload.get("line_items") or []
+        ]}
+    }
+
+
+def product_node(payload: dict) -> dict:
+    """Webhook (REST) product payload -> the GraphQL node shape the snapshot stores"""
+    variants = payload.get("variants") or []
+    return {
+        "id": record_id("Product", payload),
+        "title": payload.get("title"),
+        "status": (payload.get("status") or "").upper() or None,
+        "updatedAt": utc_timestamp(payload.get("updated_at")),
+        "totalInventory": sum(variant.get("inventory_quantity") or 0 for variant in variants),
+        "variants": {"edges": [
+            {"node": {
+                "id": variant.get("admin_graphql_api_id"),
+                "title": variant.get("title"),
+                "price": variant.get("price"),
+                "inventoryQuantity": variant.get("inventory_quantity")
+            }}
+            for variant in variants
+        ]}
+    }
+
+
+def dependency_tag(store: str, dataset: str) -> str:
+    return f"{store}|{dataset}"
+
+
+class WebhookReceiver:
+    """
+    Tags each cached answer with the (store, dataset) pairs it was built
+    from, so a webhook drops only the answers it can have changed. Tags live
+    in the cache backend, so invalidation reaches every worker sharing it.
+    """
+
+    def __init__(self):
+        self._subscribed = set()
+        self.received = Counter()
+        self.invalidated = 0
+        self.rejected = 0
+
+    def track(self, store: str, cache_key: str, datasets, ttl: int = None):
+        """Record that `cache_key`'s answer for `store` (cached for `ttl`) was built from `datasets`"""
+        answer_cache.tag(cache_key, [dependency_tag(store, dataset) for dataset in datasets], ttl=ttl)
+
+    def covers(self, store: str) -> bool:
+        """True once a verified webhook has arrived from the store"""
+        return store in self._subscribed
+
+    def answer_ttl(self, store: str):
+        return WEBHOOK_CACHE_TTL if self.covers(store) else None
+
+    def invalidate(self, store: str, dataset: str) -> int:
+        """Drop cached answers for `store` that depend on `dataset`"""
+        affected = DEPENDENT_DATASETS.get(dataset, {dataset})
+        dropped = answer_cache.invalidate_tags([dependency_tag(store, name) for name in sorted(affected)])
+        self.invalidated += dropped
+        return dropped
+
+    def apply(self, store: str, topic: str, dataset: str, payload: dict):
+        """Write the change into the snapshot, or mark it for resync if it cannot be applied"""
+        if not SNAPSHOT_ENABLED:
+            return
+        if topic in DELETE_TOPICS:
+            resource = "Order" if dataset == "orders" else "Product"
+            snapshot_store.delete(store, dataset, [record_id(resource, payload)])
+        elif dataset == "orders":
+            snapshot_store.upsert(store, "orders", [order_node(payload)], advance_watermark=False)
+        elif dataset == "products":
+            snapshot_store.upsert(store, "products", [product_node(payload)], advance_watermark=False)
+        else:
+            # Level payloads carry no product id; resync product totals on next read
+            snapshot_store.mark_stale(store, "products")
+
+    def forget(self, store: str) -> int:
+        """The store uninstalled the app: drop its snapshot, similarity index and cached answers"""
+        if SNAPSHOT_ENABLED:
+            snapshot_store.forget_store(store)
+        semantic_index.forget_store(store)
+        self._subscribed.discard(store)
+        dropped = answer_cache.invalidate_tags([dependency_tag(store, name) for name in sorted(DEPENDENT_DATASETS)])
+        self.invalidated += dropped
+        return dropped
+
+    def handle(self, store: str, topic: str, payload: dict) -> dict:
+        """Process one verified webhook delivery"""
+        if store and topic == UNINSTALL_TOPIC:
+            self.received[topic] += 1
+            invalidated = self.forget(store)
+            logger.info(f"Store {store} uninstalled: snapshot dropped, {invalidated} cached answers invalidated")
+            return {"status": "ok", "topic": topic, "invalidated": invalidated}
+        dataset = TOPIC_DATASETS.get(topic)
+        if not store or dataset is None:
+            return {"status": "ignored", "topic": topic}
+        self._subscribed.add(store)
+        self.received[topic] += 1
+        self.apply(store, topic, dataset, payload)
+        invalidated = self.invalidate(store, dataset)
+        logger.info(f"Webhook {topic} from {store}: {invalidated} cached answers invalidated")
+        return {"status": "ok", "topic": topic, "invalidated": invalidated}
+
+    def stats(self) -> dict:
+        return {
+            "received": dict(self.received),
+            "rejected": self.rejected,
+            "invalidated_answers": self.invalidated,
+            "subscribed_stores": len(self._subscribed)
+        }
+
+
+# Singleton instance
+webhook_receiver = WebhookReceiver()